@@ -0,0 +1,218 @@
+#
+# archive
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import threading
+import calendar
+import bisect
+import itertools
+import struct
+import array
+import mmap
+import time
+import sys
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # Optional, readings are returned as array.array if it is not installed.
+
+# File header: magic, format version and the number of blocks in the index which follows.
+MAGIC = b'VCAR'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+
+# Index entry for each enclosure's block: enclosure id, reading count, first and last timestamps and
+# the offset of the block. A block is the timestamp deltas (uint32) then the temperatures and
+# humidities (int16, hundredths).
+INDEX_ENTRY = struct.Struct('<iIqqQ')
+
+# Values are stored as hundredths, the precision readings are rounded to.
+SCALE = 100
+VALUE_LIMIT = 32767
+
+# Blocks start on a multiple of this so arrays can be mapped directly.
+ALIGNMENT = 8
+
+SUFFIX = '.vca'
+
+
+def month_name(timestamp):
+    """ Name of the file for the month (UTC) a timestamp falls in.
+    """
+    t = time.gmtime(timestamp)
+    return '%04d-%02d' % (t.tm_year, t.tm_mon) + SUFFIX
+
+
+def month_end(timestamp):
+    """ Timestamp of the start of the month (UTC) after the one a timestamp falls in.
+    """
+    t = time.gmtime(timestamp)
+    return calendar.timegm((t.tm_year + t.tm_mon // 12, t.tm_mon % 12 + 1, 1, 0, 0, 0))
+
+
+def to_fixed(value):
+    return min(max(int(round(value * SCALE)), -VALUE_LIMIT), VALUE_LIMIT)
+
+
+def encode(blocks):
+    """ Encode blocks, a dict of enclosure id and sorted (timestamp, temperature, humidity) lists, as a file.
+    """
+    offset = HEADER.size + INDEX_ENTRY.size * len(blocks)
+    index, data = [], []
+    for enclosure_id, readings in sorted(blocks.items()):
+        padding = -offset % ALIGNMENT
+        data.append(b'\0' * padding)
+        offset += padding
+        timestamps = [reading[0] for reading in readings]
+        deltas = array.array('I', (timestamp - timestamps[0] for timestamp in timestamps))
+        temperatures = array.array('h', (to_fixed(reading[1]) for reading in readings))
+        humidities = array.array('h', (to_fixed(reading[2]) for reading in readings))
+        index.append(INDEX_ENTRY.pack(enclosure_id, len(readings), timestamps[0], timestamps[-1], offset))
+        for values in (deltas, temperatures, humidities):
+            if sys.byteorder == 'big':
+                values.byteswap()
+            data.append(values.tobytes())
+            offset += len(data[-1])
+    return HEADER.pack(MAGIC, VERSION, len(blocks)) + b''.join(index) + b''.join(data)
+
+
+class MonthFile:
+    """ One month of archived readings mapped into memory, read through its index.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, num_blocks = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("'" + path + "' is not a version " + str(VERSION) + ' archive.')
+        self.index = {}
+        for number in range(num_blocks):
+            entry = INDEX_ENTRY.unpack_from(self.map, HEADER.size + INDEX_ENTRY.size * number)
+            self.index[entry[0]] = entry[1:]
+
+    def array(self, typecode, offset, count):
+        """ Get count values starting at an offset, as a view on the map where numpy is installed.
+        """
+        if numpy is not None:
+            return numpy.frombuffer(self.map, '<' + typecode, count, offset)
+        values = array.array({'u4': 'I', 'i2': 'h'}[typecode], self.map[offset:offset + count * int(typecode[1])])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+    def block(self, enclosure_id, from_timestamp=None, to_timestamp=None):
+        """ Get an enclosure's readings (optionally only those between two timestamps) as arrays of
+            timestamps, temperatures and humidities, or None if it has none this month.
+        """
+        if enclosure_id not in self.index:
+            return None
+        count, first_timestamp, last_timestamp, offset = self.index[enclosure_id]
+        # The index alone rules out months outside the range.
+        if from_timestamp is not None and from_timestamp > last_timestamp or \
+                to_timestamp is not None and to_timestamp < first_timestamp:
+            return None
+        deltas = self.array('u4', offset, count)
+        # Deltas are sorted so the range can be found before anything is converted.
+        start = 0 if from_timestamp is None else bisect.bisect_left(deltas, from_timestamp - first_timestamp)
+        end = count if to_timestamp is None else bisect.bisect_right(deltas, to_timestamp - first_timestamp)
+        end = max(start, end)
+        temperatures = self.array('i2', offset + 4 * count, count)[start:end]
+        humidities = self.array('i2', offset + 6 * count, count)[start:end]
+        if numpy is not None:
+            return first_timestamp + deltas[start:end].astype(numpy.int64), temperatures / SCALE, humidities / SCALE
+        return (array.array('q', (first_timestamp + delta for delta in deltas[start:end])),
+                array.array('d', (value / SCALE for value in temperatures)),
+                array.array('d', (value / SCALE for value in humidities)))
+
+    def readings(self):
+        """ Get every block as a dict of enclosure id and (timestamp, temperature, humidity) lists.
+        """
+        blocks = {}
+        for enclosure_id in self.index:
+            blocks[enclosure_id] = list(zip(*(values.tolist() for values in self.block(enclosure_id))))
+        return blocks
+
+
+class Archive:
+    """ Readings too old to keep in the database, in a compact file per month. Files are only ever
+        replaced whole so readers can map them without locking against the writer.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def open(self, name):
+        """ Get a month's file, mapping it again if it has been replaced since it was last used.
+        """
+        path = os.path.join(self.path, name)
+        stat = os.stat(path)
+        with self.lock:
+            month = self.files.get(name)
+            if month is None or month.key != (stat.st_mtime_ns, stat.st_size, stat.st_ino):
+                # The old map is closed once nothing refers to it (arrays may still be in use).
+                month = self.files[name] = MonthFile(path)
+            return month
+
+    def months(self, from_timestamp, to_timestamp):
+        """ Names of the files covering a range, in order.
+        """
+        if not os.path.isdir(self.path):
+            return []
+        first, last = month_name(max(from_timestamp, 0)), month_name(max(to_timestamp, 0))
+        return sorted(name for name in os.listdir(self.path) if name.endswith(SUFFIX) and first <= name <= last)
+
+    def add(self, readings):
+        """ Archive readings given as (timestamp, enclosure id, temperature, humidity). Readings already
+            archived with the same timestamp and enclosure are replaced.
+        """
+        months = {}
+        for timestamp, enclosure_id, temperature, humidity in readings:
+            if temperature is None or humidity is None:
+                continue
+            months.setdefault(month_name(timestamp), {}).setdefault(enclosure_id, {})[timestamp] = \
+                (timestamp, temperature, humidity)
+        os.makedirs(self.path, exist_ok=True)
+        for name, added in months.items():
+            path = os.path.join(self.path, name)
+            blocks = MonthFile(path).readings() if os.path.exists(path) else {}
+            for enclosure_id, enclosure_readings in added.items():
+                merged = {reading[0]: reading for reading in blocks.get(enclosure_id, [])}
+                merged.update(enclosure_readings)
+                blocks[enclosure_id] = [merged[timestamp] for timestamp in sorted(merged)]
+            # Write alongside and swap in so a reader never sees a partial file.
+            with open(path + '.tmp', 'wb') as f:
+                f.write(encode(blocks))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+
+    def read(self, enclosure_id, from_timestamp, to_timestamp):
+        """ Get an enclosure's archived readings between two timestamps (inclusive) as arrays of timestamps,
+            temperatures and humidities. These are numpy arrays where it is installed, otherwise array.array.
+        """
+        parts = []
+        for name in self.months(from_timestamp, to_timestamp):
+            block = self.open(name).block(enclosure_id, from_timestamp, to_timestamp)
+            if block is not None and len(block[0]):
+                parts.append(block)
+        if numpy is not None:
+            if not parts:
+                return numpy.empty(0, numpy.int64), numpy.empty(0), numpy.empty(0)
+            return tuple(numpy.concatenate(values) for values in zip(*parts))
+        return (array.array('q', itertools.chain.from_iterable(part[0] for part in parts)),
+                array.array('d', itertools.chain.from_iterable(part[1] for part in parts)),
+                array.array('d', itertools.chain.from_iterable(part[2] for part in parts)))
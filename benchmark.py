@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+
+#
+# benchmark
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import argparse
+import collections
+import asyncio
+import threading
+import tempfile
+import sqlite3
+import hashlib
+import random
+import math
+import json
+import time
+import sys
+import os
+
+DESCRIPTION = """
+Benchmark the web endpoints and daemon jobs against a database seeded with realistic history and
+simulated hardware. Results are written as JSON so they can be compared between versions.
+"""
+
+USERNAME = 'benchmark'
+PASSWORD = 'benchmark'
+DEVICES = ('heat-mat', 'pump', 'fan', 'light')
+
+
+def seed_database(path, days, interval):
+    """ Fill a new database with readings every interval seconds for a number of days.
+    """
+    import database
+    import rollups
+
+    db = database.connect(path)
+    database.migrate(db)
+    c = db.cursor()
+
+    # Daily temperature and humidity cycles with some noise.
+    now = int(time.time())
+    timestamps = range(now - int(days * 86400), now + 1, interval)
+    rows = []
+    for timestamp in timestamps:
+        phase = 2 * math.pi * (timestamp % 86400) / 86400
+        rows.append((timestamp, round(22 + 4 * math.sin(phase) + random.gauss(0, 0.2), 2),
+                     round(65 - 10 * math.sin(phase) + random.gauss(0, 1), 2),
+                     'Heat Mat: Off, Pump: Off, Fan: Off, Light: Off', 0))
+    c.executemany('INSERT OR REPLACE INTO sensor_readings (reading_timestamp, temperature, humidity, comments, '
+                  'enclosure_id) VALUES (?,?,?,?,?)', rows)
+    rollups.backfill(c)
+
+    # The tables the daemon and manage_users.py would create.
+    c.execute('CREATE TABLE IF NOT EXISTS device_states (enclosure_id INTEGER, device TEXT, state NUMERIC)')
+    c.executemany('INSERT INTO device_states VALUES (0,?,?)', [(device, 0) for device in DEVICES])
+    c.execute('CREATE TABLE IF NOT EXISTS flags (flag TEXT, state NUMERIC)')
+    c.executemany('INSERT INTO flags VALUES (?,?)', [('pid', os.getpid())])
+    c.execute('CREATE TABLE IF NOT EXISTS users (username CHARACTER VARYING(20) NOT NULL, '
+              'password CHARACTER(64) NOT NULL, salt CHARACTER(16) NOT NULL)')
+    c.execute('INSERT INTO users VALUES (?,?,?)',
+              (USERNAME, hashlib.sha256((PASSWORD + 'salt').encode('utf-8')).hexdigest(), 'salt'))
+    db.commit()
+    db.close()
+    return len(rows)
+
+
+def summarise(samples):
+    """ Summarise timings in seconds as milliseconds.
+    """
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+
+    def percentile(p):
+        return round(1000 * samples[min(len(samples) - 1, int(p / 100 * len(samples)))], 3)
+
+    return {'count': len(samples), 'mean_ms': round(1000 * sum(samples) / len(samples), 3),
+            'p50_ms': percentile(50), 'p95_ms': percentile(95), 'p99_ms': percentile(99),
+            'max_ms': round(1000 * samples[-1], 3)}
+
+
+def benchmark_web(clients, requests, num_hours):
+    """ Drive the endpoints through the WSGI app with a number of concurrent clients.
+    """
+    import vivarium_ctrl_web
+    # Importing redirects output to the log.
+    sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    app = vivarium_ctrl_web.app
+
+    now = int(time.time())
+    endpoints = collections.OrderedDict([
+        ('Index', lambda i: ('/' + str(num_hours), 'GET', None)),
+        ('Readings', lambda i: ('/api/readings?from=' + str(now - 3600 * num_hours), 'GET', None)),
+        ('Reload', lambda i: ('/reload', 'POST', {'last': str(now - 3600)})),
+        ('Files', lambda i: ('/files/scripts/Chart.js', 'GET', None)),
+        ('ToggleDevice', lambda i: ('/toggle_device', 'POST',
+                                    {'device': 'fan', 'state': 'On' if i % 2 else 'Off'})),
+    ])
+    timings = {name: [] for name in endpoints}
+    sizes = {name: [] for name in endpoints}
+    errors = collections.Counter()
+    lock = threading.Lock()
+
+    def client():
+        # Each client has its own session.
+        response = app.request('/login', method='POST', data={'username': USERNAME, 'password': PASSWORD})
+        headers = {'Cookie': response.headers['Set-Cookie'].split(';')[0]}
+        for i in range(requests):
+            for name, endpoint in endpoints.items():
+                path, method, data = endpoint(i)
+                start = time.perf_counter()
+                response = app.request(path, method=method, data=data, headers=headers)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    timings[name].append(elapsed)
+                    sizes[name].append(len(response.data))
+                    if not response.status.startswith('200'):
+                        errors[name] += 1
+
+    threads = [threading.Thread(target=client) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    results = {'clients': clients, 'requests_per_client': requests, 'num_hours': num_hours,
+               'elapsed_s': round(elapsed, 3), 'endpoints': {}}
+    for name in endpoints:
+        results['endpoints'][name] = summarise(timings[name])
+        results['endpoints'][name]['errors'] = errors[name]
+        results['endpoints'][name]['mean_bytes'] = round(sum(sizes[name]) / len(sizes[name]))
+    return results
+
+
+def benchmark_jobs(duration, interval, toggles):
+    """ Run the daemon's jobs against simulated hardware for a duration with every interval
+        shortened, using the scheduler's timings for each job and timing how long toggles take
+        to be applied.
+    """
+    import vivarium_ctrl
+    import constants
+    import hardware
+    from device_store import DeviceStore
+    from command_socket import CommandServer
+    sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+
+    # Everything manual so only the toggles below switch devices.
+    vivarium_ctrl.settings = None
+    vivarium_ctrl.load_settings()
+    vivarium_ctrl.apply_settings(dict(vivarium_ctrl.settings, **{'update-frequency': interval, 'heat-mat-auto': False,
+                                                                 'pump-auto': False, 'fan-auto': False,
+                                                                 'light-auto': False}))
+    constants.CONTROL_INTERVAL = interval
+    constants.SAMPLE_INTERVAL = interval
+    constants.DEVICE_AND_SETTINGS_INTERVAL = interval
+    vivarium_ctrl.hardware_backend = hardware.SimulatedBackend()
+    vivarium_ctrl.devices = DeviceStore((0, device) for device in DEVICES)
+    # Started and stopped by run as in the daemon, the socket is in the throwaway directory.
+    vivarium_ctrl.command_server = CommandServer({'toggle': vivarium_ctrl.command_toggle})
+
+    # The event loop runs in its own thread while the toggles are made from this one.
+    thread = threading.Thread(target=asyncio.run, args=(vivarium_ctrl.run(),), name='Event Loop Thread')
+    thread.start()
+    while not hasattr(vivarium_ctrl, 'scheduler') or vivarium_ctrl.scheduler.stopping is None:
+        time.sleep(0.01)
+
+    # Time from setting a state to the socket being switched.
+    actuation = []
+    begin = time.perf_counter()
+    for i in range(toggles):
+        start = time.perf_counter()
+        vivarium_ctrl.command_toggle('fan', (i + 1) % 2)
+        actuation.append(time.perf_counter() - start)
+        time.sleep(duration / max(toggles, 1))
+    time.sleep(max(0, duration - (time.perf_counter() - begin)))
+
+    vivarium_ctrl.stop()
+    thread.join()
+
+    results = {'duration_s': duration, 'interval_s': interval, 'actuation': summarise(actuation), 'jobs': {}}
+    for job in vivarium_ctrl.scheduler.jobs:
+        results['jobs'][job.name] = {'busy': summarise(job.busy), 'jitter': summarise(job.jitter),
+                                     'skipped': job.skipped}
+    return results
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument('--days', type=float, default=7, help='days of history to seed (default 7)')
+    parser.add_argument('--interval', type=int, default=120, help='seconds between seeded readings (default 120)')
+    parser.add_argument('--clients', type=int, default=4, help='concurrent web clients (default 4)')
+    parser.add_argument('--requests', type=int, default=20, help='requests per endpoint per client (default 20)')
+    parser.add_argument('--hours', type=int, default=168, help='hours of readings the dashboard loads (default 168)')
+    parser.add_argument('--loop-duration', type=float, default=10, help='seconds to run the jobs (default 10)')
+    parser.add_argument('--loop-interval', type=float, default=0.1, help='seconds between job runs '
+                                                                         '(default 0.1)')
+    parser.add_argument('--toggles', type=int, default=20, help='device toggles while the jobs run (default 20)')
+    parser.add_argument('--output', help='file to write the JSON results to (default stdout)')
+    options = parser.parse_args(args[1:])
+
+    # Everything runs in a throwaway directory, set before anything is imported so no file (or command
+    # socket) of an installation is touched. The settings are the defaults.
+    directory = tempfile.mkdtemp(prefix='vivarium_benchmark_')
+    os.environ['VIVARIUM_DATA'] = directory
+    os.environ['VIVARIUM_DB'] = os.path.join(directory, 'vivarium_ctrl.db')
+    os.environ['VIVARIUM_ARCHIVE'] = os.path.join(directory, 'archive')
+    os.environ.setdefault('VIVARIUM_HARDWARE', 'simulated')
+    with open(os.path.join(directory, 'settings.json'), 'wt') as f:
+        json.dump({}, f)
+
+    start = time.perf_counter()
+    rows = seed_database(os.environ['VIVARIUM_DB'], options.days, options.interval)
+    results = {'timestamp': int(time.time()),
+               'python': sys.version.split()[0],
+               'sqlite': sqlite3.sqlite_version,
+               'seed': {'days': options.days, 'interval_s': options.interval, 'rows': rows,
+                        'db_bytes': os.path.getsize(os.environ['VIVARIUM_DB']),
+                        'elapsed_s': round(time.perf_counter() - start, 3)}}
+    results['web'] = benchmark_web(options.clients, options.requests, options.hours)
+    results['daemon'] = benchmark_jobs(options.loop_duration, options.loop_interval, options.toggles)
+
+    output = json.dumps(results, indent=4)
+    if options.output:
+        with open(options.output, 'wt') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,181 @@
+#
+# camera
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import threading
+import base64
+import io
+import metrics
+
+# A plain 64x48 JPEG for testing without a camera.
+TEST_PATTERN = base64.b64decode(
+    '/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABALDA4MChAODQ4SERATGCgaGBYWGDEjJR0oOjM9PDkzODdASFxOQERXRTc4UG1RV19iZ2hnPk1xeX'
+    'BkeFxlZ2P/2wBDARESEhgVGC8aGi9jQjhCY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2P/wAARCAAw'
+    'AEADASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhBy'
+    'JxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKT'
+    'lJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAA'
+    'AAAAECAwQFBgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYkNOEl8RcYGRom'
+    'JygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExc'
+    'bHyMnK0tPU1dbX2Nna4uPk5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwDBooornOUKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiii'
+    'gAooooAKKKKACiiigD//2Q=='
+)
+
+
+CAMERA_FRAMES = metrics.Counter('camera_frames_total', 'Frames captured from the camera.')
+STREAM_VIEWERS = metrics.Gauge('stream_viewers', 'Viewers of the camera stream.')
+
+
+class FrameOutput:
+    """ File-like output for picamera splitting an MJPEG recording into frames.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.buffer = io.BytesIO()
+
+    def write(self, buf):
+        if buf.startswith(b'\xff\xd8'):
+            # Start of a new frame so the last one is complete.
+            frame = self.buffer.getvalue()
+            if frame:
+                self.callback(frame)
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        return self.buffer.write(buf)
+
+    def flush(self):
+        pass
+
+
+class PiCameraSource:
+    """ Frames from the Raspberry Pi camera using its hardware MJPEG encoder.
+    """
+
+    def __init__(self, resolution, framerate, vflip=False):
+        self.resolution = resolution
+        self.framerate = framerate
+        self.vflip = vflip
+        self.camera = None
+
+    def start(self, callback):
+        # Only needed when actually streaming, so the web app can start without it.
+        import picamera
+        self.camera = picamera.PiCamera(resolution=self.resolution, framerate=self.framerate)
+        self.camera.vflip = self.vflip
+        self.camera.start_recording(FrameOutput(callback), format='mjpeg')
+
+    def stop(self):
+        if self.camera:
+            try:
+                self.camera.stop_recording()
+            finally:
+                self.camera.close()
+                self.camera = None
+
+
+class FakeCameraSource:
+    """ Cycles through a set of JPEG frames at a fixed rate, for testing without a camera.
+    """
+
+    def __init__(self, frames=(TEST_PATTERN,), framerate=2):
+        self.frames = frames
+        self.framerate = framerate
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self, callback):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, args=(callback,), name='Fake Camera Thread', daemon=True)
+        self.thread.start()
+
+    def run(self, callback):
+        i = 0
+        while not self.stopped.is_set():
+            callback(self.frames[i % len(self.frames)])
+            i += 1
+            self.stopped.wait(1 / self.framerate)
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+
+class CameraBroadcaster:
+    """ A single thread owns the camera and publishes the latest frame to every viewer. The camera
+        is started by the first viewer and stopped when the last one leaves. Source factory is
+        called to get a new source each time the camera is started.
+    """
+
+    def __init__(self, source_factory):
+        self.source_factory = source_factory
+        self.condition = threading.Condition()
+        # Held for the lifetime of a source so a restart waits for the last one to close.
+        self.source_lock = threading.Lock()
+        self.viewers = 0
+        self.closed = False
+        self.thread = None
+        self.frame = None
+        self.frame_number = 0
+        STREAM_VIEWERS.set(0)
+
+    def add_viewer(self):
+        with self.condition:
+            self.viewers += 1
+            STREAM_VIEWERS.set(self.viewers)
+            if self.thread is None and not self.closed:
+                self.thread = threading.Thread(target=self.run, name='Camera Thread', daemon=True)
+                self.thread.start()
+
+    def remove_viewer(self):
+        with self.condition:
+            self.viewers -= 1
+            STREAM_VIEWERS.set(self.viewers)
+            self.condition.notify_all()
+
+    def close(self):
+        """ Stop the camera and end every viewer's stream, for shutting down.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def publish(self, frame):
+        with self.condition:
+            self.frame = frame
+            self.frame_number += 1
+            CAMERA_FRAMES.inc()
+            self.condition.notify_all()
+
+    def wait_frame(self, last_number, timeout):
+        """ Wait for a frame newer than the last one seen. Slow viewers skip straight to the newest.
+            Returns the frame number and frame, the frame is None if the camera stopped or stalled.
+        """
+        with self.condition:
+            ready = self.condition.wait_for(lambda: self.closed or self.thread is None or
+                                            (self.frame is not None and self.frame_number != last_number), timeout)
+            if not ready or self.closed or self.thread is None:
+                return last_number, None
+            return self.frame_number, self.frame
+
+    def run(self):
+        with self.source_lock:
+            source = self.source_factory()
+            try:
+                source.start(self.publish)
+                with self.condition:
+                    self.condition.wait_for(lambda: self.viewers <= 0 or self.closed)
+            finally:
+                # Detach before stopping the source so a new viewer starts a fresh thread.
+                with self.condition:
+                    self.thread = None
+                    self.frame = None
+                    self.condition.notify_all()
+                source.stop()
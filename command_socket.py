@@ -0,0 +1,84 @@
+#
+# command_socket
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import socket
+import socketserver
+import threading
+import json
+import os
+import paths
+
+SOCKET_PATH = paths.data_path('vivarium_ctrl.sock')
+
+# Seconds the client waits for the daemon to reply.
+TIMEOUT = 5
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """ Handle one JSON command per line, replying with one JSON response per line.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                handler = self.server.handlers.get(message.pop('command', None))
+                if handler is None:
+                    response = {'ok': False, 'error': 'Unknown command.'}
+                else:
+                    response = handler(**message)
+                    response.setdefault('ok', True)
+            except (ValueError, TypeError, KeyError, RuntimeError) as e:
+                # A RuntimeError is a command which came in as the daemon was stopping.
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class CommandServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Serve commands from the web app over a Unix domain socket. Handlers are functions taking
+        the message fields as keyword arguments and returning a dict to reply with.
+    """
+    daemon_threads = True
+
+    def __init__(self, handlers, path=SOCKET_PATH):
+        self.handlers = handlers
+        # Remove a socket left behind by an unclean shutdown.
+        if os.path.exists(path):
+            os.remove(path)
+        socketserver.UnixStreamServer.__init__(self, path, CommandHandler)
+        os.chmod(path, 0o660)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='Command Socket Thread')
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def send_command(command, path=SOCKET_PATH, timeout=TIMEOUT, **fields):
+    """ Send a command to the daemon and return its response. Raises OSError if the daemon
+        cannot be reached (not running or too slow to reply).
+    """
+    fields['command'] = command
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall(json.dumps(fields).encode('utf-8') + b'\n')
+        with s.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionResetError('No response from the daemon.')
+    return json.loads(line)
@@ -9,12 +9,93 @@
 # http://opensource.org/licenses/MIT
 #
 
-# Sleep intervals.
+# Job intervals.
 DEVICE_AND_SETTINGS_INTERVAL = 1
-SCHEDULER_INTERVAL = 10
+CONTROL_INTERVAL = 5
+RETENTION_INTERVAL = 3600
 
-# Socket numbers for devices (Energenie module only supports 4).
+# Seconds between sensor samples and samples kept in memory for each enclosure (an hour).
+SAMPLE_INTERVAL = 1
+SAMPLE_BUFFER_SIZE = 3600
+
+# Seconds of samples the rolling mean, minimum, maximum and rate of change are over and the half life in seconds of the
+# smoothed (exponentially weighted) values.
+STATS_WINDOW = 3600
+STATS_HALF_LIFE = 60
+
+# Threads for blocking I2C, RF and db calls made by the daemon's jobs.
+EXECUTOR_WORKERS = 2
+
+# Default hysteresis (°C and %) and seconds a device stays on or off for automatic control.
+TEMPERATURE_HYSTERESIS = 0.5
+HUMIDITY_HYSTERESIS = 2.0
+MINIMUM_DWELL = 60
+
+# Seconds a command waits for a device to be switched.
+ACTUATION_TIMEOUT = 5
+
+# Maximum readings deleted per transaction when pruning.
+RETENTION_CHUNK_SIZE = 500
+
+# Approximate number of points to show on a chart before switching to rollups.
+MAX_CHART_POINTS = 500
+MIN_CHART_POINTS = 10
+
+# Seconds between keepalive comments on the events stream and checks for changes.
+EVENTS_KEEPALIVE_INTERVAL = 15
+EVENTS_CHECK_INTERVAL = 1
+
+# Number of readings to show in the table on the index page.
+TABLE_PAGE_SIZE = 50
+
+# Default socket numbers for devices (Energenie module only supports 4).
 HEAT_MAT_SOCKET = 1
 PUMP_SOCKET = 2
 FAN_SOCKET = 3
 LIGHT_SOCKET = 4
+
+# Default I2C address of the BME280 sensor.
+SENSOR_ADDRESS = 0x77
+
+# Most sessions kept (least recently used are dropped first) and whether they are kept in a database to survive
+# restarts.
+MAX_SESSIONS = 100
+PERSIST_SESSIONS = True
+
+# Seconds between recording in the database that a session is still in use.
+SESSION_TOUCH_INTERVAL = 60
+
+# Metric names are prefixed by the process they are from as both are served from the web app.
+DAEMON_METRICS_PREFIX = 'vivarium_ctrl_'
+WEB_METRICS_PREFIX = 'vivarium_ctrl_web_'
+
+# Seconds between stack samples when profiling and the longest a profile can run.
+PROFILE_INTERVAL = 0.01
+MAX_PROFILE_SECONDS = 300
+
+# Seconds between checks for changes to static files.
+STATIC_CHECK_INTERVAL = 2
+
+# Camera stream settings and seconds to wait for a frame before giving up.
+CAMERA_RESOLUTION = (1280, 960)
+CAMERA_FRAMERATE = 2
+CAMERA_TIMEOUT = 10
+
+# Most log records waiting to be written before more are dropped and most written between flushes.
+LOG_QUEUE_SIZE = 1000
+LOG_BATCH_SIZE = 100
+
+# Seconds a regular request waits for a free slot before being refused, seconds an idle keep-alive connection is
+# kept open, most idle keep-alive connections kept and seconds to wait for requests to finish when stopping.
+WEB_REQUEST_WAIT = 5
+WEB_TIMEOUT = 10
+WEB_KEEP_ALIVE_CONNECTIONS = 20
+WEB_SHUTDOWN_TIMEOUT = 5
+
+# Time-lapse frames kept (most index entries and bytes of frames, whichever runs out first), frames to let the camera
+# settle before taking one, frames per second when played back and hours played back by default.
+TIMELAPSE_INDEX_SLOTS = 4096
+TIMELAPSE_DATA_SIZE = 64 * 1024 * 1024
+TIMELAPSE_WARMUP_FRAMES = 4
+TIMELAPSE_PLAYBACK_FPS = 10
+TIMELAPSE_PLAYBACK_HOURS = 24
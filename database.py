@@ -0,0 +1,241 @@
+#
+# database
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import threading
+import sqlite3
+import time
+import os
+import rollups
+import samples
+import metrics
+import paths
+
+# Can be overridden to run against another database (e.g. for benchmarks).
+DB_PATH = os.environ.get('VIVARIUM_DB', paths.data_path('vivarium_ctrl.db'))
+
+# Readings older than the days to keep are moved here, next to the database by default.
+ARCHIVE_PATH = os.environ.get('VIVARIUM_ARCHIVE', os.path.join(os.path.dirname(DB_PATH), 'archive'))
+
+# Statements are labelled by their text (without values) cut to this length.
+STATEMENT_NAME_LENGTH = 100
+
+SQL_SECONDS = metrics.Histogram('sql_statement_seconds', 'Time taken to execute each SQL statement.', ('statement',))
+
+# Statements run by a thread while it is recording them (to log with slow requests).
+recording = threading.local()
+
+# Expression to present an epoch timestamp as a local date and time string.
+READING_DATETIME = "datetime(reading_timestamp, 'unixepoch', 'localtime') AS reading_datetime"
+
+
+def statement_name(sql):
+    # Values are bound rather than written in so there are only as many names as statements in the code.
+    return ' '.join(sql.split())[:STATEMENT_NAME_LENGTH]
+
+
+def start_recording():
+    """ Start recording the statements run by this thread and how long each took.
+    """
+    recording.statements = []
+
+
+def recorded_statements():
+    return getattr(recording, 'statements', None) or []
+
+
+def stop_recording():
+    """ Stop recording and get the statements run as (statement, seconds).
+    """
+    statements = recorded_statements()
+    recording.statements = None
+    return statements
+
+
+def observe_statement(sql, seconds):
+    SQL_SECONDS.observe(seconds, statement_name(sql))
+    if getattr(recording, 'statements', None) is not None:
+        recording.statements.append((' '.join(sql.split()), seconds))
+
+
+class TimedCursor(sqlite3.Cursor):
+    """ A cursor recording how long each statement takes to execute (up to the first row).
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.execute(self, sql, parameters)
+        finally:
+            observe_statement(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.executemany(self, sql, seq_of_parameters)
+        finally:
+            observe_statement(sql, time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """ A connection whose cursors, including those behind its own execute methods, are timed.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class ReadOnlyConnection(TimedConnection):
+    """ A timed connection which cannot write, for readers such as the web app.
+    """
+
+    def __init__(self, *args, **kwargs):
+        TimedConnection.__init__(self, *args, **kwargs)
+        sqlite3.Connection.execute(self, 'PRAGMA query_only=ON')
+
+
+def connect(path=DB_PATH, **kwargs):
+    """ Open a connection with the pragmas every connection should use.
+    """
+    db = sqlite3.connect(path, factory=TimedConnection, **kwargs)
+    # WAL only needs to fsync on checkpoint so NORMAL is still safe.
+    db.execute('PRAGMA synchronous=NORMAL')
+    return db
+
+
+def last_modified(path=DB_PATH):
+    """ Get the last modified time of the database including its write-ahead log.
+    """
+    mtime = os.path.getmtime(path)
+    if os.path.exists(path + '-wal'):
+        mtime = max(mtime, os.path.getmtime(path + '-wal'))
+    return mtime
+
+
+def table_columns(c, table):
+    """ Get the column names of a table (empty if it does not exist).
+    """
+    return [column[1] for column in c.execute('PRAGMA table_info(' + table + ')')]
+
+
+def create_sensor_readings(c):
+    """ Create the readings table. Keyed by time first so pruning and ranges across enclosures stay cheap.
+    """
+    c.execute('CREATE TABLE IF NOT EXISTS sensor_readings (reading_timestamp INTEGER, temperature REAL, '
+              'humidity REAL, comments TEXT, enclosure_id INTEGER NOT NULL DEFAULT 0, '
+              'PRIMARY KEY (reading_timestamp, enclosure_id)) WITHOUT ROWID')
+
+
+def migrate_sensor_readings(c):
+    """ Version 1: Index readings by an integer epoch timestamp with typed values.
+    """
+    columns = table_columns(c, 'sensor_readings')
+    if columns and 'reading_datetime' in columns:
+        c.execute('ALTER TABLE sensor_readings RENAME TO sensor_readings_old')
+    c.execute('CREATE TABLE IF NOT EXISTS sensor_readings (reading_timestamp INTEGER PRIMARY KEY, '
+              'temperature REAL, humidity REAL, comments TEXT)')
+    if columns and 'reading_datetime' in columns:
+        # Old datetimes were stored as local time so convert them back to UTC.
+        c.execute("INSERT OR IGNORE INTO sensor_readings SELECT "
+                  "CAST(strftime('%s', reading_datetime, 'utc') AS INTEGER), CAST(temperature AS REAL), "
+                  "CAST(humidity AS REAL), comments FROM sensor_readings_old WHERE reading_datetime IS NOT NULL")
+        c.execute('DROP TABLE sensor_readings_old')
+
+
+def migrate_sensor_rollups(c):
+    """ Version 2: Add per-minute, per-hour and per-day rollups, built from existing readings by version 4.
+    """
+    # As the table was at this version, it is rebuilt with an enclosure column by version 3.
+    c.execute('CREATE TABLE IF NOT EXISTS sensor_rollups (resolution INTEGER, bucket_timestamp INTEGER, '
+              'count INTEGER, temperature_sum REAL, temperature_min REAL, temperature_max REAL, '
+              'humidity_sum REAL, humidity_min REAL, humidity_max REAL, '
+              'PRIMARY KEY (resolution, bucket_timestamp)) WITHOUT ROWID')
+
+
+def migrate_enclosures(c):
+    """ Version 3: Tag readings and rollups with the enclosure they are from, existing ones are enclosure 0.
+    """
+    c.execute('ALTER TABLE sensor_readings RENAME TO sensor_readings_old')
+    c.execute('ALTER TABLE sensor_rollups RENAME TO sensor_rollups_old')
+    create_sensor_readings(c)
+    rollups.create_table(c)
+    c.execute('INSERT INTO sensor_readings SELECT reading_timestamp, temperature, humidity, comments, 0 '
+              'FROM sensor_readings_old')
+    c.execute('INSERT INTO sensor_rollups SELECT resolution, bucket_timestamp, count, temperature_sum, '
+              'temperature_min, temperature_max, humidity_sum, humidity_min, humidity_max, 0 '
+              'FROM sensor_rollups_old')
+    c.execute('DROP TABLE sensor_readings_old')
+    c.execute('DROP TABLE sensor_rollups_old')
+
+
+def migrate_sample_aggregates(c):
+    """ Version 4: Readings are the mean of many samples so also keep how many and their range.
+    """
+    for column in ('sample_count INTEGER', 'temperature_min REAL', 'temperature_max REAL', 'humidity_min REAL',
+                   'humidity_max REAL'):
+        c.execute('ALTER TABLE sensor_readings ADD COLUMN ' + column)
+    # The readings now have every column the rollups are built from. Rollups kept since an earlier
+    # version are left alone as they may cover readings which have since been pruned.
+    if c.execute('SELECT 1 FROM sensor_rollups LIMIT 1').fetchone() is None:
+        rollups.backfill(c)
+
+
+def migrate_rolling_stats(c):
+    """ Version 5: Keep the rolling statistics of each value as they were when the reading was written.
+    """
+    for column in samples.STATS_COLUMNS:
+        c.execute('ALTER TABLE sensor_readings ADD COLUMN ' + column + ' REAL')
+
+
+# Migrations in order, the index + 1 is the schema version once applied.
+MIGRATIONS = [
+    migrate_sensor_readings,
+    migrate_sensor_rollups,
+    migrate_enclosures,
+    migrate_sample_aggregates,
+    migrate_rolling_stats,
+]
+
+
+def migrate(db):
+    """ Bring the database schema up to date applying each outstanding migration once.
+    """
+    c = db.cursor()
+    # WAL lets the web app read while the daemon writes. The mode persists in the file.
+    c.execute('PRAGMA journal_mode=WAL')
+    version = c.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            c.execute('BEGIN')
+            migration(c)
+            c.execute('PRAGMA user_version=' + str(number))
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            raise
+    enable_incremental_vacuum(db)
+    return version, len(MIGRATIONS)
+
+
+def enable_incremental_vacuum(db):
+    """ Switch to incremental auto vacuum so retention can release free pages a few at a time. This
+        only takes effect after a full vacuum, which rewrites the file and cannot be in a transaction,
+        so it is done once here before anything else is using the database.
+    """
+    c = db.cursor()
+    if c.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        c.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        c.execute('VACUUM')
@@ -0,0 +1,74 @@
+#
+# device_store
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import threading
+
+
+def to_string(value):
+    """ Convert a boolean to on/off as a string.
+    """
+    if value:
+        return "On"
+    else:
+        return "Off"
+
+
+class DeviceStore:
+    """ Device states shared between the control threads. Listeners are called with the device
+        and its new state whenever a state actually changes. The states last applied to the
+        hardware are tracked separately so callers can wait for a change to take effect.
+    """
+
+    def __init__(self, devices):
+        self.lock = threading.Lock()
+        self.applied_condition = threading.Condition(self.lock)
+        self.states = {device: False for device in devices}
+        self.applied = dict(self.states)
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def get(self, device):
+        with self.lock:
+            return self.states[device]
+
+    def snapshot(self):
+        """ Get a copy of all the states.
+        """
+        with self.lock:
+            return dict(self.states)
+
+    def set(self, device, state):
+        """ Set a state, returning True if it changed.
+        """
+        state = bool(state)
+        with self.lock:
+            if self.states[device] == state:
+                return False
+            self.states[device] = state
+        # Notify outside the lock so listeners can read the store.
+        for listener in self.listeners:
+            listener(device, state)
+        return True
+
+    def mark_applied(self, device, state):
+        """ Record the state a device was actually switched to.
+        """
+        with self.applied_condition:
+            self.applied[device] = bool(state)
+            self.applied_condition.notify_all()
+
+    def wait_applied(self, device, state, timeout):
+        """ Wait for a device to be switched to a state, returning False if it was not in time.
+        """
+        with self.applied_condition:
+            return self.applied_condition.wait_for(lambda: self.applied[device] == bool(state), timeout)
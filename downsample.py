@@ -0,0 +1,50 @@
+#
+# downsample
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+
+def lttb(x, y, threshold):
+    """ Largest-Triangle-Three-Buckets. Choose the indices of up to threshold points which best keep
+        the visual shape of a series. See Steinarsson, Downsampling Time Series for Visual Representation.
+    """
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return list(range(length))
+    # First and last points are always kept, the rest are split into buckets.
+    every = (length - 2) / (threshold - 2)
+    indices = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third point of the triangle.
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, length)
+        avg_x = sum(x[avg_start:avg_end]) / (avg_end - avg_start)
+        avg_y = sum(y[avg_start:avg_end]) / (avg_end - avg_start)
+        # Pick the point in this bucket making the largest triangle with the last chosen point.
+        max_area, next_a = -1, a
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a]))
+            if area > max_area:
+                max_area, next_a = area, j
+        indices.append(next_a)
+        a = next_a
+    indices.append(length - 1)
+    return indices
+
+
+def downsample(timestamps, temperatures, humidities, max_points):
+    """ Downsample parallel reading arrays to at most max points keeping the shape of both series.
+    """
+    if len(timestamps) <= max_points:
+        return timestamps, temperatures, humidities
+    # Half the points for each series then merge the chosen indices so the arrays stay parallel.
+    indices = sorted(set(lttb(timestamps, temperatures, max_points // 2)) |
+                     set(lttb(timestamps, humidities, max_points // 2)))
+    return [timestamps[i] for i in indices], [temperatures[i] for i in indices], [humidities[i] for i in indices]
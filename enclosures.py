@@ -0,0 +1,62 @@
+#
+# enclosures
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import constants
+
+# Sockets for each device when an enclosure does not give its own.
+DEFAULT_SOCKETS = {'heat-mat': constants.HEAT_MAT_SOCKET,
+                   'pump': constants.PUMP_SOCKET,
+                   'fan': constants.FAN_SOCKET,
+                   'light': constants.LIGHT_SOCKET}
+
+# Keys describing the hardware of an enclosure, any others override the top level settings.
+HARDWARE_KEYS = ('id', 'name', 'sensor-address', 'i2c-channel', 'sockets')
+
+
+class Enclosure:
+    """ One vivarium: the address of its sensor (and multiplexer channel if there is one), the
+        sockets for its devices and its own thresholds and schedule.
+    """
+
+    def __init__(self, enclosure_id, name, sensor_address, i2c_channel, sockets, settings):
+        self.id = enclosure_id
+        self.name = name
+        self.sensor_address = sensor_address
+        self.i2c_channel = i2c_channel
+        self.sockets = sockets
+        self.settings = settings
+
+    @property
+    def devices(self):
+        return list(self.sockets)
+
+
+def from_settings(settings):
+    """ Get the enclosures defined in the settings. Without any there is a single enclosure (0)
+        using the default sensor address, the default sockets and the top level settings.
+    """
+    defaults = {key: value for key, value in settings.items() if key != 'enclosures'}
+    enclosures = []
+    for number, definition in enumerate(settings.get('enclosures') or [{}]):
+        enclosure_settings = dict(defaults)
+        enclosure_settings.update({key: value for key, value in definition.items() if key not in HARDWARE_KEYS})
+        # Addresses may be written in hex as a string.
+        address = definition.get('sensor-address', constants.SENSOR_ADDRESS)
+        enclosures.append(Enclosure(int(definition.get('id', number)),
+                                    definition.get('name', 'Enclosure ' + str(definition.get('id', number))),
+                                    int(str(address), 0),
+                                    definition.get('i2c-channel'),
+                                    dict(definition.get('sockets', DEFAULT_SOCKETS)),
+                                    enclosure_settings))
+    ids = [enclosure.id for enclosure in enclosures]
+    if len(set(ids)) != len(ids):
+        raise ValueError('Enclosure ids must be unique.')
+    return enclosures
@@ -0,0 +1,149 @@
+#
+# events
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import sqlite3
+import threading
+import queue
+import psutil
+import database
+from device_store import to_string
+
+# Events buffered per client before it is considered too slow and dropped.
+MAX_QUEUED_EVENTS = 100
+
+
+class ChangeMonitor:
+    """ One thread watching the database for new readings, device state changes and the backend
+        starting or stopping, which publishes them to every subscribed client.
+    """
+
+    def __init__(self, path=database.DB_PATH, interval=1):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.subscribers = set()
+        self.thread = None
+        # Last seen state, events are only sent when these change.
+        self.last_modified = 0
+        self.last_timestamp = None
+        self.device_states = None
+        self.backend_running = None
+
+    def subscribe(self):
+        """ Get a queue of (event, data) tuples, None means the subscriber was dropped.
+            The monitor thread is started by the first subscriber.
+        """
+        subscriber = queue.Queue(MAX_QUEUED_EVENTS)
+        with self.lock:
+            # Start with the current state so the client does not have to wait for a change.
+            if self.device_states is not None:
+                subscriber.put(('device_states', self.device_states))
+            if self.backend_running is not None:
+                subscriber.put(('backend', {'backend_running': self.backend_running}))
+            self.subscribers.add(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='Change Monitor Thread', daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def drop(self, subscriber):
+        # Anything queued is discarded so there is room to say it was dropped.
+        self.subscribers.discard(subscriber)
+        while not subscriber.empty():
+            subscriber.get_nowait()
+        subscriber.put_nowait(None)
+
+    def close(self):
+        """ Drop every subscriber so their streams end, for shutting down.
+        """
+        with self.lock:
+            for subscriber in list(self.subscribers):
+                self.drop(subscriber)
+
+    def notify(self):
+        """ Check for changes now rather than at the next interval.
+        """
+        self.wake.set()
+
+    def publish(self, event, data):
+        with self.lock:
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.put_nowait((event, data))
+                except queue.Full:
+                    # Too slow, drop it and let the client reconnect.
+                    self.drop(subscriber)
+
+    def check(self, c):
+        """ Publish anything which has changed since the last check.
+        """
+        # Check backend process is running.
+        pid = c.execute("SELECT state FROM flags WHERE flag='pid'").fetchone()
+        backend_running = bool(pid and psutil.pid_exists(pid[0]))
+        if backend_running != self.backend_running:
+            self.backend_running = backend_running
+            self.publish('backend', {'backend_running': backend_running})
+
+        # Only query for readings and states if the database has been written to.
+        last_modified = database.last_modified(self.path)
+        if last_modified == self.last_modified:
+            return
+        self.last_modified = last_modified
+
+        if self.last_timestamp is None:
+            # Start from the latest reading, clients load history themselves.
+            self.last_timestamp = c.execute('SELECT COALESCE(MAX(reading_timestamp), 0) '
+                                            'FROM sensor_readings').fetchone()[0]
+        else:
+            c.execute('SELECT enclosure_id, reading_timestamp, ' + database.READING_DATETIME + ', temperature, '
+                      'humidity, comments, temperature_rate, humidity_rate FROM sensor_readings '
+                      'WHERE reading_timestamp>? ORDER BY reading_timestamp DESC', (self.last_timestamp,))
+            sensor_readings = [dict(zip(('enclosure_id', 'reading_timestamp', 'reading_datetime', 'temperature',
+                                         'humidity', 'comments', 'temperature_rate', 'humidity_rate'), row))
+                               for row in c.fetchall()]
+            if sensor_readings:
+                self.last_timestamp = sensor_readings[0]['reading_timestamp']
+                self.publish('sensor_readings', sensor_readings)
+
+        device_states = [{'enclosure_id': row[0], 'device': row[1], 'state': to_string(row[2])}
+                         for row in c.execute('SELECT enclosure_id, device, state FROM device_states')]
+        if device_states != self.device_states:
+            self.device_states = device_states
+            self.publish('device_states', device_states)
+
+    def run(self):
+        db = database.connect(self.path)
+        c = db.cursor()
+        try:
+            while True:
+                with self.lock:
+                    # Stop when the last client leaves, forgetting state so a restarted
+                    # monitor does not replay what was missed.
+                    if not self.subscribers:
+                        self.thread = None
+                        self.last_modified = 0
+                        self.last_timestamp = None
+                        self.device_states = None
+                        self.backend_running = None
+                        break
+                try:
+                    self.check(c)
+                except sqlite3.Error:
+                    pass  # Tables may be being recreated by the backend, try again next time.
+                self.wake.wait(self.interval)
+                self.wake.clear()
+        finally:
+            db.close()
@@ -88,43 +88,212 @@ function BuildChart(values, chartTitle, element, backgroundColor, borderColor) {
     return myChart;
 }
 
-function chartsFromTable() {
-    // HTML To JSON Script
-    // Forked from https://j.hn/html-table-to-json/ with some changes.
-    var table = document.getElementById("sensor-readings-table");
-    var json = []; // First row needs to be headers.
-    var headers = [];
-    for (var i = 0; i < table.rows[0].cells.length; i++) {
-        headers[i] = table.rows[0].cells[i].id;
-    }
-    // Go through cells (in reverse).
-    for (var i = table.rows.length - 1; i > 0; i--) {
-        var tableRow = table.rows[i];
-        var rowData = {};
-        for (var j = 0; j < tableRow.cells.length; j++) {
-            rowData[headers[j]] = tableRow.cells[j].innerHTML;
-        }
-        json.push(rowData);
-    }
-    // Map json values back to values array.
-    var temperature_data = json.map(function (e) {
-        return {x: e.readingdatetime, y: e.temperature};
-    });
-    var humidity_data = json.map(function (e) {
-        return {x: e.readingdatetime, y: e.humidity};
+var chartResolution = 0;
+
+function enclosureId() {
+    // The enclosure being viewed.
+    return document.body.getAttribute("data-enclosure");
+};
+
+function chartData(readings, values) {
+    // Zip the parallel arrays from the API into points.
+    return readings.timestamp.map(function (timestamp, i) {
+        return {x: timestamp * 1000, y: values[i]};
     });
-    //console.log(temperature_data);
-    //console.log(humidity_data);
-    temperature_chart = BuildChart(temperature_data, "Temperature (°C)", "temperature-chart", 'rgba(255, 0, 0, 0.2)', 'rgba(255, 0, 0, 0.8)');
-    humidity_chart = BuildChart(humidity_data, "Humidity (%)", "humidity-chart", 'rgba(0, 0, 255, 0.2)', 'rgba(0, 0, 255, 0.8)');
 }
 
+function chartsFromApi() {
+
+    var xhttp = new XMLHttpRequest();
+
+    xhttp.onreadystatechange = function() {
+        if(this.readyState == 4 && this.status == 200) {
+            var readings = JSON.parse(this.responseText);
+            chartResolution = readings.resolution;
+            document.getElementById("resolution").innerHTML = "Charts show " + readings.resolution_name + ".";
+            if(temperature_chart == null) {
+                temperature_chart = BuildChart(chartData(readings, readings.temperature), "Temperature (°C)", "temperature-chart", 'rgba(255, 0, 0, 0.2)', 'rgba(255, 0, 0, 0.8)');
+                humidity_chart = BuildChart(chartData(readings, readings.humidity), "Humidity (%)", "humidity-chart", 'rgba(0, 0, 255, 0.2)', 'rgba(0, 0, 255, 0.8)');
+            } else {
+                temperature_chart.data.datasets[0].data = chartData(readings, readings.temperature);
+                temperature_chart.update();
+                humidity_chart.data.datasets[0].data = chartData(readings, readings.humidity);
+                humidity_chart.update();
+            };
+        } else if(this.readyState == 4 && this.status == 401) {
+            //console.log("Session expired.");
+            document.location = "/login";
+        };
+    };
+
+    var toTimestamp = Math.ceil(Date.now() / 1000);
+    var fromTimestamp = toTimestamp - 3600 * document.getElementById("num_hours").value;
+    xhttp.open("GET", "/api/readings?from=" + fromTimestamp + "&to=" + toTimestamp + "&enclosure=" + enclosureId(), true);
+    xhttp.send();
+
+};
+
+function trimChart(chart, retainFrom) {
+    var data = chart.data.datasets[0].data;
+    while(data.length > 0 && data[0].x < retainFrom) {
+        data.shift();
+    };
+};
+
 /*
 ------------------------------------
 --------- Live Data Reload ---------
 ------------------------------------
 */
 
+// Rows kept in the table, a page more for each older page loaded.
+var tableRows = 50;
+
+function fillReadingRow(row, sensorReading) {
+    row.dataset.timestamp = sensorReading.reading_timestamp;
+    row.innerHTML =
+        "<td>" + sensorReading.reading_datetime + "</td>" +
+        "<td>" + sensorReading.temperature + "</td>" +
+        "<td>" + sensorReading.humidity + "</td>" +
+        "<td>" + sensorReading.comments + "</td>";
+};
+
+function trendText(rate, unit) {
+    // Rate of change per hour, nothing until the daemon has enough samples for one.
+    if(rate == null) {
+        return "";
+    };
+    return "<span class=\"trend\">" + (rate < 0 ? "" : "+") + rate.toFixed(1) + unit + "/h</span>";
+};
+
+function addSensorReadings(sensorReadings) {
+
+    // Add and remove sensor readings to/from table and charts.
+    var table = document.getElementById("sensor-readings-table");
+
+    if(sensorReadings.length > 0) {
+        // Update temperature and humidity tiles.
+        document.getElementById("temperature-tile").innerHTML = sensorReadings[0].temperature + "°C" +
+            trendText(sensorReadings[0].temperature_rate, "°C");
+        document.getElementById("humidity-tile").innerHTML = sensorReadings[0].humidity + "%" +
+            trendText(sensorReadings[0].humidity_rate, "%");
+    };
+
+    var retainFrom = Date.now() - 3600000 * document.getElementById("num_hours").value;
+
+    for(i = sensorReadings.length - 1; i >= 0; i--) {
+
+        // Update table keeping it to the pages loaded.
+        if(table.rows.length > tableRows) {
+            table.deleteRow(-1);
+        };
+        fillReadingRow(table.insertRow(1), sensorReadings[i]);
+
+        // Update charts directly if they show every reading.
+        if(chartResolution == 0 && temperature_chart != null) {
+            temperature_chart.data.datasets[0].data.push({
+                x: sensorReadings[i].reading_timestamp * 1000,
+                y: sensorReadings[i].temperature
+            });
+            humidity_chart.data.datasets[0].data.push({
+                x: sensorReadings[i].reading_timestamp * 1000,
+                y: sensorReadings[i].humidity
+            });
+        };
+
+    };
+
+    if(sensorReadings.length > 0 && temperature_chart != null) {
+        if(chartResolution == 0) {
+            // Drop points which have moved out of range.
+            trimChart(temperature_chart, retainFrom);
+            temperature_chart.update();
+            trimChart(humidity_chart, retainFrom);
+            humidity_chart.update();
+        } else {
+            // Charts show rollups so fetch them again.
+            chartsFromApi();
+        };
+    };
+
+};
+
+function updateDeviceStates(deviceStates) {
+    for(i = 0; i < deviceStates.length; i++) {
+        document.getElementById(deviceStates[i].device).value = deviceStates[i].state;
+    };
+};
+
+function updateBackendRunning(backendRunning) {
+    if(backendRunning) {
+        //console.log("Backend is running.");
+        document.getElementById("backend-running-tile").innerHTML = "Running";
+        document.getElementById("backend-running-tile").style.backgroundColor = "rgba(60, 179, 113, 0.8)";
+    } else {
+        //console.log("Backend is not running.");
+        document.getElementById("backend-running-tile").innerHTML = "Stopped";
+        document.getElementById("backend-running-tile").style.backgroundColor = "rgba(255, 69, 45, 0.8)";
+    };
+};
+
+// Seconds before trying again when the server refuses the event stream, doubled each time it is refused.
+var listenDelay = 1;
+
+function listen() {
+
+    // Fall back to polling for browsers without server-sent events.
+    if(typeof(EventSource) == "undefined") {
+        reload();
+        return;
+    };
+
+    var events = new EventSource("/events?enclosure=" + enclosureId());
+
+    events.addEventListener("sensor_readings", function(e) {
+        addSensorReadings(JSON.parse(e.data));
+    });
+    events.addEventListener("device_states", function(e) {
+        updateDeviceStates(JSON.parse(e.data));
+    });
+    events.addEventListener("backend", function(e) {
+        updateBackendRunning(JSON.parse(e.data).backend_running);
+    });
+    events.onopen = function() {
+        listenDelay = 1;
+    };
+    events.onerror = function() {
+        // The browser reconnects by itself unless the request was refused, either as the session
+        // expired or as the server has no room for another stream (too many tabs open).
+        if(events.readyState == EventSource.CLOSED) {
+            checkSession(function() {
+                setTimeout(listen, listenDelay * 1000);
+                listenDelay = Math.min(listenDelay * 2, 60);
+            });
+        };
+    };
+
+};
+
+function checkSession(callback) {
+
+    // Go to the login page if the session has expired, otherwise call back.
+    var xhttp = new XMLHttpRequest();
+
+    xhttp.onreadystatechange = function() {
+        if(this.readyState == 4 && this.status == 401) {
+            document.location = "/login";
+        } else if(this.readyState == 4) {
+            callback();
+        };
+    };
+
+    // Nothing will have changed since now so this is cheap.
+    xhttp.open("POST", "/reload", true);
+    xhttp.setRequestHeader("Content-type", "application/x-www-form-urlencoded");
+    xhttp.send("last=" + Math.ceil(Date.now() / 1000) + "&enclosure=" + enclosureId());
+
+};
+
 var fromDateTime = Math.ceil(Date.now() / 1000);
 
 function reload() {
@@ -138,79 +307,16 @@ function reload() {
 
                 // Parse response into JSON.
                 var data = JSON.parse(this.responseText);
-                // Split for sensor readings.
-                var sensorReadings = data.sensor_readings;
-                // Add and remove sensor readings to/from table and charts.
-                var table = document.getElementById("sensor-readings-table");
-
-                if(sensorReadings != null) {
-
-                    if(sensorReadings.length > 0) {
-                        // Update temperature and humidity tiles.
-                        document.getElementById("temperature-tile").innerHTML = sensorReadings[0].temperature + "°C";
-                        document.getElementById("humidity-tile").innerHTML = sensorReadings[0].humidity + "%";
-                    };
-
-                    // Check if readings should be removed.
-                    var firstReading = Date.parse(table.rows[table.rows.length - 1].cells[0].innerHTML);
-                    var retainFrom = Date.now() - 3600000 * document.getElementById("num_hours").value;
-                    var removeReadings = firstReading < retainFrom;
-
-                    for(i = sensorReadings.length - 1; i >= 0; i--) {
-
-                        // Update table.
-                        if(removeReadings) {
-                            table.deleteRow(-1);
-                        };
-                        var row = table.insertRow(1);
-                        row.innerHTML =
-                            "<td>" + sensorReadings[i].reading_datetime.split(".")[0] + "</td>" +
-                            "<td>" + sensorReadings[i].temperature + "</td>" +
-                            "<td>" + sensorReadings[i].humidity + "</td>" +
-                            "<td>" + sensorReadings[i].comments + "</td>";
-
-                        // Update charts.
-                        temperature_chart.data.datasets[0].data.push({
-                            x: sensorReadings[i].reading_datetime.split(".")[0],
-                            y: sensorReadings[i].temperature
-                        });
-                        if(removeReadings) {
-                            temperature_chart.data.datasets[0].data.shift();
-                        };
-                        temperature_chart.update();
-                        humidity_chart.data.datasets[0].data.push({
-                            x: sensorReadings[i].reading_datetime.split(".")[0],
-                            y: sensorReadings[i].humidity
-                         });
-                        if(removeReadings) {
-                            humidity_chart.data.datasets[0].data.shift();
-                        };
-                        humidity_chart.update();
-
-                    };
 
+                if(data.sensor_readings != null) {
+                    addSensorReadings(data.sensor_readings);
                 };
 
-                // Split device states and update tiles.
-                var deviceStates = data.device_states;
-                if(deviceStates != null) {
-
-                    for(i = 0; i < deviceStates.length; i++) {
-                        document.getElementById(deviceStates[i].device).value = deviceStates[i].state;
-                    };
-
+                if(data.device_states != null) {
+                    updateDeviceStates(data.device_states);
                 };
 
-            var backendRunning = data.backend_running;
-            if(backendRunning) {
-                //console.log("Backend is running.");
-                document.getElementById("backend-running-tile").innerHTML = "Running";
-                document.getElementById("backend-running-tile").style.backgroundColor = "rgba(60, 179, 113, 0.8)";
-            } else {
-                //console.log("Backend is not running.");
-                document.getElementById("backend-running-tile").innerHTML = "Stopped";
-                document.getElementById("backend-running-tile").style.backgroundColor = "rgba(255, 69, 45, 0.8)";
-            };
+                updateBackendRunning(data.backend_running);
 
             } else if(this.readyState == 4 && this.status == 401) {
                 //console.log("Session expired.");
@@ -228,12 +334,47 @@ function reload() {
         };
         xhttp.open("POST", "/reload", true);
         xhttp.setRequestHeader("Content-type", "application/x-www-form-urlencoded");
-        xhttp.send("last=" + fromDateTime);
+        xhttp.send("last=" + fromDateTime + "&enclosure=" + enclosureId());
 
     }, 5000);
 
 };
 
+/*
+------------------------------------
+---------- Older Readings ----------
+------------------------------------
+*/
+
+function loadOlderReadings(button) {
+
+    var table = document.getElementById("sensor-readings-table");
+    var xhttp = new XMLHttpRequest();
+
+    xhttp.onreadystatechange = function() {
+        if(this.readyState == 4 && this.status == 200) {
+            var page = JSON.parse(this.responseText);
+            for(i = 0; i < page.sensor_readings.length; i++) {
+                fillReadingRow(table.insertRow(-1), page.sensor_readings[i]);
+            };
+            tableRows += page.sensor_readings.length;
+            // No cursor once the oldest reading is shown.
+            button.disabled = page.before == null;
+        } else if(this.readyState == 4 && this.status == 401) {
+            document.location = "/login";
+        } else if(this.readyState == 4) {
+            button.disabled = false;
+        };
+    };
+
+    // Each page continues from the timestamp of the last row.
+    var before = table.rows.length > 1 ? "&before=" + table.rows[table.rows.length - 1].dataset.timestamp : "";
+    button.disabled = true;
+    xhttp.open("GET", "/api/readings/page?enclosure=" + enclosureId() + before, true);
+    xhttp.send();
+
+};
+
 /*
 ------------------------------------
 ---------- Toggle Devices ----------
@@ -254,6 +395,8 @@ function toggleDevice(button) {
         } else if(this.readyState == 4 && this.status == 401) {
             //console.log("Session expired.");
             document.location = "/login";
+        } else if(this.readyState == 4 && this.status == 503) {
+            console.log(JSON.parse(this.responseText).error);
         };
     };
 
@@ -262,7 +405,7 @@ function toggleDevice(button) {
 
     xhttp.open("POST", "/toggle_device", true);
     xhttp.setRequestHeader("Content-type", "application/x-www-form-urlencoded");
-    xhttp.send("device=" + button.id + "&state=" + button.value);
+    xhttp.send("device=" + button.id + "&state=" + button.value + "&enclosure=" + enclosureId());
 
 };
 
@@ -279,6 +422,8 @@ function updateSettings(form) {
     xhttp.onreadystatechange = function() {
         if(this.readyState == 4 && this.status == 200) {
             document.getElementById("settings-status").innerHTML = "Settings updated successfully.";
+        } else if(this.readyState == 4 && this.status == 400) {
+            document.getElementById("settings-status").textContent = this.responseText;
         } else if(this.readyState == 4 && this.status == 401) {
             //console.log("Session expired.");
             document.location = "/login";
@@ -293,3 +438,24 @@ function updateSettings(form) {
 function resetSettingsStatus() {
     document.getElementById("settings-status").innerHTML = "";
 };
+
+function startProfile(form) {
+
+    var xhttp = new XMLHttpRequest();
+
+    xhttp.onreadystatechange = function() {
+        if(this.readyState == 4 && this.status == 200) {
+            var profile = JSON.parse(this.responseText);
+            document.getElementById("profile-status").textContent = "Profiling until " +
+                new Date(profile.until * 1000).toLocaleTimeString() + ", written to " + profile.path + ".";
+        } else if(this.readyState == 4 && this.status == 401) {
+            document.location = "/login";
+        } else if(this.readyState == 4) {
+            document.getElementById("profile-status").textContent = this.responseText || "Profiling not started.";
+        };
+    };
+
+    xhttp.open("POST", "/profile", true);
+    xhttp.send(new FormData(form));
+
+};
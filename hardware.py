@@ -0,0 +1,244 @@
+#
+# hardware
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import threading
+import collections
+import random
+import struct
+import time
+import os
+from camera import PiCameraSource, FakeCameraSource, TEST_PATTERN
+
+# Environment variables override the settings so the hardware can be swapped without editing them.
+BACKEND_VARIABLE = 'VIVARIUM_HARDWARE'
+SPEED_VARIABLE = 'VIVARIUM_SIMULATION_SPEED'
+
+
+class PiBackend:
+    """ The real hardware: BME280s on I2C (behind a TCA9548A multiplexer if there are several with
+        the same address), an Energenie PiMote and the Pi camera. Libraries are imported when first
+        used so other backends work without them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.i2c = None
+        self.multiplexer = None
+
+    def bus(self, channel=None):
+        """ Get the I2C bus, or a channel of the multiplexer. Every sensor shares the one bus.
+        """
+        import board
+        import busio
+        with self.lock:
+            if self.i2c is None:
+                self.i2c = busio.I2C(board.SCL, board.SDA)
+            if channel is None:
+                return self.i2c
+            if self.multiplexer is None:
+                import adafruit_tca9548a
+                self.multiplexer = adafruit_tca9548a.TCA9548A(self.i2c)
+            return self.multiplexer[channel]
+
+    def sensor(self, enclosure):
+        import adafruit_bme280
+        return adafruit_bme280.Adafruit_BME280_I2C(self.bus(enclosure.i2c_channel), address=enclosure.sensor_address)
+
+    def socket(self, enclosure, device):
+        from gpiozero import Energenie
+        return Energenie(enclosure.sockets[device])
+
+    def camera_source(self, resolution, framerate, vflip=False):
+        return PiCameraSource(resolution, framerate, vflip)
+
+
+class SimulatedClock:
+    """ Time which runs at a multiple of real time from when it was created.
+    """
+
+    def __init__(self, speed=1):
+        self.speed = speed
+        self.start = time.time()
+        self.start_monotonic = time.monotonic()
+
+    def time(self):
+        return self.start + (time.monotonic() - self.start_monotonic) * self.speed
+
+
+class Enclosure:
+    """ A simple thermal model of a vivarium. Temperature and humidity decay towards the room
+        and are pushed by whichever devices are on. Rates are per hour of simulated time.
+    """
+
+    # Room conditions the enclosure settles to with everything off.
+    AMBIENT_TEMPERATURE = 18.0
+    AMBIENT_HUMIDITY = 50.0
+    # Hours for the difference from the room to fall by about two thirds.
+    TEMPERATURE_TIME_CONSTANT = 1.5
+    HUMIDITY_TIME_CONSTANT = 2.0
+    # Effect of each device when on.
+    HEAT_MAT_HEATING = 6.0
+    LIGHT_HEATING = 2.0
+    FAN_COOLING = 1.5
+    FAN_DRYING = 5.0
+    PUMP_HUMIDIFYING = 15.0
+    # Sensor noise (standard deviation).
+    NOISE = 0.05
+    # Longest step when integrating so fast simulations stay stable.
+    MAX_STEP = 1 / 60
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.temperature = self.AMBIENT_TEMPERATURE
+        self.humidity = self.AMBIENT_HUMIDITY
+        self.devices = {}
+        self.last_update = clock.time()
+
+    def device_on(self, device):
+        socket = self.devices.get(device)
+        return 1.0 if socket is not None and socket.value else 0.0
+
+    def update(self):
+        """ Advance the model to the current simulated time.
+        """
+        now = self.clock.time()
+        hours = (now - self.last_update) / 3600
+        self.last_update = now
+        heat_mat, light = self.device_on('heat-mat'), self.device_on('light')
+        fan, pump = self.device_on('fan'), self.device_on('pump')
+        while hours > 0:
+            step = min(hours, self.MAX_STEP)
+            hours -= step
+            self.temperature += step * ((self.AMBIENT_TEMPERATURE - self.temperature) /
+                                        self.TEMPERATURE_TIME_CONSTANT + heat_mat * self.HEAT_MAT_HEATING +
+                                        light * self.LIGHT_HEATING -
+                                        fan * self.FAN_COOLING * (self.temperature - self.AMBIENT_TEMPERATURE))
+            self.humidity += step * ((self.AMBIENT_HUMIDITY - self.humidity) / self.HUMIDITY_TIME_CONSTANT +
+                                     pump * self.PUMP_HUMIDIFYING - fan * self.FAN_DRYING)
+            self.humidity = min(max(self.humidity, 0.0), 100.0)
+
+    @property
+    def readings(self):
+        with self.lock:
+            self.update()
+            return (self.temperature + random.gauss(0, self.NOISE),
+                    min(max(self.humidity + random.gauss(0, self.NOISE), 0.0), 100.0))
+
+
+class SimulatedSensor:
+    """ Reads the enclosure model with the same attributes as the BME280 driver.
+    """
+
+    def __init__(self, enclosure):
+        self.enclosure = enclosure
+
+    @property
+    def temperature(self):
+        return self.enclosure.readings[0]
+
+    @property
+    def relative_humidity(self):
+        return self.enclosure.readings[1]
+
+
+class RecordingSocket:
+    """ A switched socket which records every change, with the same interface as gpiozero's Energenie.
+    """
+
+    def __init__(self, number, enclosure, history=1000):
+        self.number = number
+        self.enclosure = enclosure
+        self.state = False
+        self.switches = 0
+        self.history = collections.deque(maxlen=history)
+
+    @property
+    def value(self):
+        return self.state
+
+    @value.setter
+    def value(self, value):
+        # Bring the model up to date before the effect of the device changes.
+        with self.enclosure.lock:
+            self.enclosure.update()
+            self.state = bool(value)
+        self.switches += 1
+        self.history.append((self.enclosure.clock.time(), self.state))
+
+    def on(self):
+        self.value = True
+
+    def off(self):
+        self.value = False
+
+
+class SyntheticCameraSource(FakeCameraSource):
+    """ Test pattern frames each tagged with a JPEG comment holding the frame number and time, so
+        every frame is distinct as a real camera's would be.
+    """
+
+    def __init__(self, clock, framerate):
+        FakeCameraSource.__init__(self, framerate=framerate)
+        self.clock = clock
+        self.frame_number = 0
+
+    def run(self, callback):
+        while not self.stopped.is_set():
+            self.frame_number += 1
+            comment = ('Frame ' + str(self.frame_number) + ' at ' + str(self.clock.time())).encode('utf-8')
+            # Comment segment goes straight after the start of image marker.
+            callback(TEST_PATTERN[:2] + b'\xff\xfe' + struct.pack('>H', len(comment) + 2) + comment +
+                     TEST_PATTERN[2:])
+            self.stopped.wait(1 / self.framerate)
+
+
+class SimulatedBackend:
+    """ Simulated enclosures for running off the Pi, at real time or sped up for soak tests.
+        Each enclosure has its own model.
+    """
+
+    def __init__(self, speed=1):
+        self.clock = SimulatedClock(speed)
+        self.lock = threading.Lock()
+        self.enclosures = {}
+
+    def model(self, enclosure):
+        with self.lock:
+            if enclosure.id not in self.enclosures:
+                self.enclosures[enclosure.id] = Enclosure(self.clock)
+            return self.enclosures[enclosure.id]
+
+    def sensor(self, enclosure):
+        return SimulatedSensor(self.model(enclosure))
+
+    def socket(self, enclosure, device):
+        model = self.model(enclosure)
+        socket = RecordingSocket(enclosure.sockets[device], model)
+        model.devices[device] = socket
+        return socket
+
+    def camera_source(self, resolution, framerate, vflip=False):
+        return SyntheticCameraSource(self.clock, framerate)
+
+
+BACKENDS = {'pi': PiBackend, 'simulated': SimulatedBackend}
+
+
+def from_settings(settings):
+    """ Create the backend named by the environment or the settings (the Pi by default).
+    """
+    name = os.environ.get(BACKEND_VARIABLE, settings.get('hardware', 'pi'))
+    if name not in BACKENDS:
+        raise ValueError("Unknown hardware backend '" + name + "'.")
+    if name == 'simulated':
+        return SimulatedBackend(float(os.environ.get(SPEED_VARIABLE, settings.get('simulation-speed', 1))))
+    return BACKENDS[name]()
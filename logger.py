@@ -9,21 +9,162 @@
 # http://opensource.org/licenses/MIT
 #
 
+import logging
+import logging.handlers
+import threading
+import atexit
+import queue
+import json
 import re
+import constants
+import metrics
+
+LOG_RECORDS_DROPPED = metrics.Counter('log_records_dropped_total', 'Log records dropped because the queue was full.')
 
 
 class Logger:
+    """ File-like object for stdout and stderr passing each complete line to a logger.
+    """
 
     def __init__(self, logger, level, regex=None):
         self.logger = logger
         self.level = level
-        self.regex = regex
+        self.regex = re.compile(regex) if regex else None
+        self.lock = threading.Lock()
+        self.buffer = ''
 
     def write(self, message):
-        if message != '\n' and not message.isspace():
+        # Print writes the text and the newline separately so wait for the end of the line.
+        with self.lock:
+            message, newline, self.buffer = (self.buffer + message).rpartition('\n')
+        if not newline:
+            return
+        if not message.isspace():
             if self.regex:
-                message = re.sub(self.regex, '', message)
+                message = self.regex.sub('', message)
             self.logger.log(self.level, message.rstrip())
 
     def flush(self):
         pass
+
+
+def log_event(logger, level, message, **fields):
+    """ Log a message with key/value fields, written after it as key=value.
+    """
+    logger.log(level, message, extra={'fields': fields})
+
+
+class KeyValueFormatter(logging.Formatter):
+    """ Formats records with any fields from log_event appended as key=value.
+    """
+
+    def formatMessage(self, record):
+        text = logging.Formatter.formatMessage(self, record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ''.join(' ' + key + '=' + format_field(value) for key, value in fields.items())
+        return text
+
+
+def format_field(value):
+    # Quoted only if it would not read back as one value.
+    value = str(value)
+    if not value or any(character.isspace() or character in '"=' for character in value):
+        return json.dumps(value)
+    return value
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ Puts records on a bounded queue without ever waiting, dropping and counting them if it
+        is full. Records are only used in this process so are not made picklable, the message
+        is the only thing worked out here.
+    """
+
+    def __init__(self, log_queue):
+        logging.handlers.QueueHandler.__init__(self, log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+
+class BatchedFileHandler(logging.handlers.RotatingFileHandler):
+    """ A rotating file handler which is flushed once for each batch of records rather than
+        after every record.
+    """
+
+    def flush(self):
+        pass  # Flushed by the writer after each batch.
+
+    def flush_batch(self):
+        logging.handlers.RotatingFileHandler.flush(self)
+
+
+class LogWriter:
+    """ Writes records from the queue to the handler on its own thread, as many as are waiting
+        at once, so only this thread ever waits on the file system.
+    """
+
+    def __init__(self, queue_handler, handler):
+        self.queue_handler = queue_handler
+        self.handler = handler
+        self.reported = 0
+        self.thread = threading.Thread(target=self.run, name='Log Writer Thread', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        # Whatever is queued is written first.
+        try:
+            self.queue_handler.queue.put(None, timeout=1)
+        except queue.Full:
+            return
+        self.thread.join(1)
+
+    def run(self):
+        log_queue = self.queue_handler.queue
+        stopping = False
+        while not stopping:
+            batch = [log_queue.get()]
+            while len(batch) < constants.LOG_BATCH_SIZE:
+                try:
+                    batch.append(log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                if record is None:
+                    stopping = True
+                else:
+                    self.handler.handle(record)
+            dropped = self.queue_handler.dropped
+            if dropped != self.reported:
+                self.handler.handle(logging.makeLogRecord({'msg': 'Log records dropped as the queue was full.',
+                                                           'levelno': logging.WARNING, 'levelname': 'WARNING',
+                                                           'fields': {'dropped': dropped - self.reported}}))
+                self.reported = dropped
+            self.handler.flush_batch()
+
+
+def setup_logger(name, filename):
+    """ Get a logger which queues records to be written to a rotating file by its own thread.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    handler = BatchedFileHandler(filename, maxBytes=262144, backupCount=3)
+    handler.setFormatter(KeyValueFormatter('%(asctime)s - %(message)s', '%d-%b-%y %H:%M:%S'))
+    queue_handler = DroppingQueueHandler(queue.Queue(constants.LOG_QUEUE_SIZE))
+    logger.addHandler(queue_handler)
+    writer = LogWriter(queue_handler, handler)
+    writer.start()
+    atexit.register(writer.stop)
+    return logger
@@ -0,0 +1,124 @@
+#
+# metrics
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import threading
+import bisect
+import math
+
+# Upper bounds in seconds for latency histograms, from a fast SQL statement to a slow RF transmission.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Every metric created in this process, rendered in the order created.
+registry = []
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(name + '="' + value + '"' for name, value in zip(names, escaped)) + '}'
+
+
+class Metric:
+    """ A named set of values, one for each combination of label values. Label values are given
+        in the order of the label names. Safe to update from any thread.
+    """
+    type = None
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.append(self)
+
+    def samples(self, prefix):
+        """ Lines for each value in the text exposition format.
+        """
+        with self.lock:
+            return [prefix + self.name + format_labels(self.label_names, labels) + ' ' + format_value(value)
+                    for labels, value in self.values.items()]
+
+    def render(self, prefix):
+        lines = ['# HELP ' + prefix + self.name + ' ' + self.help, '# TYPE ' + prefix + self.name + ' ' + self.type]
+        return lines + self.samples(prefix)
+
+
+class Counter(Metric):
+    """ A count which only goes up.
+    """
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """ A value which can go up and down.
+    """
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    """ Counts of observations falling into buckets, along with their count and sum.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, help, label_names)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # A count for each bucket (not cumulative until rendered) then the sum.
+                counts = self.values[labels] = [0] * len(self.buckets) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self, prefix):
+        lines = []
+        names = self.label_names + ('le',)
+        with self.lock:
+            for labels, counts in self.values.items():
+                total = 0
+                for bucket, count in zip(self.buckets, counts):
+                    total += count
+                    lines.append(prefix + self.name + '_bucket' + format_labels(names, labels + (format_value(bucket),))
+                                 + ' ' + str(total))
+                lines.append(prefix + self.name + '_count' + format_labels(self.label_names, labels) + ' ' + str(total))
+                lines.append(prefix + self.name + '_sum' + format_labels(self.label_names, labels) + ' ' +
+                             format_value(counts[-1]))
+        return lines
+
+
+def render(prefix):
+    """ Get every metric in this process in the text exposition format, names starting with the prefix.
+    """
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render(prefix))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,24 @@
+#
+# paths
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import os
+
+# Runtime files (the database, settings, logs, sessions, the command socket and the time-lapse) are
+# kept next to the scripts unless another directory is given in the environment.
+DATA_VARIABLE = 'VIVARIUM_DATA'
+
+DATA_DIR = os.environ.get(DATA_VARIABLE, os.path.dirname(__file__))
+
+
+def data_path(name):
+    """ Get the path of a runtime file.
+    """
+    return os.path.join(DATA_DIR, name)
@@ -0,0 +1,104 @@
+#
+# periodic
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import asyncio
+import collections
+import math
+import metrics
+
+# Number of recent timings kept for each job.
+TIMINGS_KEPT = 1000
+
+JOB_SECONDS = metrics.Histogram('job_seconds', 'Time taken by each run of a job.', ('job',))
+JOB_JITTER_SECONDS = metrics.Histogram('job_jitter_seconds', 'How late each run of a job started.', ('job',))
+JOB_SKIPPED = metrics.Counter('job_skipped_total', 'Runs of a job skipped because it overran.', ('job',))
+
+
+class Job:
+    """ A function run every interval seconds. The interval can be a function so it can follow the
+        settings. Blocking jobs are run in the executor, others (and coroutines) on the event loop itself.
+    """
+
+    def __init__(self, name, function, interval, blocking):
+        self.name = name
+        self.function = function
+        self.interval = interval if callable(interval) else lambda: interval
+        self.blocking = blocking
+        # Seconds each run took and how late it started.
+        self.busy = collections.deque(maxlen=TIMINGS_KEPT)
+        self.jitter = collections.deque(maxlen=TIMINGS_KEPT)
+        self.skipped = 0
+
+
+class PeriodicScheduler:
+    """ Runs jobs at fixed intervals on one event loop. Each deadline is the last deadline plus the
+        interval (not the time the job finished plus the interval) so jobs do not drift. A job
+        which overruns skips the ticks it missed rather than running them back to back.
+    """
+
+    def __init__(self, executor, logger):
+        self.executor = executor
+        self.logger = logger
+        self.jobs = []
+        self.stopping = None
+
+    def add_job(self, name, function, interval, blocking=True):
+        self.jobs.append(Job(name, function, interval, blocking))
+
+    def stop(self):
+        if self.stopping is not None:
+            self.stopping.set()
+
+    async def sleep_until(self, deadline):
+        """ Sleep until a deadline (loop time), returning False if stopped first.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(self.stopping.wait(), max(0, deadline - loop.time()))
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    async def run_job(self, job):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while not self.stopping.is_set():
+            start = loop.time()
+            job.jitter.append(start - deadline)
+            JOB_JITTER_SECONDS.observe(start - deadline, job.name)
+            try:
+                if asyncio.iscoroutinefunction(job.function):
+                    await job.function()
+                elif job.blocking:
+                    await loop.run_in_executor(self.executor, job.function)
+                else:
+                    job.function()
+            except Exception:
+                self.logger.exception("Job '" + job.name + "' failed.")
+            now = loop.time()
+            job.busy.append(now - start)
+            JOB_SECONDS.observe(now - start, job.name)
+            # Next deadline, skipping any which have already passed.
+            interval = job.interval()
+            deadline += interval
+            if deadline < now:
+                missed = math.ceil((now - deadline) / interval)
+                job.skipped += missed
+                JOB_SKIPPED.inc(job.name, amount=missed)
+                deadline += missed * interval
+            if not await self.sleep_until(deadline):
+                break
+
+    async def run(self):
+        """ Run every job until stopped.
+        """
+        self.stopping = asyncio.Event()
+        await asyncio.gather(*(self.run_job(job) for job in self.jobs))
@@ -0,0 +1,170 @@
+#
+# profiling
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import collections
+import threading
+import time
+import sys
+import os
+import database
+import metrics
+
+REQUEST_SECONDS = metrics.Histogram('request_seconds', 'Wall time taken to handle a request (to the start of the '
+                                    'response for streams).', ('handler',))
+REQUEST_CPU_SECONDS = metrics.Histogram('request_cpu_seconds', 'CPU time taken to handle a request.', ('handler',))
+
+# Responses which stay open, timed only to the start of the response.
+STREAM_TYPES = ('multipart/x-mixed-replace', 'text/event-stream')
+
+
+class RequestTimer:
+    """ Times one request from start to the end of its body, recording the SQL statements run
+        by the thread handling it.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        self.finished = False
+        database.start_recording()
+
+    def elapsed(self):
+        return time.perf_counter() - self.wall, time.thread_time() - self.cpu
+
+    def server_timing(self):
+        """ Get a Server-Timing header value for the time so far.
+        """
+        wall, cpu = self.elapsed()
+        statements = database.recorded_statements()
+        sql = sum(statement[1] for statement in statements)
+        return 'app;dur=' + format(wall * 1000, '.1f') + ', cpu;dur=' + format(cpu * 1000, '.1f') + \
+               ', db;dur=' + format(sql * 1000, '.1f') + ';desc="' + str(len(statements)) + ' statements"'
+
+    def finish(self):
+        """ Stop timing and get the wall time, CPU time and statements run.
+        """
+        self.finished = True
+        wall, cpu = self.elapsed()
+        statements = database.stop_recording()
+        REQUEST_SECONDS.observe(wall, self.handler)
+        REQUEST_CPU_SECONDS.observe(cpu, self.handler)
+        return wall, cpu, statements
+
+
+class TimingMiddleware:
+    """ WSGI middleware recording the wall and CPU time of each request by handler, adding a
+        Server-Timing header and logging requests slower than the threshold along with their
+        SQL statements. Handler name gets the name from the path, threshold gets the seconds so
+        it can follow the settings.
+    """
+
+    def __init__(self, app, handler_name, threshold, logger):
+        self.app = app
+        self.handler_name = handler_name
+        self.threshold = threshold
+        self.logger = logger
+
+    def __call__(self, environ, start_response):
+        timer = RequestTimer(self.handler_name(environ.get('PATH_INFO', '')))
+
+        def timed_start_response(status, headers, exc_info=None):
+            headers = list(headers) + [('Server-Timing', timer.server_timing())]
+            content_type = next((value for name, value in headers if name.lower() == 'content-type'), '')
+            if content_type.startswith(STREAM_TYPES):
+                self.finish(timer, environ)
+            return start_response(status, headers, exc_info)
+
+        try:
+            body = self.app(environ, timed_start_response)
+        except Exception:
+            self.finish(timer, environ)
+            raise
+        return self.timed_body(body, timer, environ)
+
+    def timed_body(self, body, timer, environ):
+        # Generators are run as the body is sent so are only finished once it has all gone.
+        try:
+            for chunk in body:
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            self.finish(timer, environ)
+
+    def finish(self, timer, environ):
+        if timer.finished:
+            return
+        wall, cpu, statements = timer.finish()
+        if wall < self.threshold():
+            return
+        lines = ['Slow request ' + environ.get('REQUEST_METHOD', '') + ' ' + environ.get('PATH_INFO', '') + ' (' +
+                 timer.handler + ') took ' + format(wall * 1000, '.0f') + ' ms, ' + format(cpu * 1000, '.0f') +
+                 ' ms CPU, ' + str(len(statements)) + ' SQL statements in ' +
+                 format(sum(statement[1] for statement in statements) * 1000, '.0f') + ' ms.']
+        for sql, seconds in statements:
+            lines.append('    ' + format(seconds * 1000, '.1f') + ' ms: ' + sql)
+        self.logger.warning('\n'.join(lines))
+
+
+class SamplingProfiler:
+    """ Samples the stack of every thread at an interval for a number of seconds and writes how
+        often each distinct stack was seen in the collapsed format (frames from the thread down
+        separated by semicolons, then the count) read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.thread = None
+        self.path = None
+        self.until = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds, path):
+        """ Start profiling in the background, returns False if it is already running.
+        """
+        with self.lock:
+            if self.running:
+                return False
+            self.path = path
+            self.until = time.time() + seconds
+            self.thread = threading.Thread(target=self.run, args=(seconds, path), name='Profiler Thread',
+                                           daemon=True)
+            self.thread.start()
+            return True
+
+    def run(self, seconds, path):
+        stacks = collections.Counter()
+        own_id = threading.get_ident()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(code.co_name + ' (' + os.path.basename(code.co_filename) + ':' +
+                                 str(code.co_firstlineno) + ')')
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, 'Thread ' + str(thread_id)))
+                stacks[';'.join(reversed(stack)).replace('\n', ' ')] += 1
+            time.sleep(self.interval)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wt') as f:
+            for stack, count in stacks.most_common():
+                f.write(stack + ' ' + str(count) + '\n')
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,104 @@
+#
+# retention
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import time
+import archive as archive_format
+
+# Tables pruned to the days to keep, hourly and daily rollups are small enough to keep indefinitely.
+PRUNE_QUERIES = [
+    'DELETE FROM sensor_readings WHERE (reading_timestamp, enclosure_id) IN (SELECT reading_timestamp, '
+    'enclosure_id FROM sensor_readings WHERE reading_timestamp<? ORDER BY reading_timestamp LIMIT ?)',
+    'DELETE FROM sensor_rollups WHERE resolution=60 AND (bucket_timestamp, enclosure_id) IN (SELECT '
+    'bucket_timestamp, enclosure_id FROM sensor_rollups WHERE resolution=60 AND bucket_timestamp<? '
+    'ORDER BY bucket_timestamp LIMIT ?)'
+]
+
+# Reclaim space once this fraction of the database pages are free, releasing at most this many pages
+# each time so the write lock is only held briefly.
+FREE_PAGE_FRACTION = 0.1
+VACUUM_PAGES = 1024
+
+
+# Readings between two timestamps to move to the archive.
+ARCHIVE_QUERY = 'SELECT reading_timestamp, enclosure_id, temperature, humidity FROM sensor_readings ' \
+                'WHERE reading_timestamp>=? AND reading_timestamp<?'
+
+ARCHIVE_DELETE_QUERY = 'DELETE FROM sensor_readings WHERE (reading_timestamp, enclosure_id) IN (SELECT ' \
+                       'reading_timestamp, enclosure_id FROM sensor_readings WHERE reading_timestamp>=? AND ' \
+                       'reading_timestamp<? LIMIT ?)'
+
+
+def archive_readings(db, cutoff, archive, chunk_size, stop=None):
+    """ Move readings older than the cutoff to the archive a month at a time, so each month's
+        file is written once however many readings go into it. A month's readings are only
+        deleted (in chunks) once its file has been written so a failure part way loses nothing.
+        Returns rows moved.
+    """
+    c = db.cursor()
+    archived = 0
+    while stop is None or not stop.is_set():
+        first = c.execute('SELECT MIN(reading_timestamp) FROM sensor_readings WHERE reading_timestamp<?',
+                          (cutoff,)).fetchone()[0]
+        if first is None:
+            break
+        end = min(archive_format.month_end(first), cutoff)
+        archive.add(c.execute(ARCHIVE_QUERY, (first, end)).fetchall())
+        while True:
+            c.execute(ARCHIVE_DELETE_QUERY, (first, end, chunk_size))
+            db.commit()
+            archived += c.rowcount
+            if c.rowcount < chunk_size:
+                break
+    return archived
+
+
+def prune_readings(db, days_to_keep, chunk_size, stop=None, archive=None):
+    """ Delete readings (and minute rollups) older than the days to keep in chunks, committing
+        after each chunk so the sensor loop is never locked out for long. Readings are moved to
+        the archive first if one is given. Returns rows deleted.
+    """
+    c = db.cursor()
+    cutoff = int(time.time() - 86400 * days_to_keep)
+    deleted = 0
+    if archive is not None:
+        deleted += archive_readings(db, cutoff, archive, chunk_size, stop)
+    for query in PRUNE_QUERIES:
+        while stop is None or not stop.is_set():
+            c.execute(query, (cutoff, chunk_size))
+            db.commit()
+            deleted += c.rowcount
+            if c.rowcount < chunk_size:
+                break
+    return deleted
+
+
+def reclaim_space(db):
+    """ Return free pages to the file system if enough have built up. The database is switched to
+        incremental auto vacuum when it is migrated, until then nothing is released. Returns bytes
+        reclaimed.
+    """
+    c = db.cursor()
+    page_size = c.execute('PRAGMA page_size').fetchone()[0]
+    page_count = c.execute('PRAGMA page_count').fetchone()[0]
+    free_pages = c.execute('PRAGMA freelist_count').fetchone()[0]
+    if not free_pages or free_pages < page_count * FREE_PAGE_FRACTION:
+        return 0
+    # Each step of the pragma releases one page and execute only takes the first, a script runs to the end.
+    db.executescript('PRAGMA incremental_vacuum(' + str(VACUUM_PAGES) + ')')
+    return (page_count - c.execute('PRAGMA page_count').fetchone()[0]) * page_size
+
+
+def compact(db, days_to_keep, chunk_size, stop=None, archive=None):
+    """ Prune (or archive) expired readings and reclaim the space. Returns rows deleted and bytes reclaimed.
+    """
+    deleted = prune_readings(db, days_to_keep, chunk_size, stop, archive)
+    reclaimed = reclaim_space(db) if deleted else 0
+    return deleted, reclaimed
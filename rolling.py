@@ -0,0 +1,143 @@
+#
+# rolling
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import collections
+
+# Statistics kept for each value, in the order they are given. Rules name them as the value and the
+# statistic joined by a dash (e.g. temperature-ewma) and the database as columns joined by an underscore.
+STATS = ('ewma', 'window_mean', 'window_min', 'window_max', 'rate')
+
+
+class Ewma:
+    """ Exponentially weighted moving average of values which may not be evenly spaced in time.
+        A value half life seconds old has half the weight of the newest.
+    """
+
+    def __init__(self, half_life):
+        self.half_life = half_life
+        self.value = None
+        self.timestamp = None
+
+    def add(self, timestamp, value):
+        if self.value is None:
+            self.value = value
+        else:
+            weight = 1 - 0.5 ** (max(timestamp - self.timestamp, 0) / self.half_life)
+            self.value += weight * (value - self.value)
+        self.timestamp = timestamp
+
+
+class RollingWindow:
+    """ Mean, minimum, maximum and least squares slope of the values added in the last window
+        seconds. Each value is added to and taken from running sums and the minimum and maximum
+        are the fronts of monotonic deques, so every value costs O(1) (amortised) however many
+        are in the window.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.values = collections.deque()
+        # Values which could still become the minimum (increasing) or maximum (decreasing).
+        self.minimums = collections.deque()
+        self.maximums = collections.deque()
+        self.reset()
+
+    def reset(self):
+        # Times are kept relative to an origin near the oldest value so the sums stay small.
+        self.origin = None
+        self.sum_x = self.sum_y = self.sum_xx = self.sum_xy = 0.0
+
+    def add(self, timestamp, value):
+        if self.origin is None:
+            self.origin = timestamp
+        x = timestamp - self.origin
+        self.values.append((timestamp, value))
+        self.sum_x += x
+        self.sum_y += value
+        self.sum_xx += x * x
+        self.sum_xy += x * value
+        while self.minimums and self.minimums[-1][1] >= value:
+            self.minimums.pop()
+        self.minimums.append((timestamp, value))
+        while self.maximums and self.maximums[-1][1] <= value:
+            self.maximums.pop()
+        self.maximums.append((timestamp, value))
+        self.expire(timestamp - self.window)
+
+    def expire(self, before):
+        """ Drop values from before a timestamp.
+        """
+        while self.values and self.values[0][0] <= before:
+            timestamp, value = self.values.popleft()
+            x = timestamp - self.origin
+            self.sum_x -= x
+            self.sum_y -= value
+            self.sum_xx -= x * x
+            self.sum_xy -= x * value
+        while self.minimums and self.minimums[0][0] <= before:
+            self.minimums.popleft()
+        while self.maximums and self.maximums[0][0] <= before:
+            self.maximums.popleft()
+        if not self.values:
+            self.reset()
+        elif self.values[0][0] - self.origin > self.window:
+            self.rebase(self.values[0][0])
+
+    def rebase(self, origin):
+        # Shift the sums to the new origin rather than adding every value again.
+        shift, count = origin - self.origin, len(self.values)
+        self.sum_xx += count * shift * shift - 2 * shift * self.sum_x
+        self.sum_xy -= shift * self.sum_y
+        self.sum_x -= count * shift
+        self.origin = origin
+
+    @property
+    def mean(self):
+        return self.sum_y / len(self.values) if self.values else None
+
+    @property
+    def minimum(self):
+        return self.minimums[0][1] if self.minimums else None
+
+    @property
+    def maximum(self):
+        return self.maximums[0][1] if self.maximums else None
+
+    @property
+    def slope(self):
+        """ Change per second of the line best fitting the values, None without two at different times.
+        """
+        count = len(self.values)
+        denominator = count * self.sum_xx - self.sum_x * self.sum_x
+        if count < 2 or denominator <= 0:
+            return None
+        return (count * self.sum_xy - self.sum_x * self.sum_y) / denominator
+
+
+class RollingStats:
+    """ The smoothed value, windowed mean, minimum and maximum and rate of change per hour of one
+        sensor value, updated with each sample.
+    """
+
+    def __init__(self, window, half_life):
+        self.ewma = Ewma(half_life)
+        self.rolling_window = RollingWindow(window)
+
+    def add(self, timestamp, value):
+        self.ewma.add(timestamp, value)
+        self.rolling_window.add(timestamp, value)
+
+    def stats(self):
+        """ Get the statistics in the order of STATS, None for any not known yet.
+        """
+        slope = self.rolling_window.slope
+        return (self.ewma.value, self.rolling_window.mean, self.rolling_window.minimum, self.rolling_window.maximum,
+                None if slope is None else slope * 3600)
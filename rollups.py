@@ -0,0 +1,79 @@
+#
+# rollups
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+# Bucket sizes in seconds for per-minute, per-hour and per-day rollups.
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+RESOLUTIONS = (MINUTE, HOUR, DAY)
+
+# Names for the resolutions when shown on the page, raw readings are 0.
+RESOLUTION_NAMES = {0: 'readings', MINUTE: 'minutely means', HOUR: 'hourly means', DAY: 'daily means'}
+
+# Select rollups in the same shape as sensor readings (mean for the value, range in the comments).
+READINGS_WHAT = "bucket_timestamp AS reading_timestamp, " \
+                "datetime(bucket_timestamp, 'unixepoch', 'localtime') AS reading_datetime, " \
+                "ROUND(temperature_sum / count, 2) AS temperature, ROUND(humidity_sum / count, 2) AS humidity, " \
+                "temperature_min, temperature_max, humidity_min, humidity_max, count, " \
+                "'Mean of ' || count || ' readings, Temperature: ' || temperature_min || ' to ' || " \
+                "temperature_max || ', Humidity: ' || humidity_min || ' to ' || humidity_max AS comments"
+
+
+def create_table(c):
+    """ Create the rollups table. Sums are kept rather than means so buckets can be updated incrementally.
+    """
+    c.execute('CREATE TABLE IF NOT EXISTS sensor_rollups (resolution INTEGER, bucket_timestamp INTEGER, '
+              'count INTEGER, temperature_sum REAL, temperature_min REAL, temperature_max REAL, '
+              'humidity_sum REAL, humidity_min REAL, humidity_max REAL, enclosure_id INTEGER NOT NULL DEFAULT 0, '
+              'PRIMARY KEY (resolution, bucket_timestamp, enclosure_id)) WITHOUT ROWID')
+
+
+def backfill(c):
+    """ Build rollups for all existing readings.
+    """
+    for resolution in RESOLUTIONS:
+        c.execute('INSERT OR REPLACE INTO sensor_rollups SELECT ?, reading_timestamp - reading_timestamp % ?, '
+                  'COUNT(*), SUM(temperature), MIN(COALESCE(temperature_min, temperature)), '
+                  'MAX(COALESCE(temperature_max, temperature)), SUM(humidity), '
+                  'MIN(COALESCE(humidity_min, humidity)), MAX(COALESCE(humidity_max, humidity)), '
+                  'enclosure_id FROM sensor_readings '
+                  'GROUP BY reading_timestamp - reading_timestamp % ?, enclosure_id',
+                  (resolution, resolution, resolution))
+
+
+def add_readings(c, readings):
+    """ Fold readings, as rows of (timestamp, temperature, humidity, comments, enclosure id, sample count,
+        temperature min, max, humidity min, max), into the bucket for each resolution. The ranges of
+        the samples are used for the minimums and maximums.
+    """
+    c.executemany('INSERT INTO sensor_rollups VALUES (?,?,1,?,?,?,?,?,?,?) '
+                  'ON CONFLICT (resolution, bucket_timestamp, enclosure_id) DO UPDATE SET count=count+1, '
+                  'temperature_sum=temperature_sum+excluded.temperature_sum, '
+                  'temperature_min=MIN(temperature_min, excluded.temperature_min), '
+                  'temperature_max=MAX(temperature_max, excluded.temperature_max), '
+                  'humidity_sum=humidity_sum+excluded.humidity_sum, '
+                  'humidity_min=MIN(humidity_min, excluded.humidity_min), '
+                  'humidity_max=MAX(humidity_max, excluded.humidity_max)',
+                  [(resolution, reading[0] - reading[0] % resolution, reading[1], reading[6], reading[7],
+                    reading[2], reading[8], reading[9], reading[4])
+                   for reading in readings for resolution in RESOLUTIONS])
+
+
+def choose_resolution(span, num_readings, max_points):
+    """ Pick the finest resolution that keeps a chart of the span within roughly max points.
+        Returns 0 when the raw readings are few enough to use directly.
+    """
+    if num_readings <= max_points:
+        return 0
+    for resolution in RESOLUTIONS:
+        if min(num_readings, span / resolution) <= max_points:
+            return resolution
+    return RESOLUTIONS[-1]
@@ -0,0 +1,273 @@
+#
+# rules
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import datetime
+import math
+import constants
+import samples
+
+# Settings used to build rules from the automatic control settings when none are declared.
+SETTING_DEFAULTS = {'temperature-hysteresis': constants.TEMPERATURE_HYSTERESIS,
+                    'humidity-hysteresis': constants.HUMIDITY_HYSTERESIS,
+                    'minimum-dwell': constants.MINIMUM_DWELL,
+                    'smooth-control': False}
+
+
+def to_time(value):
+    """ Convert a time as a string (HH:MM) to a time, times are passed through.
+    """
+    if isinstance(value, datetime.time):
+        return value
+    return datetime.time(int(value.split(':')[0]), int(value.split(':')[1]))
+
+
+def is_time_between(begin_time, end_time, check_time=None):
+    """ Check if a time is within a range.
+        Taken from the accepted answer by Joe Holloway here:
+        https://stackoverflow.com/a/10048290
+    """
+    # If check time is not given, default to current time.
+    check_time = check_time or datetime.datetime.now().time()
+    if begin_time < end_time:
+        return check_time >= begin_time and check_time <= end_time
+    else:  # Crosses midnight.
+        return check_time >= begin_time or check_time <= end_time
+
+
+class Rule:
+    """ Decides the state of one device. Evaluating returns True or False, or None when the rule
+        has no say (outside its window or without a reading yet). Any rule can be limited to a
+        window of the day and given minimum times to stay on and off.
+    """
+
+    def __init__(self, device, window=None, min_on=0, min_off=0):
+        self.device = device
+        self.window = (to_time(window[0]), to_time(window[1])) if window else None
+        self.min_on = min_on
+        self.min_off = min_off
+        # Switches the rule held back itself (within a hysteresis band).
+        self.suppressed = 0
+
+    def active(self):
+        return self.window is None or is_time_between(*self.window)
+
+    def evaluate(self, now, readings):
+        if not self.active():
+            return None
+        return self.decide(now, readings)
+
+    def decide(self, now, readings):
+        raise NotImplementedError
+
+
+class ScheduleRule(Rule):
+    """ On between two times of day, off otherwise.
+    """
+
+    def __init__(self, device, on, off, **kwargs):
+        Rule.__init__(self, device, **kwargs)
+        self.on = to_time(on)
+        self.off = to_time(off)
+
+    def decide(self, now, readings):
+        return is_time_between(self.on, self.off)
+
+
+class ThresholdRule(Rule):
+    """ On when a reading goes below (or above) a threshold and off once it is back past the
+        threshold by the hysteresis, so readings hovering around the threshold do not flip the
+        device on every sample.
+    """
+
+    def __init__(self, device, input, below=None, above=None, hysteresis=0, **kwargs):
+        Rule.__init__(self, device, **kwargs)
+        if (below is None) == (above is None):
+            raise ValueError("Threshold rule for '" + device + "' needs one of below or above.")
+        self.input = input
+        self.below = below
+        self.above = above
+        self.hysteresis = hysteresis
+        self.state = None
+        self.plain_state = None
+
+    def decide(self, now, readings):
+        value = readings.get(self.input)
+        if value is None:
+            return None
+        if self.below is not None:
+            plain_state = value <= self.below
+            state = plain_state or bool(self.state and value < self.below + self.hysteresis)
+        else:
+            plain_state = value >= self.above
+            state = plain_state or bool(self.state and value > self.above - self.hysteresis)
+        # Without the band the device would have switched here.
+        if self.plain_state is not None and plain_state != self.plain_state and state == self.state:
+            self.suppressed += 1
+        self.plain_state, self.state = plain_state, state
+        return state
+
+
+class PidRule(Rule):
+    """ Holds a reading at a setpoint by switching the device on for a fraction of each period
+        (time proportioning), the fraction coming from a PID controller. Reverse is for devices
+        which bring the reading down (a fan for temperature).
+    """
+
+    def __init__(self, device, input, setpoint, kp, ki=0, kd=0, period=600, reverse=False, **kwargs):
+        Rule.__init__(self, device, **kwargs)
+        # A bad value would otherwise only show up as a broken duty cycle once running.
+        for name, value in (('setpoint', setpoint), ('kp', kp), ('ki', ki), ('kd', kd), ('period', period)):
+            if not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise ValueError("PID rule for '" + device + "' needs a finite number for " + name + ".")
+        if period <= 0:
+            raise ValueError("PID rule for '" + device + "' needs a period above zero.")
+        self.input = input
+        self.setpoint = setpoint
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.period = period
+        self.reverse = reverse
+        self.integral = 0
+        self.last_error = None
+        self.last_time = None
+        self.duty = 0
+
+    def decide(self, now, readings):
+        value = readings.get(self.input)
+        if value is None:
+            return None
+        error = value - self.setpoint if self.reverse else self.setpoint - value
+        dt = now - self.last_time if self.last_time is not None else 0
+        derivative = (error - self.last_error) / dt if dt else 0
+        self.integral += error * dt
+        # Stop the integral winding up beyond what a full or empty duty cycle needs.
+        if self.ki:
+            self.integral = min(max(self.integral, -1 / abs(self.ki)), 1 / abs(self.ki))
+        self.last_error, self.last_time = error, now
+        self.duty = min(max(self.kp * error + self.ki * self.integral + self.kd * derivative, 0), 1)
+        # On for the first part of each period.
+        return now % self.period < self.duty * self.period
+
+
+RULE_TYPES = {'schedule': ScheduleRule, 'threshold': ThresholdRule, 'pid': PidRule}
+
+
+class RuleEngine:
+    """ Evaluates every rule together against the latest readings. A device is on if any rule with
+        a say wants it on. Changes are held back until the device has been in its current state
+        for the longest minimum time of its rules, these count as suppressed actuations.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.min_on, self.min_off = {}, {}
+        for rule in rules:
+            self.min_on[rule.device] = max(self.min_on.get(rule.device, 0), rule.min_on)
+            self.min_off[rule.device] = max(self.min_off.get(rule.device, 0), rule.min_off)
+        # State each device was last seen in and when it changed (manual toggles count too).
+        self.last_states = {}
+        self.last_changed = {}
+        # State each held back device is waiting for so a hold is only counted once.
+        self.held = {}
+        self.dwell_suppressed = 0
+
+    @property
+    def suppressed(self):
+        return self.dwell_suppressed + sum(rule.suppressed for rule in self.rules)
+
+    def carry_over(self, engine):
+        """ Keep when devices last changed from an engine being replaced, so reloading settings
+            does not reset the minimum times.
+        """
+        self.last_states = engine.last_states
+        self.last_changed = engine.last_changed
+        self.dwell_suppressed = engine.dwell_suppressed
+
+    def evaluate(self, now, readings, states):
+        """ Get the devices which should change as a dict of device and new state. Now is a
+            monotonic time, states are the current states of the devices. Rules for a device
+            without a state (not set up yet) are left out.
+        """
+        wanted = {}
+        for rule in self.rules:
+            if rule.device not in states:
+                continue
+            state = rule.evaluate(now, readings)
+            if state is not None:
+                wanted[rule.device] = wanted.get(rule.device, False) or state
+        changes = {}
+        for device, state in wanted.items():
+            current = states[device]
+            if device not in self.last_states:
+                self.last_states[device] = current  # Unknown how long it has been like this.
+            elif current != self.last_states[device]:
+                self.last_states[device] = current
+                self.last_changed[device] = now
+            if state == current:
+                self.held.pop(device, None)
+                continue
+            dwell = self.min_on[device] if current else self.min_off[device]
+            if device in self.last_changed and now - self.last_changed[device] < dwell:
+                if self.held.get(device) != state:
+                    self.held[device] = state
+                    self.dwell_suppressed += 1
+                continue
+            self.held.pop(device, None)
+            self.last_states[device] = state
+            self.last_changed[device] = now
+            changes[device] = state
+        return changes
+
+
+def rule_definitions(settings):
+    """ Get the rules declared in the settings, or build them from the automatic control settings.
+    """
+    if 'rules' in settings:
+        return settings['rules']
+    settings = dict(SETTING_DEFAULTS, **settings)
+    dwell = {'min-on': settings['minimum-dwell'], 'min-off': settings['minimum-dwell']}
+    # Switch on the smoothed values so a single noisy sample cannot cross a threshold.
+    suffix = '-ewma' if settings['smooth-control'] else ''
+    definitions = []
+    if settings['heat-mat-auto']:
+        definitions.append(dict(dwell, type='threshold', device='heat-mat', input='temperature' + suffix,
+                                below=settings['low-temperature'], hysteresis=settings['temperature-hysteresis']))
+    if settings['fan-auto']:
+        definitions.append(dict(dwell, type='threshold', device='fan', input='temperature' + suffix,
+                                above=settings['high-temperature'], hysteresis=settings['temperature-hysteresis']))
+    if settings['pump-auto']:
+        definitions.append(dict(dwell, type='threshold', device='pump', input='humidity' + suffix,
+                                below=settings['low-humidity'], hysteresis=settings['humidity-hysteresis']))
+    if settings['light-auto']:
+        definitions.append({'type': 'schedule', 'device': 'light', 'on': settings['light-on-time'],
+                            'off': settings['light-off-time']})
+    return definitions
+
+
+def compile_rules(settings, devices):
+    """ Build an engine for the rules in the settings, rules for devices which are not present
+        are left out. Raises ValueError if a rule is invalid.
+    """
+    rules = []
+    for definition in rule_definitions(settings):
+        definition = {key.replace('-', '_'): value for key, value in definition.items()}
+        rule_type = RULE_TYPES.get(definition.get('type'))
+        if rule_type is None:
+            raise ValueError('Unknown rule type in ' + str(definition) + '.')
+        del definition['type']
+        if 'input' in definition and definition['input'] not in samples.INPUTS:
+            raise ValueError('Unknown input in ' + str(definition) + '.')
+        if definition.get('device') not in devices:
+            continue
+        try:
+            rules.append(rule_type(**definition))
+        except TypeError as e:
+            raise ValueError('Invalid rule ' + str(definition) + ': ' + str(e))
+    return RuleEngine(rules)
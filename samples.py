@@ -0,0 +1,84 @@
+#
+# samples
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import collections
+from rolling import STATS, RollingStats
+
+# Values from each sample.
+VALUES = ('temperature', 'humidity')
+
+# Names of the values and their statistics as inputs to rules and as columns of each reading.
+INPUTS = VALUES + tuple(value + '-' + stat.replace('_', '-') for value in VALUES for stat in STATS)
+STATS_COLUMNS = tuple(value + '_' + stat for value in VALUES for stat in STATS)
+
+
+class SampleBuffer:
+    """ The latest samples from one sensor in a fixed size ring, along with the count, sums,
+        minimums and maximums of those taken since the last flush and the rolling statistics of
+        each value. Only used from the event loop so there is no locking.
+    """
+
+    def __init__(self, size, window, half_life):
+        self.samples = collections.deque(maxlen=size)
+        self.rolling_stats = {value: RollingStats(window, half_life) for value in VALUES}
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.temperature_sum = self.humidity_sum = 0.0
+        self.temperature_min = self.humidity_min = float('inf')
+        self.temperature_max = self.humidity_max = float('-inf')
+
+    def add(self, timestamp, temperature, humidity):
+        self.samples.append((timestamp, temperature, humidity))
+        self.count += 1
+        self.temperature_sum += temperature
+        self.temperature_min = min(self.temperature_min, temperature)
+        self.temperature_max = max(self.temperature_max, temperature)
+        self.humidity_sum += humidity
+        self.humidity_min = min(self.humidity_min, humidity)
+        self.humidity_max = max(self.humidity_max, humidity)
+        self.rolling_stats['temperature'].add(timestamp, temperature)
+        self.rolling_stats['humidity'].add(timestamp, humidity)
+
+    def latest(self):
+        """ Get the newest sample as (timestamp, temperature, humidity), or None if there are none.
+        """
+        return self.samples[-1] if self.samples else None
+
+    def readings(self):
+        """ Get the newest sample and the statistics of each value by their names in rules (e.g.
+            temperature and temperature-ewma), empty if there are no samples.
+        """
+        latest = self.latest()
+        if latest is None:
+            return {}
+        return dict(zip(INPUTS, latest[1:] + tuple(result for value in VALUES
+                                                   for result in self.rolling_stats[value].stats())))
+
+    def stats(self):
+        """ Get the statistics of each value in the order of STATS_COLUMNS, rounded for storing.
+        """
+        return tuple(None if result is None else round(result, 3)
+                     for value in VALUES for result in self.rolling_stats[value].stats())
+
+    def flush(self):
+        """ Get the mean, minimum and maximum of each value since the last flush as (count,
+            temperature, minimum, maximum, humidity, minimum, maximum) and start again. Returns
+            None if there have been no samples.
+        """
+        if not self.count:
+            return None
+        aggregate = (self.count, round(self.temperature_sum / self.count, 2), self.temperature_min,
+                     self.temperature_max, round(self.humidity_sum / self.count, 2), self.humidity_min,
+                     self.humidity_max)
+        self.reset()
+        return aggregate
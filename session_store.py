@@ -0,0 +1,108 @@
+#
+# session_store
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import collections
+import threading
+import sqlite3
+import time
+import web
+
+
+class SessionStore(web.session.Store):
+    """ Sessions held in memory, least recently used first. Sessions unused for longer than the
+        timeout are evicted from the front as they are found, as is the oldest when there are
+        too many. With a path the sessions are also kept in an SQLite database so they survive
+        restarts, written when the data in a session changes and otherwise only every touch
+        interval to record it is still in use (not on every request).
+    """
+
+    def __init__(self, timeout, max_sessions, path=None, touch_interval=60):
+        self.timeout = timeout
+        self.max_sessions = max_sessions
+        self.touch_interval = touch_interval
+        self.lock = threading.Lock()
+        # Session id to (last used, data).
+        self.sessions = collections.OrderedDict()
+        # Session id to the last used time as it is in the database.
+        self.written = {}
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, atime REAL, '
+                            'data BLOB)')
+            self.db.execute('DELETE FROM sessions WHERE atime<?', (time.time() - timeout,))
+            self.db.commit()
+            for session_id, atime, data in self.db.execute('SELECT session_id, atime, data FROM sessions '
+                                                           'ORDER BY atime'):
+                self.sessions[session_id] = (atime, self.decode(data))
+                self.written[session_id] = atime
+
+    def evict(self, now):
+        # Least recently used are at the front so stop at the first still in use.
+        expired = []
+        while self.sessions:
+            session_id, (atime, data) = next(iter(self.sessions.items()))
+            if now - atime <= self.timeout and len(self.sessions) <= self.max_sessions:
+                break
+            del self.sessions[session_id]
+            self.written.pop(session_id, None)
+            expired.append((session_id,))
+        if expired and self.db is not None:
+            self.db.executemany('DELETE FROM sessions WHERE session_id=?', expired)
+            self.db.commit()
+
+    def touch(self, key, now):
+        # Record a session is still in use so it is not purged after a restart, at most every touch interval.
+        if self.db is not None and key in self.written and now - self.written[key] >= self.touch_interval:
+            self.db.execute('UPDATE sessions SET atime=? WHERE session_id=?', (now, key))
+            self.db.commit()
+            self.written[key] = now
+
+    def __contains__(self, key):
+        with self.lock:
+            self.evict(time.time())
+            return key in self.sessions
+
+    def __getitem__(self, key):
+        with self.lock:
+            now = time.time()
+            self.evict(now)
+            atime, data = self.sessions[key]
+            self.sessions[key] = (now, data)
+            self.sessions.move_to_end(key)
+            self.touch(key, now)
+            return dict(data)
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            now = time.time()
+            changed = key not in self.sessions or self.sessions[key][1] != value
+            self.sessions[key] = (now, dict(value))
+            self.sessions.move_to_end(key)
+            if changed and self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO sessions VALUES (?,?,?)', (key, now, self.encode(value)))
+                self.db.commit()
+                self.written[key] = now
+            else:
+                self.touch(key, now)
+            self.evict(now)
+
+    def __delitem__(self, key):
+        with self.lock:
+            self.sessions.pop(key, None)
+            self.written.pop(key, None)
+            if self.db is not None:
+                self.db.execute('DELETE FROM sessions WHERE session_id=?', (key,))
+                self.db.commit()
+
+    def cleanup(self, timeout):
+        with self.lock:
+            self.evict(time.time())
@@ -0,0 +1,211 @@
+#
+# settings_file
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import threading
+import datetime
+import json
+import os
+import constants
+import enclosures
+import rules
+
+
+def boolean(value):
+    # Forms send booleans as strings.
+    if value in ('true', 'false'):
+        return value == 'true'
+    if isinstance(value, bool):
+        return value
+    raise ValueError('expected true or false')
+
+
+def number(kind, minimum=None, maximum=None):
+    """ Get a parser for an int or float setting within an optional range.
+    """
+    def parse(value):
+        if isinstance(value, bool):
+            raise ValueError('expected a number')
+        value = kind(value)
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            raise ValueError('expected a number from ' + str(minimum) + ' to ' + str(maximum))
+        return value
+    return parse
+
+
+def time_of_day(value):
+    # Written as HH:MM.
+    if isinstance(value, datetime.time):
+        return value
+    parts = str(value).split(':')
+    if len(parts) not in (2, 3):
+        raise ValueError('expected a time as HH:MM')
+    return datetime.time(int(parts[0]), int(parts[1]))
+
+
+def text(value):
+    if not isinstance(value, str):
+        raise ValueError('expected a string')
+    return value
+
+
+def text_list(value):
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError('expected a list of strings')
+    return value
+
+
+def rule_list(value):
+    # Each rule is checked when the rules are compiled.
+    if not isinstance(value, list) or not all(isinstance(rule, dict) for rule in value):
+        raise ValueError('expected a list of rules')
+    return value
+
+
+def enclosure_list(value):
+    # Enclosures can override any setting so their values are parsed the same way.
+    if not isinstance(value, list) or not all(isinstance(enclosure, dict) for enclosure in value):
+        raise ValueError('expected a list of enclosures')
+    return [parse_values(enclosure) for enclosure in value]
+
+
+# Parser and default for each setting. Settings without a default are left out unless given.
+SCHEMA = {
+    'low-temperature': (number(float, -40, 85), 15.0),
+    'high-temperature': (number(float, -40, 85), 25.0),
+    'low-humidity': (number(float, 0, 100), 60.0),
+    'light-on-time': (time_of_day, datetime.time(9, 0)),
+    'light-off-time': (time_of_day, datetime.time(16, 30)),
+    'heat-mat-auto': (boolean, False),
+    'pump-auto': (boolean, False),
+    'fan-auto': (boolean, False),
+    'light-auto': (boolean, False),
+    'update-frequency': (number(int, 1, 3600), 120),
+    'days-to-keep': (number(int, 1, 365), 7),
+    'archive-readings': (boolean, True),
+    'temperature-hysteresis': (number(float, 0), constants.TEMPERATURE_HYSTERESIS),
+    'humidity-hysteresis': (number(float, 0), constants.HUMIDITY_HYSTERESIS),
+    'minimum-dwell': (number(int, 0), constants.MINIMUM_DWELL),
+    'smooth-control': (boolean, False),
+    'hardware': (text, None),
+    'metrics-token': (text, None),
+    'admins': (text_list, None),
+    'slow-request-threshold': (number(float, 0), 1.0),
+    'web-address': (text, '0.0.0.0'),
+    'web-port': (number(int, 1, 65535), 8080),
+    'web-threads': (number(int, 2, 100), 12),
+    'max-streams': (number(int, 1, 99), 6),
+    'tls-certificate': (text, None),
+    'tls-private-key': (text, None),
+    'timelapse-interval': (number(int, 0, 86400), 0),
+    'rules': (rule_list, None),
+    'enclosures': (enclosure_list, None),
+}
+
+
+def parse_values(values):
+    """ Convert the settings in values to their types, others (such as those describing the hardware of an
+        enclosure) are passed through. Raises ValueError naming the first invalid setting.
+    """
+    parsed = {}
+    for key, value in values.items():
+        if key in SCHEMA:
+            try:
+                value = SCHEMA[key][0](value)
+            except (TypeError, ValueError) as e:
+                raise ValueError("Invalid setting '" + key + "': " + str(e) + '.')
+        parsed[key] = value
+    return parsed
+
+
+def parse(values):
+    """ Validate settings and convert them to their types, filling in defaults for any missing.
+        The enclosures and rules are checked by building them.
+    """
+    parsed = {key: default for key, (parser, default) in SCHEMA.items() if default is not None}
+    parsed.update(parse_values(values))
+    # Streams must always leave some workers for other requests.
+    if parsed['max-streams'] >= parsed['web-threads']:
+        raise ValueError("Invalid setting 'max-streams': expected fewer than the web threads.")
+    if ('tls-certificate' in parsed) != ('tls-private-key' in parsed):
+        raise ValueError("Invalid setting 'tls-certificate': expected both a certificate and a private key.")
+    try:
+        configured_enclosures = enclosures.from_settings(parsed)
+    except (TypeError, KeyError) as e:
+        raise ValueError('Invalid enclosures: ' + str(e) + '.')
+    for enclosure in configured_enclosures:
+        rules.compile_rules(enclosure.settings, enclosure.devices)
+    return parsed
+
+
+def serialise(values):
+    """ Convert parsed settings back to what is written to the file (times as HH:MM).
+    """
+    if isinstance(values, dict):
+        return {key: serialise(value) for key, value in values.items()}
+    if isinstance(values, list):
+        return [serialise(value) for value in values]
+    if isinstance(values, datetime.time):
+        return values.strftime('%H:%M')
+    return values
+
+
+class SettingsFile:
+    """ The settings file, parsed and validated once each time it changes. The settings returned
+        are shared so must not be modified. Saving replaces the file whole so it is never seen
+        part written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.key = None
+        self.values = None
+        self.error = None
+
+    def stat_key(self):
+        # Replacing the file always changes the inode even if the mtime does not.
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def changed(self):
+        """ Check if the file has changed since it was last loaded.
+        """
+        return self.stat_key() != self.key
+
+    def load(self):
+        """ Get the settings, only reading the file if it has changed. Raises ValueError if the
+            file is invalid (until it changes again).
+        """
+        key = self.stat_key()
+        with self.lock:
+            if key != self.key:
+                try:
+                    with open(self.path, 'rt') as f:
+                        self.values, self.error = parse(json.load(f)), None
+                except ValueError as e:
+                    self.error = e
+                self.key = key
+            if self.error is not None:
+                raise self.error
+            return self.values
+
+    def save(self, values):
+        """ Validate and write the settings, returning them parsed.
+        """
+        values = parse(values)
+        temporary = self.path + '.tmp'
+        with self.lock:
+            with open(temporary, 'wt') as f:
+                f.write(json.dumps(serialise(values), indent=4))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.path)
+        return values
@@ -0,0 +1,121 @@
+#
+# static_files
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import threading
+import mimetypes
+import datetime
+import hashlib
+import gzip
+import time
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # Optional, gzip is used if it is not installed.
+
+# Types worth compressing, images are already compressed.
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+class Asset:
+    """ A file held in memory with its ETag and any compressed variants.
+    """
+
+    def __init__(self, filename):
+        stat = os.stat(filename)
+        with open(filename, 'rb') as f:
+            self.data = f.read()
+        self.mtime = stat.st_mtime
+        self.last_checked = time.monotonic()
+        self.last_modified = datetime.datetime.fromtimestamp(stat.st_mtime)
+        self.content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        self.etag = hashlib.sha256(self.data).hexdigest()[:16]
+        # Variants by content encoding, only kept if they are actually smaller.
+        self.variants = {}
+        if self.content_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(self.data, 9)
+            if len(compressed) < len(self.data):
+                self.variants['gzip'] = compressed
+            if brotli:
+                compressed = brotli.compress(self.data)
+                if len(compressed) < len(self.data):
+                    self.variants['br'] = compressed
+
+    def encode(self, accept_encoding):
+        """ Choose the smallest variant the client accepts. Returns the encoding (None for
+            identity) and the data.
+        """
+        accepted = [encoding.split(';')[0].strip() for encoding in accept_encoding.split(',')]
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.variants:
+                return encoding, self.variants[encoding]
+        return None, self.data
+
+
+class StaticFiles:
+    """ Files under a directory cached in memory. Each file is checked for changes at most once
+        every check interval and reloaded if its mtime has changed.
+    """
+
+    def __init__(self, root, check_interval=2):
+        self.root = os.path.realpath(root)
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.assets = {}
+
+    def path(self, name):
+        """ Get the full path for a name, or None if it is outside the root.
+        """
+        path = os.path.realpath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep):
+            return None
+        return path
+
+    def load_all(self):
+        """ Load every file up front so the first requests do not touch the disk.
+        """
+        for directory, directories, filenames in os.walk(self.root):
+            for filename in filenames:
+                self.get(os.path.relpath(os.path.join(directory, filename), self.root))
+
+    def get(self, name):
+        """ Get the asset for a name relative to the root, or None if there is no such file.
+        """
+        path = self.path(name)
+        if path is None:
+            return None
+        with self.lock:
+            asset = self.assets.get(path)
+        if asset is not None and time.monotonic() - asset.last_checked < self.check_interval:
+            return asset
+        try:
+            if asset is not None and os.path.getmtime(path) == asset.mtime:
+                asset.last_checked = time.monotonic()
+                return asset
+            if not os.path.isfile(path):
+                raise FileNotFoundError(path)
+            asset = Asset(path)
+        except OSError:
+            with self.lock:
+                self.assets.pop(path, None)
+            return None
+        with self.lock:
+            self.assets[path] = asset
+        return asset
+
+    def url(self, url):
+        """ Add a content hash to a url under files/ so it can be cached indefinitely.
+        """
+        asset = self.get(url.split('files/', 1)[1])
+        if asset is None:
+            return url
+        return url + '?v=' + asset.etag
@@ -0,0 +1,87 @@
+#
+# test_archive
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import unittest
+import tempfile
+import calendar
+import os
+import archive
+
+# 2020-06-30 23:00:00 UTC, readings either side of midnight fall in different months.
+START = calendar.timegm((2020, 6, 30, 23, 0, 0))
+
+
+def readings(enclosure_id, count, start=START, step=60):
+    return [(start + i * step, enclosure_id, round(20 + i / 100, 2), round(60 - i / 100, 2)) for i in range(count)]
+
+
+class TestEncoding(unittest.TestCase):
+
+    def test_round_trip(self):
+        blocks = {0: [(START, 21.25, 55.5), (START + 60, -10.01, 99.99)], 3: [(START + 5, 0.0, 0.0)]}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, archive.month_name(START))
+            with open(path, 'wb') as f:
+                f.write(archive.encode(blocks))
+            self.assertEqual(archive.MonthFile(path).readings(), blocks)
+
+    def test_out_of_range_values_clamped(self):
+        self.assertEqual(archive.to_fixed(1000), archive.VALUE_LIMIT)
+        self.assertEqual(archive.to_fixed(-1000), -archive.VALUE_LIMIT)
+        self.assertEqual(archive.to_fixed(12.345), 1234)
+
+    def test_not_an_archive(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bad' + archive.SUFFIX)
+            with open(path, 'wb') as f:
+                f.write(b'NOPE' + b'\0' * 32)
+            with self.assertRaises(ValueError):
+                archive.MonthFile(path)
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = archive.Archive(os.path.join(self.directory.name, 'archive'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_add_and_read(self):
+        added = readings(0, 120) + readings(1, 30)
+        self.archive.add(added)
+        self.assertEqual(sorted(os.listdir(self.archive.path)), ['2020-06.vca', '2020-07.vca'])
+        timestamps, temperatures, humidities = self.archive.read(0, START, START + 7200)
+        self.assertEqual(list(zip(timestamps, temperatures, humidities)),
+                         [(reading[0], reading[2], reading[3]) for reading in added if reading[1] == 0])
+
+    def test_read_range(self):
+        self.archive.add(readings(0, 120))
+        timestamps = self.archive.read(0, START + 1800, START + 3600)[0]
+        self.assertEqual(list(timestamps), list(range(START + 1800, START + 3601, 60)))
+        self.assertEqual(len(self.archive.read(2, START, START + 7200)[0]), 0)
+
+    def test_add_merges_and_replaces(self):
+        self.archive.add(readings(0, 10))
+        self.archive.add([(START + 60, 0, 30.0, 40.0), (START + 30, 0, 1.0, 2.0)])
+        timestamps, temperatures, humidities = self.archive.read(0, START, START + 600)
+        self.assertEqual(len(timestamps), 11)
+        self.assertEqual((temperatures[1], humidities[1]), (1.0, 2.0))
+        self.assertEqual((temperatures[2], humidities[2]), (30.0, 40.0))
+
+    def test_missing_values_skipped(self):
+        self.archive.add([(START, 0, None, 50.0), (START + 60, 0, 20.0, 50.0)])
+        self.assertEqual(list(self.archive.read(0, START, START + 60)[0]), [START + 60])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#
+# test_camera
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import unittest
+import threading
+from camera import CameraBroadcaster, FakeCameraSource, FrameOutput, TEST_PATTERN
+
+FRAMES = (b'\xff\xd8one\xff\xd9', b'\xff\xd8two\xff\xd9')
+
+
+class TrackedSource(FakeCameraSource):
+    """ Fake source recording whether it has been started and stopped.
+    """
+
+    def __init__(self, frames, framerate):
+        FakeCameraSource.__init__(self, frames, framerate)
+        self.started = False
+        self.stopped_at_end = False
+
+    def start(self, callback):
+        self.started = True
+        FakeCameraSource.start(self, callback)
+
+    def stop(self):
+        FakeCameraSource.stop(self)
+        self.stopped_at_end = True
+
+
+class TestFrameOutput(unittest.TestCase):
+
+    def test_splits_frames(self):
+        frames = []
+        output = FrameOutput(frames.append)
+        for chunk in (FRAMES[0][:3], FRAMES[0][3:], FRAMES[1]):
+            output.write(chunk)
+        # The last frame is only complete once the next one starts.
+        self.assertEqual(frames, [FRAMES[0]])
+        output.write(FRAMES[0])
+        self.assertEqual(frames, list(FRAMES))
+
+
+class TestCameraBroadcaster(unittest.TestCase):
+
+    def setUp(self):
+        self.sources = []
+        self.threads = []
+        self.broadcaster = self.create_broadcaster(100)
+
+    def tearDown(self):
+        self.broadcaster.close()
+        for thread in self.threads:
+            thread.join(5)
+
+    def create_broadcaster(self, framerate):
+        def source_factory():
+            self.sources.append(TrackedSource(FRAMES, framerate))
+            return self.sources[-1]
+        return CameraBroadcaster(source_factory)
+
+    def add_viewer(self):
+        self.broadcaster.add_viewer()
+        # The thread is detached before the source is stopped so hold on to it to wait for both.
+        if self.broadcaster.thread not in self.threads:
+            self.threads.append(self.broadcaster.thread)
+
+    def wait_stopped(self):
+        for thread in self.threads:
+            thread.join(5)
+
+    def test_viewer_gets_newer_frames(self):
+        self.add_viewer()
+        number, frame = self.broadcaster.wait_frame(0, 5)
+        self.assertIn(frame, FRAMES)
+        next_number, next_frame = self.broadcaster.wait_frame(number, 5)
+        self.assertGreater(next_number, number)
+        self.assertIn(next_frame, FRAMES)
+        self.broadcaster.remove_viewer()
+
+    def test_one_source_for_all_viewers(self):
+        for i in range(3):
+            self.add_viewer()
+        self.broadcaster.wait_frame(0, 5)
+        self.assertEqual(len(self.sources), 1)
+        self.broadcaster.remove_viewer()
+        self.broadcaster.remove_viewer()
+        self.assertFalse(self.sources[0].stopped_at_end)
+        self.broadcaster.remove_viewer()
+        self.wait_stopped()
+        self.assertTrue(self.sources[0].stopped_at_end)
+
+    def test_restarts_for_a_new_viewer(self):
+        self.add_viewer()
+        self.broadcaster.wait_frame(0, 5)
+        self.broadcaster.remove_viewer()
+        self.wait_stopped()
+        self.add_viewer()
+        number, frame = self.broadcaster.wait_frame(0, 5)
+        self.assertIsNotNone(frame)
+        self.assertEqual(len(self.sources), 2)
+        self.assertTrue(self.sources[1].started)
+        self.broadcaster.remove_viewer()
+
+    def test_no_frame_without_a_camera(self):
+        self.assertEqual(self.broadcaster.wait_frame(0, 0.1), (0, None))
+        self.assertEqual(self.sources, [])
+
+    def test_close_ends_viewers(self):
+        # Slow enough that the viewer is still waiting for the second frame when closed.
+        self.broadcaster = self.create_broadcaster(0.1)
+        self.add_viewer()
+        number, frame = self.broadcaster.wait_frame(0, 5)
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(self.broadcaster.wait_frame(number, 5)))
+        waiter.start()
+        waiter.join(0.2)
+        self.broadcaster.close()
+        waiter.join(5)
+        self.assertEqual(results, [(number, None)])
+        self.wait_stopped()
+        self.assertTrue(self.sources[0].stopped_at_end)
+        # Nothing is started once closed.
+        self.broadcaster.remove_viewer()
+        self.broadcaster.add_viewer()
+        self.assertIsNone(self.broadcaster.thread)
+
+    def test_default_frames_are_the_test_pattern(self):
+        self.assertEqual(FakeCameraSource().frames, (TEST_PATTERN,))
+        self.assertTrue(TEST_PATTERN.startswith(b'\xff\xd8') and TEST_PATTERN.endswith(b'\xff\xd9'))
+
+
+if __name__ == '__main__':
+    unittest.main()
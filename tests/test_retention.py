@@ -0,0 +1,75 @@
+#
+# test_retention
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import unittest
+import threading
+import tempfile
+import calendar
+import os
+import database
+import retention
+from archive import Archive, month_name
+
+# 2020-05-20 00:00:00 UTC, readings every hour from here run into July.
+START = calendar.timegm((2020, 5, 20, 0, 0, 0))
+
+
+class CountingArchive(Archive):
+    """ Archive recording the months each call to add wrote.
+    """
+
+    def __init__(self, path):
+        Archive.__init__(self, path)
+        self.writes = []
+
+    def add(self, readings):
+        self.writes.append(sorted(set(month_name(reading[0]) for reading in readings)))
+        Archive.add(self, readings)
+
+
+class TestArchiveReadings(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = database.connect(os.path.join(self.directory.name, 'vivarium_ctrl.db'))
+        database.migrate(self.db)
+        self.timestamps = list(range(START, START + 50 * 86400, 3600))
+        self.db.executemany('INSERT INTO sensor_readings (reading_timestamp, temperature, humidity, comments, '
+                            'enclosure_id) VALUES (?,?,?,?,?)',
+                            [(timestamp, 20.5, 60.25, '', enclosure_id)
+                             for timestamp in self.timestamps for enclosure_id in (0, 1)])
+        self.db.commit()
+        self.archive = CountingArchive(os.path.join(self.directory.name, 'archive'))
+
+    def tearDown(self):
+        self.db.close()
+        self.directory.cleanup()
+
+    def test_each_month_written_once(self):
+        cutoff = calendar.timegm((2020, 7, 2, 0, 0, 0))
+        moved = retention.archive_readings(self.db, cutoff, self.archive, 100)
+        expected = [timestamp for timestamp in self.timestamps if timestamp < cutoff]
+        self.assertEqual(moved, 2 * len(expected))
+        self.assertEqual(self.archive.writes, [['2020-05.vca'], ['2020-06.vca'], ['2020-07.vca']])
+        self.assertEqual(self.db.execute('SELECT MIN(reading_timestamp) FROM sensor_readings').fetchone()[0],
+                         cutoff)
+        for enclosure_id in (0, 1):
+            self.assertEqual(list(self.archive.read(enclosure_id, START, cutoff)[0]), expected)
+
+    def test_stopped(self):
+        stop = threading.Event()
+        stop.set()
+        self.assertEqual(retention.archive_readings(self.db, START + 86400, self.archive, 100, stop), 0)
+        self.assertEqual(self.archive.writes, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#
+# test_rolling
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import unittest
+from rolling import Ewma, RollingWindow, RollingStats
+
+
+class TestEwma(unittest.TestCase):
+
+    def test_seeded_with_first_value(self):
+        ewma = Ewma(60)
+        self.assertIsNone(ewma.value)
+        ewma.add(0, 20)
+        self.assertEqual(ewma.value, 20)
+
+    def test_half_life(self):
+        ewma = Ewma(60)
+        ewma.add(0, 20)
+        ewma.add(60, 30)
+        self.assertAlmostEqual(ewma.value, 25)
+        # Uneven spacing, two half lives leave a quarter of the old value.
+        ewma.add(180, 5)
+        self.assertAlmostEqual(ewma.value, 10)
+
+    def test_same_time_has_no_weight(self):
+        ewma = Ewma(60)
+        ewma.add(0, 20)
+        ewma.add(0, 30)
+        self.assertEqual(ewma.value, 20)
+
+
+class TestRollingWindow(unittest.TestCase):
+
+    def test_empty(self):
+        window = RollingWindow(10)
+        self.assertEqual((window.mean, window.minimum, window.maximum, window.slope), (None, None, None, None))
+
+    def test_expiry(self):
+        window = RollingWindow(10)
+        for timestamp, value in ((0, 4), (5, 8), (10, 6)):
+            window.add(timestamp, value)
+        # The value from exactly the window ago has gone.
+        self.assertEqual(len(window.values), 2)
+        self.assertAlmostEqual(window.mean, 7)
+        window.expire(10)
+        self.assertEqual((window.mean, window.minimum, window.maximum), (None, None, None))
+        self.assertIsNone(window.origin)
+
+    def test_minimum_and_maximum(self):
+        window = RollingWindow(10)
+        for timestamp, value in ((0, 1), (2, 9), (4, 5), (6, 3), (8, 7)):
+            window.add(timestamp, value)
+        self.assertEqual((window.minimum, window.maximum), (1, 9))
+        # Values which can never be the minimum or maximum are not kept.
+        self.assertEqual(list(window.minimums), [(0, 1), (6, 3), (8, 7)])
+        self.assertEqual(list(window.maximums), [(2, 9), (8, 7)])
+        window.add(10, 4)
+        self.assertEqual((window.minimum, window.maximum), (3, 9))
+        window.add(12, 4)
+        self.assertEqual((window.minimum, window.maximum), (3, 7))
+
+    def test_slope(self):
+        window = RollingWindow(100)
+        window.add(0, 5)
+        self.assertIsNone(window.slope)
+        window.add(0, 6)
+        self.assertIsNone(window.slope)
+        window.add(10, 11)
+        self.assertAlmostEqual(window.slope, 0.55)
+
+    def test_slope_after_rebase(self):
+        window = RollingWindow(60)
+        for timestamp in range(0, 1000, 5):
+            window.add(timestamp, 20 + 0.01 * timestamp)
+        self.assertGreater(window.origin, 900)
+        self.assertAlmostEqual(window.slope, 0.01)
+        self.assertAlmostEqual(window.mean, 20 + 0.01 * 967.5)
+
+
+class TestRollingStats(unittest.TestCase):
+
+    def test_stats(self):
+        stats = RollingStats(60, 30)
+        self.assertEqual(stats.stats(), (None, None, None, None, None))
+        stats.add(0, 20)
+        self.assertEqual(stats.stats(), (20, 20, 20, 20, None))
+        stats.add(30, 21)
+        ewma, mean, minimum, maximum, rate = stats.stats()
+        self.assertAlmostEqual(ewma, 20.5)
+        self.assertAlmostEqual(mean, 20.5)
+        self.assertEqual((minimum, maximum), (20, 21))
+        # Per hour rather than per second.
+        self.assertAlmostEqual(rate, 120)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#
+# test_rollups
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import unittest
+import math
+import sqlite3
+import rollups
+import database
+from downsample import lttb, downsample
+
+
+class TestChooseResolution(unittest.TestCase):
+
+    def test_raw_when_few_enough(self):
+        self.assertEqual(rollups.choose_resolution(86400, 500, 500), 0)
+
+    def test_finest_that_fits(self):
+        self.assertEqual(rollups.choose_resolution(86400, 86400, 1000), rollups.HOUR)
+        self.assertEqual(rollups.choose_resolution(3 * 3600, 10800, 500), rollups.MINUTE)
+        self.assertEqual(rollups.choose_resolution(365 * 86400, 10 ** 6, 500), rollups.DAY)
+
+    def test_coarsest_when_none_fit(self):
+        self.assertEqual(rollups.choose_resolution(10 ** 5 * 86400, 10 ** 7, 10), rollups.DAY)
+
+
+class TestBackfill(unittest.TestCase):
+
+    def test_migration_builds_rollups(self):
+        db = sqlite3.connect(':memory:')
+        db.execute('CREATE TABLE sensor_readings (reading_datetime TEXT, temperature TEXT, humidity TEXT, '
+                   'comments TEXT)')
+        db.executemany('INSERT INTO sensor_readings VALUES (?, ?, ?, ?)',
+                       [('2020-05-01 10:0' + str(minute) + ':' + second, str(20 + minute), '60', '')
+                        for minute in range(3) for second in ('00', '30')])
+        db.commit()
+        database.migrate(db)
+        rows = db.execute('SELECT resolution, count, temperature_sum, temperature_min, temperature_max '
+                          'FROM sensor_rollups ORDER BY resolution, bucket_timestamp').fetchall()
+        self.assertEqual(rows, [(rollups.MINUTE, 2, 40.0, 20.0, 20.0), (rollups.MINUTE, 2, 42.0, 21.0, 21.0),
+                                (rollups.MINUTE, 2, 44.0, 22.0, 22.0), (rollups.HOUR, 6, 126.0, 20.0, 22.0),
+                                (rollups.DAY, 6, 126.0, 20.0, 22.0)])
+
+
+class TestLttb(unittest.TestCase):
+
+    def test_keeps_everything_below_threshold(self):
+        self.assertEqual(lttb([0, 1, 2], [0, 1, 2], 5), [0, 1, 2])
+        self.assertEqual(lttb([0, 1, 2, 3], [0, 1, 2, 3], 2), [0, 1, 2, 3])
+
+    def test_keeps_ends_and_count(self):
+        x = list(range(1000))
+        y = [math.sin(i / 50) for i in x]
+        indices = lttb(x, y, 100)
+        self.assertEqual(len(indices), 100)
+        self.assertEqual((indices[0], indices[-1]), (0, 999))
+        self.assertEqual(indices, sorted(set(indices)))
+
+    def test_keeps_spike(self):
+        x = list(range(100))
+        y = [0] * 100
+        y[42] = 10
+        self.assertIn(42, lttb(x, y, 10))
+
+    def test_downsample_parallel(self):
+        timestamps = list(range(1000))
+        temperatures = [20 + math.sin(t / 30) for t in timestamps]
+        humidities = [60 + math.cos(t / 70) for t in timestamps]
+        result = downsample(timestamps, temperatures, humidities, 100)
+        self.assertLessEqual(len(result[0]), 100)
+        for t, temperature, humidity in zip(*result):
+            self.assertEqual((temperature, humidity), (temperatures[t], humidities[t]))
+        self.assertIs(downsample(timestamps, temperatures, humidities, 1000)[0], timestamps)
+
+
+if __name__ == '__main__':
+    unittest.main()
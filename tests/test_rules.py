@@ -0,0 +1,141 @@
+#
+# test_rules
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import unittest
+import rules
+import enclosures
+from device_store import DeviceStore
+
+AUTO_SETTINGS = {'low-temperature': 15.0, 'high-temperature': 25.0, 'low-humidity': 60.0,
+                 'light-on-time': '09:00', 'light-off-time': '16:30', 'heat-mat-auto': True, 'pump-auto': True,
+                 'fan-auto': True, 'light-auto': True}
+
+PID_RULE = {'type': 'pid', 'device': 'fan', 'input': 'temperature', 'setpoint': 26, 'kp': 0.5, 'reverse': True}
+
+
+class TestThresholdRule(unittest.TestCase):
+
+    def test_below_with_hysteresis(self):
+        rule = rules.ThresholdRule('heat-mat', 'temperature', below=20, hysteresis=1)
+        states = [rule.evaluate(0, {'temperature': value}) for value in (21, 20, 20.5, 20.9, 21, 20.5)]
+        self.assertEqual(states, [False, True, True, True, False, False])
+        # Would have switched off at 20.5 and 20.9 without the band, once as it stayed on.
+        self.assertEqual(rule.suppressed, 1)
+
+    def test_above(self):
+        rule = rules.ThresholdRule('fan', 'temperature', above=30, hysteresis=2)
+        states = [rule.evaluate(0, {'temperature': value}) for value in (29, 30, 28.5, 28)]
+        self.assertEqual(states, [False, True, True, False])
+
+    def test_no_reading(self):
+        rule = rules.ThresholdRule('pump', 'humidity', below=60)
+        self.assertIsNone(rule.evaluate(0, {}))
+
+    def test_needs_one_threshold(self):
+        with self.assertRaises(ValueError):
+            rules.ThresholdRule('pump', 'humidity')
+        with self.assertRaises(ValueError):
+            rules.ThresholdRule('pump', 'humidity', below=50, above=70)
+
+
+class TestPidRule(unittest.TestCase):
+
+    def test_duty_cycle(self):
+        rule = rules.PidRule('heat-mat', 'temperature', setpoint=25, kp=0.25, period=100)
+        # Half duty, on for the first half of each period.
+        self.assertTrue(rule.evaluate(10, {'temperature': 23}))
+        self.assertFalse(rule.evaluate(60, {'temperature': 23}))
+        self.assertEqual(rule.duty, 0.5)
+
+    def test_duty_is_limited(self):
+        rule = rules.PidRule('fan', 'temperature', setpoint=25, kp=1, reverse=True)
+        rule.evaluate(0, {'temperature': 40})
+        self.assertEqual(rule.duty, 1)
+        rule.evaluate(1, {'temperature': 10})
+        self.assertEqual(rule.duty, 0)
+
+
+class TestRuleEngine(unittest.TestCase):
+
+    def test_any_rule_on(self):
+        engine = rules.RuleEngine([rules.ThresholdRule('fan', 'temperature', above=30),
+                                   rules.ThresholdRule('fan', 'humidity', above=90)])
+        self.assertEqual(engine.evaluate(0, {'temperature': 20, 'humidity': 95}, {'fan': False}), {'fan': True})
+        self.assertEqual(engine.evaluate(1, {'temperature': 20, 'humidity': 95}, {'fan': True}), {})
+
+    def test_minimum_dwell(self):
+        engine = rules.RuleEngine([rules.ThresholdRule('pump', 'humidity', below=60, min_on=10, min_off=10)])
+        self.assertEqual(engine.evaluate(0, {'humidity': 70}, {'pump': False}), {})
+        self.assertEqual(engine.evaluate(1, {'humidity': 50}, {'pump': False}), {'pump': True})
+        # Held on until it has been on for the minimum, counted once however long it is held.
+        self.assertEqual(engine.evaluate(2, {'humidity': 70}, {'pump': True}), {})
+        self.assertEqual(engine.evaluate(5, {'humidity': 70}, {'pump': True}), {})
+        self.assertEqual(engine.suppressed, 1)
+        self.assertEqual(engine.evaluate(11, {'humidity': 70}, {'pump': True}), {'pump': False})
+
+    def test_carry_over(self):
+        engine = rules.RuleEngine([rules.ThresholdRule('pump', 'humidity', below=60, min_off=10)])
+        engine.evaluate(0, {'humidity': 70}, {'pump': True})
+        reloaded = rules.RuleEngine([rules.ThresholdRule('pump', 'humidity', below=60, min_off=10)])
+        reloaded.carry_over(engine)
+        self.assertEqual(reloaded.evaluate(5, {'humidity': 50}, {'pump': False}), {})
+
+    def test_reload_with_new_device(self):
+        started = enclosures.from_settings(dict(AUTO_SETTINGS, enclosures=[{'sockets': {'fan': 1}}]))[0]
+        devices = DeviceStore((started.id, device) for device in started.devices)
+        reloaded = enclosures.from_settings(dict(AUTO_SETTINGS, enclosures=[{'sockets': {'fan': 1, 'pump': 2}}]))[0]
+        engine = rules.compile_rules(reloaded.settings, reloaded.devices)
+        # Only the devices set up when starting have a state, the pump is left alone until a restart.
+        states = {device: devices.get((reloaded.id, device)) for device in reloaded.devices
+                  if (reloaded.id, device) in devices.states}
+        self.assertEqual(engine.evaluate(0, {'temperature': 30, 'humidity': 50}, states), {'fan': True})
+
+
+class TestCompileRules(unittest.TestCase):
+
+    def test_from_automatic_settings(self):
+        engine = rules.compile_rules(AUTO_SETTINGS, ['heat-mat', 'pump', 'fan', 'light'])
+        self.assertEqual([type(rule) for rule in engine.rules],
+                         [rules.ThresholdRule, rules.ThresholdRule, rules.ThresholdRule, rules.ScheduleRule])
+        self.assertEqual([rule.min_on for rule in engine.rules], [rules.SETTING_DEFAULTS['minimum-dwell']] * 3 + [0])
+
+    def test_smooth_control(self):
+        definitions = rules.rule_definitions(dict(AUTO_SETTINGS, **{'smooth-control': True}))
+        self.assertEqual([definition.get('input') for definition in definitions],
+                         ['temperature-ewma', 'temperature-ewma', 'humidity-ewma', None])
+
+    def test_missing_devices_left_out(self):
+        engine = rules.compile_rules(AUTO_SETTINGS, ['fan'])
+        self.assertEqual([rule.device for rule in engine.rules], ['fan'])
+
+    def test_declared_rules(self):
+        engine = rules.compile_rules({'rules': [{'type': 'pid', 'device': 'heat-mat', 'input': 'temperature-ewma',
+                                                 'setpoint': 26, 'kp': 0.5, 'min-on': 30}]}, ['heat-mat'])
+        self.assertIsInstance(engine.rules[0], rules.PidRule)
+        self.assertEqual(engine.rules[0].min_on, 30)
+
+    def test_invalid_rules(self):
+        for definition in ({'type': 'magic', 'device': 'fan'},
+                           {'type': 'threshold', 'device': 'fan', 'input': 'pressure', 'above': 1},
+                           {'type': 'threshold', 'device': 'fan', 'input': 'temperature', 'above': 1, 'colour': 1},
+                           dict(PID_RULE, period=0),
+                           dict(PID_RULE, period=-600),
+                           dict(PID_RULE, period='600'),
+                           dict(PID_RULE, period=float('inf')),
+                           dict(PID_RULE, kp=float('nan')),
+                           dict(PID_RULE, ki=float('inf')),
+                           dict(PID_RULE, setpoint=float('nan'))):
+            with self.assertRaises(ValueError):
+                rules.compile_rules({'rules': [definition]}, ['fan'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+#
+# timelapse
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import threading
+import struct
+import mmap
+import time
+import os
+import metrics
+
+# File header: magic, format version, number of index slots, size of the data area, sequence of the
+# next frame and the position the next frame is written from.
+MAGIC = b'VCTL'
+VERSION = 1
+HEADER = struct.Struct('<4sHxxIQQQ')
+
+# Index entry for each frame: timestamp, position and length. The index is itself a ring with the
+# frame with sequence s in slot s % index slots.
+INDEX_ENTRY = struct.Struct('<dQI4x')
+
+# The data area starts on a page boundary.
+ALIGNMENT = mmap.PAGESIZE
+
+TIMELAPSE_FRAMES = metrics.Counter('timelapse_frames_total', 'Frames recorded for the time-lapse.')
+
+
+def is_jpeg(frame):
+    # A frame torn by a crash part way through writing will not start and end as a JPEG.
+    return frame[:2] == b'\xff\xd8' and frame[-2:] == b'\xff\xd9'
+
+
+class FrameRing:
+    """ Frames kept in a fixed size file allocated up front, the newest overwriting the oldest.
+        Positions only ever increase, a frame's offset in the data area is its position modulo
+        the size of the data area and a frame is still there as long as its position is no more
+        than a data area behind the end. Frames are never split across the end of the data area,
+        the rest of it is skipped instead. Frames are read straight from the mapped file.
+    """
+
+    def __init__(self, path, index_slots, data_size):
+        self.path = path
+        self.lock = threading.Lock()
+        self.index_offset = HEADER.size
+        self.data_offset = -(-(HEADER.size + index_slots * INDEX_ENTRY.size) // ALIGNMENT) * ALIGNMENT
+        self.index_slots = index_slots
+        self.data_size = data_size
+        if not self.valid():
+            self.create()
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.next_sequence, self.end = HEADER.unpack_from(self.map, 0)[4:]
+
+    def valid(self):
+        # Made again if missing or sized differently (the frames in it are lost).
+        try:
+            with open(self.path, 'rb') as f:
+                header = HEADER.unpack(f.read(HEADER.size))
+        except (OSError, struct.error):
+            return False
+        return header[:4] == (MAGIC, VERSION, self.index_slots, self.data_size) and \
+            os.path.getsize(self.path) == self.data_offset + self.data_size
+
+    def create(self):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.index_slots, self.data_size, 0, 0))
+            # Allocated now so recording can never run out of space.
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, self.data_offset + self.data_size)
+            else:
+                f.truncate(self.data_offset + self.data_size)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    def close(self):
+        with self.lock:
+            self.map.close()
+            self.file.close()
+
+    def append(self, timestamp, frame):
+        """ Add a frame, overwriting the oldest frames as needed.
+        """
+        if len(frame) > self.data_size:
+            raise ValueError('Frame of ' + str(len(frame)) + ' bytes is larger than the time-lapse file.')
+        with self.lock:
+            position = self.end
+            if position % self.data_size + len(frame) > self.data_size:
+                position += self.data_size - position % self.data_size
+            # Data first then the index entry then the header so a frame is only listed once written.
+            offset = self.data_offset + position % self.data_size
+            self.map[offset:offset + len(frame)] = frame
+            INDEX_ENTRY.pack_into(self.map, self.index_offset + self.next_sequence % self.index_slots *
+                                  INDEX_ENTRY.size, timestamp, position, len(frame))
+            self.next_sequence += 1
+            self.end = position + len(frame)
+            HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.index_slots, self.data_size, self.next_sequence,
+                             self.end)
+        TIMELAPSE_FRAMES.inc()
+
+    def entry(self, sequence):
+        return INDEX_ENTRY.unpack_from(self.map, self.index_offset + sequence % self.index_slots * INDEX_ENTRY.size)
+
+    def first_sequence(self):
+        # The oldest frame still in both the index and the data area, entries get newer as the sequence goes up.
+        low, high = max(self.next_sequence - self.index_slots, 0), self.next_sequence
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry(middle)[1] < self.end - self.data_size:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def sequences(self, from_timestamp=None, to_timestamp=None):
+        """ Get the range of sequences of the frames between two timestamps (all if not given).
+        """
+        with self.lock:
+            first = self.first_sequence()
+            return range(self.bisect(first, from_timestamp, False), self.bisect(first, to_timestamp, True))
+
+    def bisect(self, low, timestamp, after):
+        # The first sequence with a timestamp at or (if after) beyond the timestamp.
+        high = self.next_sequence
+        if timestamp is None:
+            return high if after else low
+        while low < high:
+            middle = (low + high) // 2
+            stamp = self.entry(middle)[0]
+            if stamp < timestamp or (after and stamp == timestamp):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def nearest(self, timestamp=None):
+        """ Get the sequence of the last frame at or before a timestamp (the latest if not given, the
+            oldest if all are after it), None if there are no frames.
+        """
+        frames = self.sequences(to_timestamp=timestamp)
+        if frames:
+            return frames[-1]
+        frames = self.sequences()
+        return frames[0] if frames else None
+
+    def frame(self, sequence):
+        """ Get the timestamp and data of a frame, None if it has been overwritten (or is damaged).
+        """
+        with self.lock:
+            if sequence < self.first_sequence() or sequence >= self.next_sequence:
+                return None
+            timestamp, position, length = self.entry(sequence)
+            offset = self.data_offset + position % self.data_size
+            frame = self.map[offset:offset + length]
+        return (timestamp, frame) if is_jpeg(frame) else None
+
+    def __len__(self):
+        with self.lock:
+            return self.next_sequence - self.first_sequence()
+
+
+class LazyFrameRing:
+    """ Opens a frame ring only once it is needed. As the file is allocated in full it is only
+        created for the first frame recorded, so nothing is allocated unless time-lapse is used.
+    """
+
+    def __init__(self, path, index_slots, data_size):
+        self.path = path
+        self.index_slots = index_slots
+        self.data_size = data_size
+        self.lock = threading.Lock()
+        self.ring = None
+
+    def get(self, create=False):
+        """ Get the ring, None if there is no file yet unless creating it.
+        """
+        with self.lock:
+            if self.ring is None and (create or os.path.exists(self.path)):
+                self.ring = FrameRing(self.path, self.index_slots, self.data_size)
+            return self.ring
+
+
+class TimelapseRecorder:
+    """ Takes a frame from the camera broadcaster every interval seconds, sharing the camera with
+        the live stream (or starting it just for the frame if no one is watching). Interval gets
+        the seconds between frames so it can follow the settings, zero pauses recording. Ring is
+        a LazyFrameRing, created with the first frame.
+    """
+
+    def __init__(self, broadcaster, ring, interval, warmup_frames, timeout, logger):
+        self.broadcaster = broadcaster
+        self.ring = ring
+        self.interval = interval
+        self.warmup_frames = warmup_frames
+        self.timeout = timeout
+        self.logger = logger
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='Time-lapse Thread', daemon=True)
+        self.failed = False
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def capture(self):
+        """ Get a frame once the camera has had a few frames to settle its exposure, None if there is none.
+        """
+        self.broadcaster.add_viewer()
+        try:
+            frame_number, frame = 0, None
+            for i in range(self.warmup_frames + 1):
+                frame_number, frame = self.broadcaster.wait_frame(frame_number, self.timeout)
+                if frame is None:
+                    return None
+            return frame
+        finally:
+            self.broadcaster.remove_viewer()
+
+    def run(self):
+        next_capture = time.time()
+        while not self.stopping.is_set():
+            try:
+                interval = self.interval()
+            except ValueError:
+                interval = 0  # Invalid settings, paused until they are fixed.
+            if not interval:
+                # Check again in a minute in case it is turned on.
+                next_capture = time.time() + 60
+            elif time.time() >= next_capture:
+                next_capture = max(next_capture + interval, time.time())
+                try:
+                    frame = self.capture()
+                    if frame is not None:
+                        self.ring.get(create=True).append(time.time(), frame)
+                    elif not self.failed and not self.stopping.is_set():
+                        self.logger.warning('No frame from the camera for the time-lapse.')
+                    self.failed = frame is None
+                except Exception:
+                    self.logger.exception('Failed to record a time-lapse frame.')
+            self.stopping.wait(max(min(next_capture - time.time(), 60), 0))
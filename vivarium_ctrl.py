@@ -11,45 +11,65 @@
 # http://opensource.org/licenses/MIT
 # 
 
-import adafruit_bme280
-import sqlite3
-import datetime
-import board
-import busio
 import constants
-from gpiozero import Energenie
+import hardware
+import database
+import retention
+import rollups
+import enclosures
+import rules
+from device_store import DeviceStore, to_string
+from command_socket import CommandServer
+from periodic import PeriodicScheduler
+from samples import SampleBuffer, STATS_COLUMNS
+from archive import Archive
+from settings_file import SettingsFile
+import metrics
+import paths
 import threading
-import json
+import asyncio
+import concurrent.futures
 import signal
 import logging
-import logging.handlers
-from logger import Logger
+from logger import Logger, setup_logger, log_event
 import sys
 import os
 import time
 
-# Use paths relative to the script.
-dirname = os.path.dirname(__file__)
-if dirname:
-    dirname += '/'
-
-logger = logging.getLogger('Vivarium_CTRL')
-logger.setLevel(logging.INFO)
-handler = logging.handlers.RotatingFileHandler(dirname + 'vivarium_ctrl.log', maxBytes=262144, backupCount=3)
-handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s', '%d-%b-%y %H:%M:%S'))
-logger.addHandler(handler)
+logger = setup_logger('Vivarium_CTRL', paths.data_path('vivarium_ctrl.log'))
 
 sys.stdout = Logger(logger, logging.INFO)
 sys.stderr = Logger(logger, logging.ERROR)
 
+# Each executor thread has its own db connection.
+db_local = threading.local()
+db_connections = []
 
-def to_string(value):
-    """ Convert a boolean to on/off as a string.
-    """
-    if value:
-        return "On"
-    else:
-        return "Off"
+# Set when stopping so long running jobs (retention) can finish early.
+stopping = threading.Event()
+
+SENSOR_READ_SECONDS = metrics.Histogram('sensor_read_seconds', 'Time taken to read a sensor over I2C.',
+                                        ('enclosure',))
+SENSOR_READ_ERRORS = metrics.Counter('sensor_read_errors_total', 'Failed sensor reads.', ('enclosure',))
+ACTUATION_SECONDS = metrics.Histogram('actuation_seconds', 'Time taken to switch a socket and record it.',
+                                      ('enclosure', 'device'))
+
+# Parsed again only when it changes.
+settings_file = SettingsFile(paths.data_path('settings.json'))
+
+# Expired readings are moved here rather than deleted (unless turned off in the settings).
+reading_archive = Archive(database.ARCHIVE_PATH)
+
+# States last written to the db so changes made by the web app can be told apart. Held while writing
+# a state and its mirror and while comparing the db to the mirror so neither sees one without the other.
+mirrored_states = {}
+mirror_lock = threading.Lock()
+
+# Rules for each enclosure.
+rule_engines = {}
+
+# Aggregated readings waiting to be written (kept if a write fails so they are retried).
+pending_readings = []
 
 
 def to_bool(value):
@@ -61,192 +81,303 @@ def to_bool(value):
         return False
 
 
-def is_time_between(begin_time, end_time, check_time=None):
-    """ Check if a time is within a range.
-        Taken from the accepted answer by Joe Holloway here:
-        https://stackoverflow.com/a/10048290
+def get_db():
+    """ Get the db connection for the current executor thread, connecting on first use.
     """
-    # If check time is not given, default to current time.
-    check_time = check_time or datetime.datetime.now().time()
-    if begin_time < end_time:
-        return check_time >= begin_time and check_time <= end_time
-    else:  # Crosses midnight.
-        return check_time >= begin_time or check_time <= end_time
+    if not hasattr(db_local, 'db'):
+        # Closed from the main thread at shutdown.
+        db_local.db = database.connect(check_same_thread=False)
+        db_connections.append(db_local.db)
+    return db_local.db
 
 
-def scheduler_loop():
+def running_enclosures():
+    """ Get the enclosures with hardware set up, ones added to the settings since starting are left out.
+    """
+    return [enclosure for enclosure in configured_enclosures if enclosure.id in sensors]
 
-    # Don't share db connection between threads.
-    db = sqlite3.connect(dirname + 'vivarium_ctrl.db')
-    c = db.cursor()
 
-    logger.info('Scheduler thread started.')
-
-    # Update device based on schedule.
-    while not running.is_set():
-        # Turn the light on if within the on and off time.
-        if settings['light-auto']:
-            light_state = to_bool(c.execute("SELECT state FROM device_states WHERE device='light'").fetchone()[0])
-            light_due_on = is_time_between(settings['light-on-time'], settings['light-off-time'])
-            if light_due_on and not light_state:
-                c.execute("UPDATE device_states SET state=1 WHERE device='light'")
-                db.commit()
-            elif not light_due_on and light_state:
-                c.execute("UPDATE device_states SET state=0 WHERE device='light'")
-                db.commit()
-        running.wait(constants.SCHEDULER_INTERVAL)
-
-    # Close db.
-    db.close()
-    logger.info('Scheduler thread stopped.')
+def running_devices(enclosure):
+    """ Get the devices of an enclosure with sockets set up, ones added to the settings since starting are left out.
+    """
+    return [device for device in enclosure.devices if (enclosure.id, device) in sockets]
 
 
-def device_and_settings_loop():
+def evaluate_rules(enclosure):
+    # Switch any devices the rules want changed.
+    states = {device: devices.get((enclosure.id, device)) for device in running_devices(enclosure)}
+    readings = sample_buffers[enclosure.id].readings()
+    changes = rule_engines[enclosure.id].evaluate(time.monotonic(), readings, states)
+    for device, state in changes.items():
+        devices.set((enclosure.id, device), state)
 
-    # Don't share db connection between threads.
-    db = sqlite3.connect(dirname + 'vivarium_ctrl.db')
-    c = db.cursor()
 
-    # Initialise devices.
-    heat_mat = Energenie(constants.HEAT_MAT_SOCKET)
-    pump = Energenie(constants.PUMP_SOCKET)
-    fan = Energenie(constants.FAN_SOCKET)
-    light = Energenie(constants.LIGHT_SOCKET)
-
-    logger.info('Device and settings thread started.')
-
-    # Continue running until interrupted.
-    while not running.is_set():
-
-        #  Update device states.
-        device_states = c.execute('SELECT * FROM device_states')
-        for device_state in device_states:
-            if device_state[0] == 'heat-mat':
-                if to_bool(device_state[1]) != heat_mat.value:
-                    heat_mat.value = to_bool(device_state[1])
-            elif device_state[0] == 'pump':
-                if to_bool(device_state[1]) != pump.value:
-                    pump.value = to_bool(device_state[1])
-            elif device_state[0] == 'fan':
-                if to_bool(device_state[1]) != fan.value:
-                    fan.value = to_bool(device_state[1])
-            elif device_state[0] == 'light':
-                if to_bool(device_state[1]) != light.value:
-                    light.value = to_bool(device_state[1])
-
-        # Check if settings need reloading.
-        reload_settings = to_bool(c.execute("SELECT state FROM flags WHERE flag='reload_settings'").fetchone()[0])
-        if reload_settings:
+def control_job():
+    # Rules also depend on the time (schedules, minimum times and duty cycles) so are evaluated between readings.
+    for enclosure in running_enclosures():
+        evaluate_rules(enclosure)
+
+
+def apply_device_state(device, state):
+    # Switch the socket then mirror the state to the db for the web app.
+    start = time.perf_counter()
+    if sockets[device].value != state:
+        sockets[device].value = state
+    devices.mark_applied(device, state)
+    db = get_db()
+    with mirror_lock:
+        db.execute('UPDATE device_states SET state=? WHERE enclosure_id=? AND device=?', (int(state),) + device)
+        db.commit()
+        # Only mirrored once written or a poll in between would see a toggle and switch it back.
+        mirrored_states[device] = state
+    ACTUATION_SECONDS.observe(time.perf_counter() - start, *device)
+
+
+async def actuator(changes):
+    # Apply each change as soon as it is made, until given None.
+    loop = asyncio.get_running_loop()
+    while True:
+        change = await changes.get()
+        if change is None:
+            return
+        device, state = change
+        try:
+            await loop.run_in_executor(executor, apply_device_state, device, state)
+        except Exception:
+            logger.exception("Failed to switch '" + device[1] + "' in enclosure " + str(device[0]) + ".")
+
+
+def device_and_settings_job():
+    # Reload the settings if the file has been replaced (the web app also asks straight away).
+    if settings_file.changed():
+        try:
             load_settings()
-            c.execute("UPDATE flags SET state = 0 WHERE flag = 'reload_settings'")
-            db.commit()
+        except ValueError as e:
+            logger.error('Settings not reloaded. ' + str(e))
 
-        # Pause briefly.
-        running.wait(constants.DEVICE_AND_SETTINGS_INTERVAL)
+    db = get_db()
+    c = db.cursor()
 
-    # Close db and switch off all devices.
-    db.close()
-    heat_mat.off()
-    pump.off()
-    fan.off()
-    light.off()
-    logger.info('Device and settings thread stopped. All devices have been turned off.')
+    # Nothing else has written to the db so there cannot be any toggles. The data version only means
+    # anything compared to the last from the same connection and the job can run on any executor thread.
+    data_version = c.execute('PRAGMA data_version').fetchone()[0]
+    if data_version == getattr(db_local, 'data_version', None):
+        return
+    db_local.data_version = data_version
+
+    #  Update device states changed by the web app (other executor threads also write here).
+    with mirror_lock:
+        for enclosure_id, device, state in c.execute('SELECT enclosure_id, device, state '
+                                                     'FROM device_states').fetchall():
+            if (enclosure_id, device) in devices.states and \
+                    to_bool(state) != mirrored_states.get((enclosure_id, device), False):
+                devices.set((enclosure_id, device), to_bool(state))
 
 
-def sensor_monitor_loop():
+def read_sensor(enclosure_id):
+    start = time.perf_counter()
+    reading = round(sensors[enclosure_id].temperature, 2), round(sensors[enclosure_id].relative_humidity, 2)
+    SENSOR_READ_SECONDS.observe(time.perf_counter() - start, enclosure_id)
+    return reading
 
-    # Initialise sensor, database connection and cursor.
-    i2c = busio.I2C(board.SCL, board.SDA)
-    bme280 = adafruit_bme280.Adafruit_BME280_I2C(i2c)
-    db = sqlite3.connect(dirname + 'vivarium_ctrl.db')
+
+def insert_readings(readings):
+    # Insert, update rollups and commit all enclosures at once (old readings are removed by the retention job).
+    db = get_db()
     c = db.cursor()
+    query = 'INSERT OR IGNORE INTO sensor_readings (reading_timestamp, temperature, humidity, comments, ' \
+            'enclosure_id, sample_count, temperature_min, temperature_max, humidity_min, humidity_max, ' + \
+            ', '.join(STATS_COLUMNS) + ') VALUES (' + ','.join('?' * (10 + len(STATS_COLUMNS))) + ')'
+    # A second reading within the same second is dropped, only the rows kept are rolled up so none count twice.
+    inserted = [reading for reading in readings if c.execute(query, reading).rowcount]
+    rollups.add_readings(c, inserted)
+    db.commit()
 
-    logger.info('Sensor monitor thread started.')
-
-    # Continue running until interrupted.
-    while not running.is_set():
-
-        # Take time now to calculate delta for wait.
-        now = time.time()
-
-        # Get readings.
-        temperature, humidity = round(bme280.temperature, 2), round(bme280.relative_humidity, 2)
-
-        # Turn the heater on if temperature is low.
-        heat_mat_state = to_bool(c.execute("SELECT state FROM device_states WHERE device='heat-mat'").fetchone()[0])
-        if settings['heat-mat-auto']:
-            if temperature <= settings['low-temperature'] and not heat_mat_state:
-                c.execute("UPDATE device_states SET state=1 WHERE device='heat-mat'")
-                db.commit()
-                heat_mat_state = True
-            elif temperature > settings['low-temperature'] and heat_mat_state:
-                c.execute("UPDATE device_states SET state=0 WHERE device='heat-mat'")
-                db.commit()
-                heat_mat_state = False
-
-        # Turn the fan on if temperature is high.
-        fan_state = to_bool(c.execute("SELECT state FROM device_states WHERE device='fan'").fetchone()[0])
-        if settings['fan-auto']:
-            if temperature >= settings['high-temperature'] and not fan_state:
-                c.execute("UPDATE device_states SET state=1 WHERE device='fan'")
-                db.commit()
-                fan_state = True
-            elif temperature < settings['high-temperature'] and fan_state:
-                c.execute("UPDATE device_states SET state=0 WHERE device='fan'")
-                db.commit()
-                fan_state = False
-
-        # Turn the pump on if the humidity is low.
-        pump_state = to_bool(c.execute("SELECT state FROM device_states WHERE device='pump'").fetchone()[0])
-        if settings['pump-auto']:
-            if humidity <= settings['low-humidity'] and not pump_state:
-                c.execute("UPDATE device_states SET state=1 WHERE device='pump'")
-                db.commit()
-                pump_state = True
-            elif humidity > settings['low-humidity'] and pump_state:
-                c.execute("UPDATE device_states SET state=0 WHERE device='pump'")
-                db.commit()
-                pump_state = False
-
-        # Light will most likely be on a schedule instead so just fetch the state.
-        light_state = to_bool(c.execute("SELECT state FROM device_states WHERE device='light'").fetchone()[0])
-
-        # Write read status and device states to the database.
-        comments = "Heat Mat: " + to_string(heat_mat_state) + ", Pump: " + to_string(pump_state) + \
-                   ", Fan: " + to_string(fan_state) + ", Light: " + to_string(light_state)
-
-        # Insert, delete old readings and commit.
-        c.execute('INSERT INTO sensor_readings VALUES (?,?,?,?)',
-                  (datetime.datetime.now(), temperature, humidity, comments))
-        c.execute('DELETE FROM sensor_readings WHERE reading_datetime<?',
-                  (datetime.datetime.fromtimestamp(time.time() - 86400 * settings['days-to-keep']),))
-        db.commit()
 
-        # Sleep until next read (taking account of processing time).
-        running.wait(settings['update-frequency'] - (time.time() - now))
+async def sample_job():
+    # Read every sensor at once, one failing does not hold up the others.
+    loop = asyncio.get_running_loop()
+    current_enclosures = running_enclosures()
+    results = await asyncio.gather(*(loop.run_in_executor(executor, read_sensor, enclosure.id)
+                                     for enclosure in current_enclosures), return_exceptions=True)
+    timestamp = time.time()
+    for enclosure, result in zip(current_enclosures, results):
+        if isinstance(result, Exception):
+            log_event(logger, logging.ERROR, 'Failed to read the sensor.', enclosure=enclosure.id, error=repr(result))
+            SENSOR_READ_ERRORS.inc(enclosure.id)
+            continue
+        # Into the buffer for the rules straight away, the db only gets the aggregate.
+        sample_buffers[enclosure.id].add(timestamp, *result)
+        evaluate_rules(enclosure)
+
+
+async def flush_job():
+    # One row per enclosure of the samples since the last flush, all written in one transaction.
+    timestamp = int(time.time())
+    for enclosure in running_enclosures():
+        aggregate = sample_buffers[enclosure.id].flush()
+        if aggregate is None:
+            continue
+        count, temperature, temperature_min, temperature_max, humidity, humidity_min, humidity_max = aggregate
+        # Write device states with the reading.
+        comments = ', '.join(device.replace('-', ' ').title() + ': ' + to_string(devices.get((enclosure.id, device)))
+                             for device in running_devices(enclosure))
+        # The rolling statistics as they are now go with the reading.
+        pending_readings.append((timestamp, temperature, humidity, comments, enclosure.id, count,
+                                 temperature_min, temperature_max, humidity_min, humidity_max) +
+                                sample_buffers[enclosure.id].stats())
+    if not pending_readings:
+        return
+    readings = list(pending_readings)
+    await asyncio.get_running_loop().run_in_executor(executor, insert_readings, readings)
+    del pending_readings[:len(readings)]
+
+
+def retention_job():
+    # Prune old readings on a schedule rather than with every reading.
+    archive = reading_archive if settings.get('archive-readings', True) else None
+    deleted, reclaimed = retention.compact(get_db(), settings['days-to-keep'], constants.RETENTION_CHUNK_SIZE,
+                                           stopping, archive)
+    if deleted:
+        log_event(logger, logging.INFO, 'Retention ' + ('archived' if archive else 'removed') + ' old readings.',
+                  readings=deleted, reclaimed_bytes=reclaimed)
+
+
+async def run():
+    """ Run the jobs on one event loop until stopped, then switch off all the devices.
+    """
+    global loop, executor, scheduler, sensors, sample_buffers, sockets
+    loop = asyncio.get_running_loop()
+
+    # Blocking I2C, RF and db calls are made in a small pool so the loop itself never blocks,
+    # with a thread for each enclosure so all the sensors can be read at once.
+    executor = concurrent.futures.ThreadPoolExecutor(constants.EXECUTOR_WORKERS + len(configured_enclosures),
+                                                     thread_name_prefix='Executor')
+    scheduler = PeriodicScheduler(executor, logger)
+
+    # Initialise sensors, sample buffers and devices for each enclosure.
+    sensors = {enclosure.id: await loop.run_in_executor(executor, hardware_backend.sensor, enclosure)
+               for enclosure in configured_enclosures}
+    sample_buffers = {enclosure.id: SampleBuffer(constants.SAMPLE_BUFFER_SIZE, constants.STATS_WINDOW,
+                                                 constants.STATS_HALF_LIFE) for enclosure in configured_enclosures}
+    sockets = {(enclosure.id, device): hardware_backend.socket(enclosure, device)
+               for enclosure in configured_enclosures for device in enclosure.devices}
+
+    # Changes can be made from any thread (commands come in on the socket server's threads).
+    changes = asyncio.Queue()
+    devices.add_listener(lambda device, state: loop.call_soon_threadsafe(changes.put_nowait, (device, state)))
+    actuator_task = asyncio.ensure_future(actuator(changes))
+
+    # Commands are only served while there is a loop to apply their changes, any sent before
+    # now have been waiting in the socket's backlog.
+    command_server.start()
+
+    # Sample often for the rules but only write the aggregate every update frequency.
+    scheduler.add_job('sample', sample_job, constants.SAMPLE_INTERVAL)
+    scheduler.add_job('flush', flush_job, lambda: settings['update-frequency'])
+    scheduler.add_job('device_and_settings', device_and_settings_job, constants.DEVICE_AND_SETTINGS_INTERVAL)
+    scheduler.add_job('control', control_job, constants.CONTROL_INTERVAL, blocking=False)
+    scheduler.add_job('retention', retention_job, constants.RETENTION_INTERVAL)
+
+    # Shutdown gracefully on signals when running as the daemon.
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, signal_handler, signum)
+
+    logger.info('Jobs started.')
+    try:
+        await scheduler.run()
+    finally:
+        # Stopping waits for the server's loop to finish so is done off the event loop.
+        await loop.run_in_executor(executor, command_server.stop)
+    logger.info('Jobs stopped.')
+
+    # Write what has been sampled since the last flush.
+    try:
+        await flush_job()
+    except Exception:
+        logger.exception('Failed to write the last readings.')
+
+    # Let any outstanding changes finish, including one being applied, then switch off all devices once
+    # nothing else can switch one back on.
+    changes.put_nowait(None)
+    await actuator_task
+    executor.shutdown(wait=True)
+    switch_off_all()
+    for db in db_connections:
+        db.close()
+    logger.info('All devices have been turned off. Rules suppressed ' +
+                str(sum(engine.suppressed for engine in rule_engines.values())) + ' actuations.')
+
+
+def switch_off_all():
+    for socket in sockets.values():
+        socket.off()
+
+
+def stop():
+    """ Stop the jobs, safe to call from any thread.
+    """
+    stopping.set()
+    loop.call_soon_threadsafe(scheduler.stop)
+
 
-    # Close db.
-    db.close()
-    logger.info('Sensor monitor thread stopped.')
+def command_ping():
+    return {'pid': os.getpid()}
 
 
-def load_settings():
-    # Load settings.
-    f = open(dirname + 'settings.json', 'rt')
-    settings.update(json.loads(f.read()))
-    # Times will still be string.
-    for key in settings.keys():
-        if type(settings[key]) == str and ':' in settings[key]:
-            settings[key] = datetime.time(int(settings[key].split(':')[0]), int(settings[key].split(':')[1]))
+def command_get_state():
+    return {'device_states': [{'enclosure_id': device[0], 'device': device[1], 'state': to_string(state)}
+                              for device, state in devices.snapshot().items()],
+            'suppressed': {str(enclosure_id): engine.suppressed for enclosure_id, engine in rule_engines.items()}}
+
+
+def command_toggle(device, state, enclosure_id=0):
+    # Set the state and wait for the actuator to actually switch the socket.
+    if (enclosure_id, device) not in devices.states:
+        return {'ok': False, 'error': "Unknown device '" + device + "' in enclosure " + str(enclosure_id) + "."}
+    devices.set((enclosure_id, device), to_bool(state))
+    if not devices.wait_applied((enclosure_id, device), to_bool(state), constants.ACTUATION_TIMEOUT):
+        return {'ok': False, 'error': "Timed out switching '" + device + "'."}
+    return {'enclosure_id': enclosure_id, 'device': device, 'state': to_string(to_bool(state))}
+
+
+def command_metrics():
+    return {'metrics': metrics.render(constants.DAEMON_METRICS_PREFIX)}
+
+
+def command_reload_settings():
+    load_settings()
+    return {}
+
+
+def apply_settings(new_settings):
+    global settings, configured_enclosures, rule_engines
+    # Thresholds and schedules for each enclosure, the hardware is only set up when starting.
+    new_enclosures = enclosures.from_settings(new_settings)
+    # Rules are compiled once here rather than on every evaluation.
+    new_rule_engines = {}
+    for enclosure in new_enclosures:
+        new_rule_engines[enclosure.id] = rules.compile_rules(enclosure.settings, enclosure.devices)
+        if enclosure.id in rule_engines:
+            new_rule_engines[enclosure.id].carry_over(rule_engines[enclosure.id])
+    # Nothing is changed unless all of it is valid (already parsed, times are times).
+    settings, configured_enclosures, rule_engines = new_settings, new_enclosures, new_rule_engines
     logger.info('Settings (re)loaded.')
     logger.debug(str(settings))
 
 
-def signal_handler(signum, frame):
-    # Shutdown gracefully allowing threads to finish.
-    logger.info(signal.Signals(signum).name + ' received. Stopping threads.')
-    global running
-    running.set()
+def load_settings():
+    # Only applied if the file has changed since they were last loaded.
+    new_settings = settings_file.load()
+    if new_settings is not settings:
+        apply_settings(new_settings)
+
+
+def signal_handler(signum):
+    # Shutdown gracefully allowing jobs to finish.
+    logger.info(signal.Signals(signum).name + ' received. Stopping jobs.')
+    stop()
 
 
 def main():
@@ -255,31 +386,33 @@ def main():
 
     # Load initial settings.
     global settings
-    settings = dict()
+    settings = None
     load_settings()
 
+    # Real or simulated hardware.
+    global hardware_backend
+    hardware_backend = hardware.from_settings(settings)
+    logger.info('Using ' + type(hardware_backend).__name__ + ' with ' + str(len(configured_enclosures)) +
+                ' enclosure(s).')
+
     # Initialise database connection and cursor.
-    db = sqlite3.connect(dirname + 'vivarium_ctrl.db')
+    db = database.connect()
     c = db.cursor()
 
-    # Create the sensor readings table if it does not already exist.
-    c.execute('CREATE TABLE IF NOT EXISTS sensor_readings (reading_datetime TEXT, temperature NUMERIC, '
-              'humidity NUMERIC, comments TEXT)')
-    db.commit()
+    # Create or migrate the sensor readings table.
+    old_version, new_version = database.migrate(db)
+    if old_version != new_version:
+        logger.info('Database migrated from version ' + str(old_version) + ' to ' + str(new_version) + '.')
 
     # Create a device states table and initialise all as off.
-    device_states = [('heat-mat', 0),
-                     ('pump', 0),
-                     ('fan', 0),
-                     ('light', 0)]
+    device_states = [(enclosure.id, device, 0) for enclosure in configured_enclosures for device in enclosure.devices]
     c.execute('DROP TABLE IF EXISTS device_states')
-    c.execute('CREATE TABLE device_states (device TEXT, state NUMERIC)')
-    c.executemany('INSERT INTO device_states VALUES (?,?)', device_states)
+    c.execute('CREATE TABLE device_states (enclosure_id INTEGER, device TEXT, state NUMERIC)')
+    c.executemany('INSERT INTO device_states VALUES (?,?,?)', device_states)
     db.commit()
 
     # Create flags table.
-    flags = [('reload_settings', 0),
-             ('pid', os.getpid())]
+    flags = [('pid', os.getpid())]
     c.execute('DROP TABLE IF EXISTS flags')
     c.execute('CREATE TABLE flags (flag TEXT, state NUMERIC)')
     c.executemany("INSERT INTO flags VALUES (?,?)", flags)
@@ -288,26 +421,22 @@ def main():
     # Finished with this connection.
     db.close()
 
-    logger.info('Database and tables initialised. Starting threads.')
-
-    # Control loops and catch interrupts.
-    global running
-    running = threading.Event()
-    signal.signal(signal.SIGTERM, signal_handler)
-    signal.signal(signal.SIGINT, signal_handler)
-
-    # Start threads.
-    sensor_monitor_thread = threading.Thread(target=sensor_monitor_loop, name='Sensor Monitor Thread')
-    sensor_monitor_thread.start()
-    device_and_settings_thread = threading.Thread(target=device_and_settings_loop, name='Device and Settings Thread')
-    device_and_settings_thread.start()
-    scheduler_thread = threading.Thread(target=scheduler_loop, name='Scheduler Thread')
-    scheduler_thread.start()
-
-    # Wait for all threads to finish.
-    sensor_monitor_thread.join()
-    device_and_settings_thread.join()
-    scheduler_thread.join()
+    logger.info('Database and tables initialised. Starting jobs.')
+
+    # Device states shared between jobs and commands, the db is kept as a mirror for the web app.
+    global devices
+    devices = DeviceStore((state[0], state[1]) for state in device_states)
+
+    # Accept commands from the web app, they are served once the jobs are running.
+    global command_server
+    command_server = CommandServer({'ping': command_ping,
+                                    'get-state': command_get_state,
+                                    'toggle': command_toggle,
+                                    'reload-settings': command_reload_settings,
+                                    'metrics': command_metrics})
+
+    # Run until a signal is received.
+    asyncio.run(run())
 
     logger.info('Shutdown completed successfully.')
 
@@ -12,20 +12,38 @@
 # 
 
 import web
-import io
-import picamera
-#from cheroot.server import HTTPServer
-#from cheroot.ssl.builtin import BuiltinSSLAdapter
 import hashlib
-import datetime
+import hmac
+import re
 import time
 import json
+import math
+import signal
+import threading
+import queue
 import logging
-import logging.handlers
-from logger import Logger
+from logger import Logger, setup_logger, log_event
+import database
+import rollups
+import downsample
+import events
+import command_socket
+import hardware
+import enclosures
+from device_store import to_string
+from camera import CameraBroadcaster
+from timelapse import LazyFrameRing, TimelapseRecorder
+from static_files import StaticFiles
+from archive import Archive
+from settings_file import SettingsFile, serialise
+from session_store import SessionStore
+from profiling import TimingMiddleware, SamplingProfiler
+from web_server import RequestLimiter, create_server
+import metrics
+import constants
+import paths
 import sys
 import os
-import mimetypes
 import psutil
 
 # Use paths relative to the script.
@@ -33,80 +51,167 @@ dirname = os.path.dirname(__file__)
 if dirname:
     dirname += '/'
 
-logger = logging.getLogger('Vivarium_CTRL_Web')
-logger.setLevel(logging.INFO)
-handler = logging.handlers.RotatingFileHandler(dirname + 'vivarium_ctrl_web.log', maxBytes=262144, backupCount=3)
-handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s', '%d-%b-%y %H:%M:%S'))
-logger.addHandler(handler)
+logger = setup_logger('Vivarium_CTRL_Web', paths.data_path('vivarium_ctrl_web.log'))
 
 sys.stdout = Logger(logger, logging.INFO)
 sys.stderr = Logger(logger, logging.ERROR)
 
-# Use HTTPS
-#HTTPServer.ssl_adapter = BuiltinSSLAdapter(
-#    certificate=dirname + 'cert/cert.pem',
-#    private_key=dirname + 'cert/key.pem'
-#)
-
 # Set URLs
 urls = (
     '/', 'Index',
     '/(\d+)', 'Index',
     '/reload', 'Reload',
+    '/api/readings', 'Readings',
+    '/api/readings/page', 'ReadingsPage',
+    '/events', 'Events',
     '/login', 'Login',
     '/logout', 'Logout',
     '/favicon.ico', 'Favicon',
     '/stream.mjpg', 'Stream',
+    '/timelapse/frame', 'TimelapseFrame',
+    '/timelapse/play', 'TimelapsePlay',
     '/toggle_device', 'ToggleDevice',
     '/settings', 'Settings',
+    '/metrics', 'Metrics',
+    '/profile', 'Profile',
     '/files/(.*)/(.*)', 'Files'
 )
 
-# Setup database connection.
+# Debug must be disabled for sessions to work (and before the db is set up so queries are not logged).
+web.config.debug = False
+
+# Setup database connection (read only, each worker thread has its own).
 db = web.database(
     dbn='sqlite',
-    db=dirname + 'vivarium_ctrl.db'
+    db=database.DB_PATH,
+    factory=database.ReadOnlyConnection
 )
 
+STREAM_FRAMES_SENT = metrics.Counter('stream_frames_sent_total', 'Frames sent to viewers of the camera stream.')
+DAEMON_UP = metrics.Gauge('daemon_up', 'Whether the backend answered for its metrics.')
+
+# Parsed again only when it changes.
+settings_file = SettingsFile(paths.data_path('settings.json'))
+
+# Shared by all clients of the events stream.
+change_monitor = events.ChangeMonitor(interval=constants.EVENTS_CHECK_INTERVAL)
+
+# Real or simulated camera (chosen the same way as for the backend).
+hardware_backend = hardware.from_settings(settings_file.load())
+
+# One camera shared by all viewers of the stream.
+camera_broadcaster = CameraBroadcaster(lambda: hardware_backend.camera_source(constants.CAMERA_RESOLUTION,
+                                                                              constants.CAMERA_FRAMERATE, vflip=True))
+
+# Frames taken from the same camera on a schedule, in a fixed size file made once time-lapse is turned on.
+timelapse_ring = LazyFrameRing(paths.data_path('timelapse.vtl'), constants.TIMELAPSE_INDEX_SLOTS,
+                               constants.TIMELAPSE_DATA_SIZE)
+timelapse_recorder = TimelapseRecorder(camera_broadcaster, timelapse_ring,
+                                       lambda: settings_file.load()['timelapse-interval'],
+                                       constants.TIMELAPSE_WARMUP_FRAMES, constants.CAMERA_TIMEOUT, logger)
+
+# Set once the server is stopping so playbacks end early.
+shutting_down = threading.Event()
+
+# Static files held in memory.
+static_files = StaticFiles(dirname + 'files', constants.STATIC_CHECK_INTERVAL)
+static_files.load_all()
+
+# Readings older than the days to keep, mapped in as they are charted.
+reading_archive = Archive(database.ARCHIVE_PATH)
+
 # Templates
-render = web.template.render(dirname + 'templates/')
+render = web.template.render(dirname + 'templates/', globals={'static_url': static_files.url})
+
+# Where the rows of the readings table go in the rendered index, replaced as they are streamed.
+TABLE_ROWS = '<!-- Table rows. -->'
 
-# Debug must be disabled for sessions to work.
-web.config.debug = False
 app = web.application(urls, globals())
-session = web.session.Session(app, web.session.DiskStore(dirname + 'sessions'),
-                              initializer={'authenticated': False, 'username': None})
+
+
+# Matched the same way as web.py does to name the handler of each request.
+handler_patterns = [(re.compile('^' + pattern + r'\Z'), name) for pattern, name in app.mapping]
+
+
+def handler_name(path):
+    """ Get the name of the class handling a path.
+    """
+    for pattern, name in handler_patterns:
+        if pattern.match(path):
+            return name
+    return 'NotFound'
+
+
+# Handlers whose responses stay open, each holding a worker thread.
+STREAM_HANDLERS = ('Stream', 'TimelapsePlay', 'Events')
+
+
+def limit_middleware(wsgi_app):
+    """ Keep streams and regular requests to their own share of the worker threads.
+    """
+    server_settings = settings_file.load()
+    max_streams = server_settings['max-streams']
+    return RequestLimiter(wsgi_app, lambda path: handler_name(path) in STREAM_HANDLERS, max_streams,
+                          server_settings['web-threads'] - max_streams, constants.WEB_REQUEST_WAIT)
+
+
+def timing_middleware(wsgi_app):
+    """ Time every request, logging slow ones.
+    """
+    return TimingMiddleware(wsgi_app, handler_name, lambda: settings_file.load()['slow-request-threshold'], logger)
+
+
+# Started by an admin to see where the time goes.
+profiler = SamplingProfiler(constants.PROFILE_INTERVAL)
+# Sessions in memory so requests do not read and write a file each, persisted when they change and
+# every so often while in use.
+session_store = SessionStore(web.config.session_parameters.timeout, constants.MAX_SESSIONS,
+                             paths.data_path('sessions.db') if constants.PERSIST_SESSIONS else None,
+                             constants.SESSION_TOUCH_INTERVAL)
+session = web.session.Session(app, session_store, initializer={'authenticated': False, 'username': None})
 
 
 class Index:
-    """ Displays all the data and provide links to other features.
+    """ Displays all the data and provide links to other features. The page is streamed so the
+        header and tiles are sent before the readings table is read.
     """
     def GET(self, num_hours=12):
         if not session.authenticated:
             proto = web.ctx.env.get('HTTP_X_FORWARDED_PROTO', 'http')
             raise web.seeother(proto + '://' + web.ctx.host + '/login')
         else:
-            # Calculate date and time by subtracting from timestamp.
-            from_datetime = datetime.datetime.fromtimestamp(time.time() - 3600 * int(num_hours))
-            # Get requested number of readings.
-            sensor_readings = list(db.select('sensor_readings', order='reading_datetime DESC',
-                                             where='reading_datetime>=$from_datetime',
-                                             vars={'from_datetime': from_datetime}))
+            # The enclosure to show (the first by default).
+            all_enclosures = load_enclosures()
+            enclosure = select_enclosure(all_enclosures)
+            if enclosure is None:
+                raise web.notfound()
+            # Only the latest reading is needed for the tiles.
+            latest_reading = next(iter(select_readings_page(enclosure.id, limit=1)), None)
             # Get device states.
-            device_states = list(db.select('device_states'))
-            # Render with table and charts.
-            return render.index(device_states, sensor_readings, num_hours)
+            device_states = list(db.select('device_states', where='enclosure_id=$enclosure_id',
+                                           vars={'enclosure_id': enclosure.id}))
+            # Render around the table, charts are built and older pages of the table fetched once loaded.
+            web.header('Content-Type', 'text/html; charset=utf-8')
+            head, tail = str(render.index(all_enclosures, enclosure, device_states, latest_reading, TABLE_ROWS,
+                                          num_hours)).split(TABLE_ROWS)
+            yield head
+            for sensor_reading in select_readings_page(enclosure.id):
+                yield str(render.reading_row(sensor_reading))
+            yield tail
 
     def POST(self):
         if not session.authenticated:
             proto = web.ctx.env.get('HTTP_X_FORWARDED_PROTO', 'http')
             raise web.seeother(proto + '://' + web.ctx.host + '/login')
         else:
-            num_hours = web.input().num_hours
+            params = web.input(enclosure='')
+            num_hours = params.num_hours
             if num_hours == '12':
                 num_hours = ''
+            # Stay on the same enclosure.
+            query = '?enclosure=' + params.enclosure if params.enclosure else ''
             proto = web.ctx.env.get('HTTP_X_FORWARDED_PROTO', 'http')
-            raise web.seeother(proto + '://' + web.ctx.host + '/' + num_hours)
+            raise web.seeother(proto + '://' + web.ctx.host + '/' + num_hours + query)
 
 
 class Reload:
@@ -122,24 +227,22 @@ class Reload:
             return_data = dict()
             # Cast timestamp from string to float.
             from_timestamp = to_float(web.input().last)
-            # If this is None then there is an error on the clients part.
-            if from_timestamp is None:
+            enclosure = select_enclosure(load_enclosures())
+            # If either is None then there is an error on the clients part.
+            if from_timestamp is None or enclosure is None:
                 web.ctx.status = '400 Bad Request'
                 return  # Will return 400 Bad Request.
-            elif os.path.getmtime(dirname + 'vivarium_ctrl.db') > from_timestamp:  # Check if the DB has been modified.
-                # Convert timestamp to datetime.
-                from_datetime = datetime.datetime.fromtimestamp(from_timestamp)
+            elif database.last_modified() > from_timestamp:  # Check if the DB has been modified.
                 # Get the sensor reading(s).
-                sensor_readings = list(db.select('sensor_readings', order='reading_datetime DESC',
-                                                 where='reading_datetime>$from_datetime',
-                                                 vars={'from_datetime': from_datetime}))
+                sensor_readings = list(select_sensor_readings(int(from_timestamp), 0, enclosure.id))
                 # Get device states and convert the 1/0 to On/Off.
-                device_states = list(db.select('device_states'))
+                device_states = list(db.select('device_states', where='enclosure_id=$enclosure_id',
+                                               vars={'enclosure_id': enclosure.id}))
                 for device_state in device_states:
                     device_state.state = to_string(device_state.state)
                 # Create a combined dict to return.
                 return_data.update({'sensor_readings': sensor_readings,
-                                   'device_states': device_states})
+                                    'device_states': device_states})
             # Check backend process is running.
             pid = db.select('flags', where='flag="pid"')
             if pid and psutil.pid_exists(pid[0].state):
@@ -149,10 +252,129 @@ class Reload:
             # Add to response.
             return_data.update({'backend_running': backend_running})
             # Set header, dump to JSON and return.
-            web.header('Content-type:', 'application/json')
+            web.header('Content-Type', 'application/json')
             return json.dumps(return_data)
 
 
+class Events:
+    """ Push new readings, device states and backend status to the client as server-sent events.
+    """
+    def GET(self):
+        if not session.authenticated:
+            web.ctx.status = '401 Unauthorized'
+            web.header('WWW-Authenticate', 'Forms realm="Vivarium_CTRL"')
+            return  # Will return the 401 Unauthorized with header.
+        else:
+            enclosure = select_enclosure(load_enclosures())
+            if enclosure is None:
+                web.ctx.status = '400 Bad Request'
+                return  # Will return 400 Bad Request.
+            web.header('Content-type', 'text/event-stream')
+            web.header('Cache-Control', 'no-cache')
+            subscriber = change_monitor.subscribe()
+            try:
+                while True:
+                    try:
+                        item = subscriber.get(timeout=constants.EVENTS_KEEPALIVE_INTERVAL)
+                    except queue.Empty:
+                        # Comment line to keep the connection open through proxies.
+                        yield ': keepalive\n\n'
+                        continue
+                    if item is None:
+                        break  # Dropped for being too slow, the client will reconnect.
+                    if item[0] in ('sensor_readings', 'device_states'):
+                        # Only those for the enclosure being viewed.
+                        item = (item[0], [row for row in item[1] if row['enclosure_id'] == enclosure.id])
+                        if not item[1]:
+                            continue
+                    yield 'event: ' + item[0] + '\ndata: ' + json.dumps(item[1]) + '\n\n'
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                change_monitor.unsubscribe(subscriber)
+
+
+class Readings:
+    """ Readings for a time range as parallel arrays for charting.
+    """
+    def GET(self):
+        if not session.authenticated:
+            web.ctx.status = '401 Unauthorized'
+            web.header('WWW-Authenticate', 'Forms realm="Vivarium_CTRL"')
+            return  # Will return the 401 Unauthorized with header.
+        else:
+            params = web.input(to=None, max_points=str(constants.MAX_CHART_POINTS))
+            # Default to the last 12 hours.
+            to_timestamp = to_float(params.to) if params.to else time.time()
+            from_timestamp = to_float(params.get('from', str(to_timestamp - 43200))) \
+                if to_timestamp is not None else None
+            max_points = to_float(params.max_points)
+            enclosure = select_enclosure(load_enclosures())
+            # If any are None then there is an error on the clients part.
+            if to_timestamp is None or from_timestamp is None or max_points is None or enclosure is None:
+                web.ctx.status = '400 Bad Request'
+                return  # Will return 400 Bad Request.
+            from_timestamp, to_timestamp, max_points = int(from_timestamp), int(to_timestamp), int(max_points)
+            # Zero max points returns every raw reading.
+            if max_points > 0:
+                max_points = max(max_points, constants.MIN_CHART_POINTS)
+                resolution = choose_resolution(from_timestamp, to_timestamp, enclosure.id, max_points)
+            else:
+                resolution = 0
+            timestamps, temperatures, humidities = [], [], []
+            # Readings (and minute rollups) older than the days to keep are only in the archive.
+            if resolution in (0, rollups.MINUTE):
+                oldest = oldest_reading_timestamp(enclosure.id)
+                if oldest is None or from_timestamp < oldest:
+                    archived_to = to_timestamp if oldest is None else min(to_timestamp, oldest - 1)
+                    timestamps, temperatures, humidities = (values.tolist() for values in reading_archive.read(
+                        enclosure.id, from_timestamp, archived_to))
+            for sensor_reading in select_sensor_readings(from_timestamp, resolution, enclosure.id, to_timestamp,
+                                                         order='ASC'):
+                timestamps.append(sensor_reading.reading_timestamp)
+                temperatures.append(sensor_reading.temperature)
+                humidities.append(sensor_reading.humidity)
+            # Rollups are only approximately the right size so thin them down to the limit.
+            if max_points > 0:
+                timestamps, temperatures, humidities = downsample.downsample(timestamps, temperatures, humidities,
+                                                                             max_points)
+            web.header('Content-Type', 'application/json')
+            return json.dumps({'enclosure_id': enclosure.id,
+                               'resolution': resolution,
+                               'resolution_name': rollups.RESOLUTION_NAMES[resolution],
+                               'timestamp': timestamps,
+                               'temperature': temperatures,
+                               'humidity': humidities})
+
+
+class ReadingsPage:
+    """ A page of readings for the table, newest first, before the timestamp of the last row
+        already shown.
+    """
+    def GET(self):
+        if not session.authenticated:
+            web.ctx.status = '401 Unauthorized'
+            web.header('WWW-Authenticate', 'Forms realm="Vivarium_CTRL"')
+            return  # Will return the 401 Unauthorized with header.
+        else:
+            params = web.input(before=None)
+            # The first page if there is no cursor.
+            before = to_float(params.before) if params.before else None
+            enclosure = select_enclosure(load_enclosures())
+            # If either is None then there is an error on the clients part.
+            if (params.before and before is None) or enclosure is None:
+                web.ctx.status = '400 Bad Request'
+                return  # Will return 400 Bad Request.
+            sensor_readings = list(select_readings_page(enclosure.id, None if before is None else int(before)))
+            # The cursor for the next page, none once the oldest has been sent.
+            if len(sensor_readings) == constants.TABLE_PAGE_SIZE:
+                before = sensor_readings[-1].reading_timestamp
+            else:
+                before = None
+            web.header('Content-Type', 'application/json')
+            return json.dumps({'sensor_readings': sensor_readings, 'before': before})
+
+
 class Login:
     """ Basic authentication to guard against unauthorised access.
     """
@@ -202,26 +424,88 @@ class Stream:
             proto = web.ctx.env.get('HTTP_X_FORWARDED_PROTO', 'http')
             raise web.seeother(proto + '://' + web.ctx.host + '/login')
         else:
-            camera = picamera.PiCamera()
-            camera.resolution = (1280, 960)
-            camera.vflip = True
             logger.info("Camera stream opened by user '" + session.username + "'.")
             web.header('Content-type', 'multipart/x-mixed-replace; boundary=jpgboundary')
-            stream = io.BytesIO()
+            camera_broadcaster.add_viewer()
             try:
-                for foo in camera.capture_continuous(stream, 'jpeg'):
-                    yield '\r\n--jpgboundary\r\n'
-                    web.header('Content-type', 'image/jpeg')
-                    yield b'\r\n' + stream.getvalue() + b'\r\n'
-                    stream.seek(0)
-                    stream.truncate()
-                    time.sleep(0.5)
+                frame_number = 0
+                while True:
+                    # Always the newest frame, any missed while sending the last are skipped.
+                    frame_number, frame = camera_broadcaster.wait_frame(frame_number, constants.CAMERA_TIMEOUT)
+                    if frame is None:
+                        break  # Camera stopped or failed.
+                    yield ('\r\n--jpgboundary\r\nContent-type: image/jpeg\r\nContent-length: ' + str(len(frame)) +
+                           '\r\n\r\n').encode('utf-8')
+                    yield frame
+                    STREAM_FRAMES_SENT.inc()
             except (KeyboardInterrupt, BrokenPipeError, ConnectionResetError):
                 pass
             finally:
                 logger.info("Camera stream closed by user '" + session.username + "'.")
-                stream.close()
-                camera.close()
+                camera_broadcaster.remove_viewer()
+
+
+class TimelapseFrame:
+    """ A single time-lapse frame, the last taken at or before a timestamp (the latest by default).
+    """
+    def GET(self):
+        if not session.authenticated:
+            web.ctx.status = '401 Unauthorized'
+            web.header('WWW-Authenticate', 'Forms realm="Vivarium_CTRL"')
+            return  # Will return the 401 Unauthorized with header.
+        else:
+            params = web.input(at=None)
+            at = to_float(params.at) if params.at else None
+            if params.at and at is None:
+                web.ctx.status = '400 Bad Request'
+                return  # Will return 400 Bad Request.
+            ring = timelapse_ring.get()
+            sequence = ring.nearest(at) if ring is not None else None
+            frame = ring.frame(sequence) if sequence is not None else None
+            if frame is None:
+                return web.notfound()
+            web.header('Content-Type', 'image/jpeg')
+            web.header('X-Frame-Timestamp', str(frame[0]))
+            return frame[1]
+
+
+class TimelapsePlay:
+    """ Play back the time-lapse frames between two timestamps (the last day by default) as an
+        MJPEG stream at a number of frames per second.
+    """
+    def GET(self):
+        if not session.authenticated:
+            proto = web.ctx.env.get('HTTP_X_FORWARDED_PROTO', 'http')
+            raise web.seeother(proto + '://' + web.ctx.host + '/login')
+        else:
+            params = web.input(to=None, fps=str(constants.TIMELAPSE_PLAYBACK_FPS))
+            to_timestamp = to_float(params.to) if params.to else time.time()
+            playback = constants.TIMELAPSE_PLAYBACK_HOURS * 3600
+            from_timestamp = to_float(params.get('from', str(to_timestamp - playback))) \
+                if to_timestamp is not None else None
+            fps = to_float(params.fps)
+            # If any are None then there is an error on the clients part.
+            if to_timestamp is None or from_timestamp is None or fps is None or not 0 < fps <= 30:
+                web.ctx.status = '400 Bad Request'
+                return  # Will return 400 Bad Request.
+            ring = timelapse_ring.get()
+            if ring is None:
+                raise web.notfound()  # Nothing recorded yet.
+            web.header('Content-type', 'multipart/x-mixed-replace; boundary=jpgboundary')
+            next_frame = time.monotonic()
+            try:
+                for sequence in ring.sequences(from_timestamp, to_timestamp):
+                    frame = ring.frame(sequence)
+                    if frame is None:
+                        continue  # Overwritten since playback started.
+                    if shutting_down.wait(max(next_frame - time.monotonic(), 0)):
+                        break
+                    next_frame += 1 / fps
+                    yield ('\r\n--jpgboundary\r\nContent-type: image/jpeg\r\nContent-length: ' +
+                           str(len(frame[1])) + '\r\n\r\n').encode('utf-8')
+                    yield frame[1]
+            except (BrokenPipeError, ConnectionResetError):
+                pass
 
 
 class Favicon:
@@ -243,14 +527,32 @@ class ToggleDevice:
         else:
             device = web.input().device
             old_state = web.input().state
+            enclosure = select_enclosure(load_enclosures())
+            # Checked here as well as by the backend as the db fallback would write any device given.
+            if enclosure is None or device not in enclosure.devices:
+                web.ctx.status = '400 Bad Request'
+                return  # Will return 400 Bad Request.
             if old_state == "On":
                 new_state = 0
             else:
                 new_state = 1
-            logger.info("'" + device + "' set '" + to_string(new_state) + "' by user '" + session.username + "'.")
-            db.update('device_states', where='device=$device', vars={'device': device}, state=new_state)
-            web.header('Content-type:', 'application/json')
-            return json.dumps({"device": device, "state": to_string(new_state)})
+            log_event(logger, logging.INFO, 'Device set.', enclosure=enclosure.name, device=device,
+                      state=to_string(new_state), user=session.username)
+            web.header('Content-Type', 'application/json')
+            try:
+                # Have the backend switch the device and confirm it has.
+                response = command_socket.send_command('toggle', device=device, state=new_state,
+                                                       enclosure_id=enclosure.id)
+            except OSError:
+                # Backend not running or not responding, it will pick this up from the db.
+                write_device_state(enclosure.id, device, new_state)
+                response = {'ok': True, 'enclosure_id': enclosure.id, 'device': device,
+                            'state': to_string(new_state)}
+            change_monitor.notify()
+            if not response['ok']:
+                logger.warning("Failed to set '" + device + "': " + response['error'])
+                web.ctx.status = '503 Service Unavailable'
+            return json.dumps(response)
 
 
 class Settings:
@@ -261,9 +563,7 @@ class Settings:
             proto = web.ctx.env.get('HTTP_X_FORWARDED_PROTO', 'http')
             raise web.seeother(proto + '://' + web.ctx.host + '/login')
         else:
-            f = open(dirname + 'settings.json', 'rt')
-            settings = json.loads(f.read())
-            return render.settings(settings)
+            return render.settings(serialise(settings_file.load()), is_admin())
 
     def POST(self):
         if not session.authenticated:
@@ -271,69 +571,224 @@ class Settings:
             web.header('WWW-Authenticate', 'Forms realm="Vivarium_CTRL"')
             return  # Will return the 401 Unauthorized with header.
         else:
-            # Retrieve the input.
-            settings = web.input()
-            # Correct the types (as they will all be string).
-            for key in settings.keys():
-                if settings[key] == 'true':
-                    settings[key] = True
-                elif settings[key] == 'false':
-                    settings[key] = False
-                else:
-                    if '.' in settings[key]:
-                        value = to_float(settings[key])
-                        if value is not None:
-                            settings[key] = value
-                    elif str.isnumeric(settings[key]):
-                        settings[key] = int(settings[key])
-            # Write to file immediately.
-            f = open(dirname + 'settings.json', 'wt')
-            f.write(json.dumps(settings, indent=4))
-            f.flush()
-            # Set reload flag.
-            db.update('flags', where="flag='reload_settings'", state=1)
+            # Keep any settings which are not on the form, the form's are checked and converted when saved.
+            settings = serialise(settings_file.load())
+            settings.update(web.input())
+            try:
+                settings_file.save(settings)
+            except ValueError as e:
+                web.ctx.status = '400 Bad Request'
+                return str(e)
+            # The backend also notices the file change itself, this just applies it straight away.
+            try:
+                command_socket.send_command('reload-settings')
+            except OSError:
+                pass  # Not running, it will load the new settings when started.
             # Render template with message and new settings.
             logger.info("Settings updated by user '" + session.username + "'.")
             return  # Will return 200 OK by default.
 
 
+class Metrics:
+    """ Metrics from this process and the backend in the Prometheus text format. Open to logged in
+        users or with the metrics token from the settings as a bearer token (for scrapers).
+    """
+    def GET(self):
+        token = settings_file.load().get('metrics-token')
+        authorization = web.ctx.env.get('HTTP_AUTHORIZATION', '')
+        if not session.authenticated and not (token and hmac.compare_digest(authorization, 'Bearer ' + token)):
+            web.ctx.status = '401 Unauthorized'
+            web.header('WWW-Authenticate', 'Bearer realm="Vivarium_CTRL"')
+            return  # Will return the 401 Unauthorized with header.
+        else:
+            # Scrapers do not keep cookies so do not start a session for each scrape.
+            if not session.authenticated:
+                session.send_cookie = False
+            try:
+                daemon_metrics = command_socket.send_command('metrics')['metrics']
+                DAEMON_UP.set(1)
+            except OSError:
+                daemon_metrics = ''
+                DAEMON_UP.set(0)
+            web.header('Content-type', 'text/plain; version=0.0.4')
+            return metrics.render(constants.WEB_METRICS_PREFIX) + daemon_metrics
+
+
+class Profile:
+    """ Run the sampling profiler for a number of seconds (admins only).
+    """
+    def GET(self):
+        if not is_admin():
+            web.ctx.status = '403 Forbidden'
+            return  # Will return 403 Forbidden.
+        else:
+            web.header('Content-type', 'application/json')
+            return json.dumps({'running': profiler.running, 'until': profiler.until, 'path': profiler.path})
+
+    def POST(self):
+        if not is_admin():
+            web.ctx.status = '403 Forbidden'
+            return  # Will return 403 Forbidden.
+        else:
+            seconds = to_float(web.input(seconds='').seconds)
+            if seconds is None or not 0 < seconds <= constants.MAX_PROFILE_SECONDS:
+                web.ctx.status = '400 Bad Request'
+                return 'Seconds must be from 1 to ' + str(constants.MAX_PROFILE_SECONDS) + '.'
+            path = paths.data_path('profiles/' + time.strftime('%Y%m%d-%H%M%S') + '.folded')
+            if not profiler.start(seconds, path):
+                web.ctx.status = '409 Conflict'
+                return 'The profiler is already running.'
+            logger.info("Profiling for " + str(seconds) + " seconds to '" + path + "' started by user '" +
+                        session.username + "'.")
+            web.header('Content-type', 'application/json')
+            return json.dumps({'running': True, 'until': profiler.until, 'path': path})
+
+
 class Files:
     """ A fairly hackey way to get around the fixed path for static files in webpy.
     """
     def GET(self, path, filename):
-        try:
-            etag = str(os.path.getmtime(dirname + 'files/' + path + '/' + filename))
-            last_modified = datetime.datetime.fromtimestamp(
-                os.path.getmtime(dirname + 'files/' + path + '/' + filename)
-            )
-            if web.modified(last_modified, etag):
-                f = open(dirname + 'files/' + path + '/' + filename, 'rb')
-                web.header('Content-type', mimetypes.guess_type(filename)[0])
-                return f.read()
-            else:
-                return web.notmodified()
-        except (FileNotFoundError, OSError):
+        asset = static_files.get(path + '/' + filename)
+        if asset is None:
             return web.notfound()
+        encoding, data = asset.encode(web.ctx.env.get('HTTP_ACCEPT_ENCODING', ''))
+        web.header('Content-type', asset.content_type)
+        web.header('Vary', 'Accept-Encoding')
+        # Versioned urls always have the same content so can be cached for good, others are revalidated.
+        if web.input(v=None).v == asset.etag:
+            web.header('Cache-Control', 'public, max-age=31536000, immutable')
+        else:
+            web.header('Cache-Control', 'no-cache')
+        # Raises 304 Not Modified if the client has it already (each encoding needs its own ETag).
+        web.modified(asset.last_modified, asset.etag + ('-' + encoding if encoding else ''))
+        if encoding:
+            web.header('Content-Encoding', encoding)
+        return data
+
+
+def load_enclosures():
+    """ Get the enclosures from the settings.
+    """
+    return enclosures.from_settings(settings_file.load())
+
+
+def select_enclosure(all_enclosures):
+    """ Get the enclosure given by the input (the first by default), None if there is no such enclosure.
+    """
+    enclosure_id = web.input(enclosure=None).enclosure
+    if not enclosure_id:
+        return all_enclosures[0]
+    for enclosure in all_enclosures:
+        if str(enclosure.id) == enclosure_id:
+            return enclosure
+    return None
+
+
+def choose_resolution(from_timestamp, to_timestamp, enclosure_id, max_points):
+    """ Choose the resolution to chart an enclosure's readings between two timestamps at.
+    """
+    # Hourly rollups give the number of readings without counting them all.
+    num_readings = db.query('SELECT COALESCE(SUM(count), 0) AS num_readings FROM sensor_rollups '
+                            'WHERE resolution=$resolution AND bucket_timestamp BETWEEN $from_timestamp AND '
+                            '$to_timestamp AND enclosure_id=$enclosure_id',
+                            vars={'resolution': rollups.HOUR, 'to_timestamp': to_timestamp,
+                                  'from_timestamp': from_timestamp - from_timestamp % rollups.HOUR,
+                                  'enclosure_id': enclosure_id})[0].num_readings
+    return rollups.choose_resolution(to_timestamp - from_timestamp, num_readings, max_points)
+
+
+def oldest_reading_timestamp(enclosure_id):
+    """ Get the timestamp of an enclosure's oldest reading still in the database, None if there are none.
+    """
+    oldest = db.select('sensor_readings', what='reading_timestamp', where='enclosure_id=$enclosure_id',
+                       order='reading_timestamp ASC', limit=1, vars={'enclosure_id': enclosure_id})
+    return oldest[0].reading_timestamp if oldest else None
+
+
+def select_sensor_readings(from_timestamp, resolution, enclosure_id, to_timestamp=None, order='DESC'):
+    """ Get an enclosure's readings from a timestamp (newest first by default), raw or as rollups at a given
+        resolution.
+    """
+    where = 'bucket_timestamp' if resolution else 'reading_timestamp'
+    where += '>=$from_timestamp' if to_timestamp is None else ' BETWEEN $from_timestamp AND $to_timestamp'
+    where += ' AND enclosure_id=$enclosure_id'
+    if resolution:
+        return db.select('sensor_rollups', what=rollups.READINGS_WHAT, order='bucket_timestamp ' + order,
+                         where='resolution=$resolution AND ' + where,
+                         vars={'resolution': resolution, 'from_timestamp': from_timestamp,
+                               'to_timestamp': to_timestamp, 'enclosure_id': enclosure_id})
+    else:
+        return db.select('sensor_readings', what='*, ' + database.READING_DATETIME,
+                         order='reading_timestamp ' + order, where=where,
+                         vars={'from_timestamp': from_timestamp, 'to_timestamp': to_timestamp,
+                               'enclosure_id': enclosure_id})
+
+
+def select_readings_page(enclosure_id, before=None, limit=constants.TABLE_PAGE_SIZE):
+    """ Get a page of an enclosure's readings older than a timestamp (or the latest), newest first. Walks
+        the primary key from the timestamp so every page costs the same however far back it is.
+    """
+    where = 'enclosure_id=$enclosure_id'
+    if before is not None:
+        where = 'reading_timestamp<$before AND ' + where
+    return db.select('sensor_readings', what='*, ' + database.READING_DATETIME, order='reading_timestamp DESC',
+                     where=where, limit=limit, vars={'before': before, 'enclosure_id': enclosure_id})
+
+
+def write_device_state(enclosure_id, device, state):
+    """ Set a device's state in the db, the only write made by the web app so it has its own connection.
+    """
+    write_db = database.connect()
+    try:
+        with write_db:
+            write_db.execute('UPDATE device_states SET state=? WHERE enclosure_id=? AND device=?',
+                             (state, enclosure_id, device))
+    finally:
+        write_db.close()
+
+
+def is_admin():
+    """ Check if the session is an admin's, every user is an admin if none are set.
+    """
+    admins = settings_file.load().get('admins')
+    return session.authenticated and (not admins or session.username in admins)
 
 
 def to_float(value):
-    """ Convert a decimal represented as a string to a float.
+    """ Convert a decimal represented as a string to a float, nan and infinity are not accepted.
     """
     try:
-        return float(value)
+        value = float(value)
     except ValueError:
         return None
+    return value if math.isfinite(value) else None
 
 
-def to_string(value):
-    """ Convert a boolean to on/off as a string.
-    """
-    if value:
-        return "On"
-    else:
-        return "Off"
+def stop(signum, frame):
+    logger.info(signal.Signals(signum).name + ' received. Stopping server.')
+    sys.exit(0)
 
 
 if __name__ == "__main__":
-    app.run()
-    #web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", 8181))
+    # Changes to these settings take effect on restart.
+    server_settings = settings_file.load()
+    certificate, private_key = server_settings.get('tls-certificate'), server_settings.get('tls-private-key')
+    if certificate:
+        certificate, private_key = os.path.join(dirname, certificate), os.path.join(dirname, private_key)
+    server = create_server(app.wsgifunc(timing_middleware, limit_middleware),
+                           (server_settings['web-address'], server_settings['web-port']),
+                           server_settings['web-threads'], certificate, private_key)
+    signal.signal(signal.SIGTERM, stop)
+    logger.info('Serving on ' + ('https' if certificate else 'http') + '://' + server_settings['web-address'] + ':' +
+                str(server_settings['web-port']) + ' with ' + str(server_settings['web-threads']) + ' threads.')
+    timelapse_recorder.start()
+    try:
+        server.start()
+    except (KeyboardInterrupt, SystemExit):
+        # End the streams first so their workers are free to stop.
+        shutting_down.set()
+        timelapse_recorder.stop()
+        change_monitor.close()
+        camera_broadcaster.close()
+        server.stop()
+    logger.info('Server stopped.')
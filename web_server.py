@@ -0,0 +1,75 @@
+#
+# web_server
+#
+# Copyright (c) 2020 Daniel Dean <dd@danieldean.uk>.
+#
+# Licensed under The MIT License a copy of which you should have
+# received. If not, see:
+#
+# http://opensource.org/licenses/MIT
+#
+
+import threading
+import json
+from cheroot import wsgi
+from cheroot.ssl.builtin import BuiltinSSLAdapter
+import constants
+import metrics
+
+REQUESTS_REJECTED = metrics.Counter('requests_rejected_total', 'Requests refused for being over their limit.',
+                                    ('kind',))
+
+
+class RequestLimiter:
+    """ WSGI middleware keeping streams and regular requests to separate limits. A stream holds
+        a worker thread for as long as it is open so streams are refused once at their limit,
+        regular requests wait a short time for one in progress to finish. Keeping the limits
+        below the number of workers means open streams can never leave none for the dashboard.
+    """
+
+    def __init__(self, app, is_stream, max_streams, max_requests, wait):
+        self.app = app
+        self.is_stream = is_stream
+        self.streams = threading.BoundedSemaphore(max_streams)
+        self.requests = threading.BoundedSemaphore(max_requests)
+        self.wait = wait
+
+    def __call__(self, environ, start_response):
+        if self.is_stream(environ.get('PATH_INFO', '')):
+            kind, slots, acquired = 'stream', self.streams, self.streams.acquire(blocking=False)
+        else:
+            kind, slots, acquired = 'request', self.requests, self.requests.acquire(timeout=self.wait)
+        if not acquired:
+            REQUESTS_REJECTED.inc(kind)
+            # The same form as other errors so clients can read it the same way.
+            start_response('503 Service Unavailable', [('Content-Type', 'application/json'), ('Retry-After', '5')])
+            return [json.dumps({'ok': False, 'error': 'Too many ' + kind + 's, try again shortly.'}).encode()]
+        try:
+            body = self.app(environ, start_response)
+        except Exception:
+            slots.release()
+            raise
+        return self.limited_body(body, slots)
+
+    def limited_body(self, body, slots):
+        # Released once the body has been sent (or the client has gone).
+        try:
+            for chunk in body:
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            slots.release()
+
+
+def create_server(wsgi_app, address, threads, certificate=None, private_key=None):
+    """ Create a server with a fixed pool of worker threads, keeping connections alive between
+        requests and using TLS if given a certificate and private key.
+    """
+    server = wsgi.Server(address, wsgi_app, numthreads=threads, max=threads, server_name='Vivarium_CTRL',
+                         timeout=constants.WEB_TIMEOUT, shutdown_timeout=constants.WEB_SHUTDOWN_TIMEOUT)
+    server.nodelay = True
+    server.keep_alive_conn_limit = constants.WEB_KEEP_ALIVE_CONNECTIONS
+    if certificate:
+        server.ssl_adapter = BuiltinSSLAdapter(certificate, private_key)
+    return server